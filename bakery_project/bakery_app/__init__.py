@@ -2,15 +2,15 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_bcrypt import Bcrypt
-from flask_caching import Cache
 from flask_httpauth import HTTPTokenAuth
 from flask_marshmallow import Marshmallow
 from bakery_app.config import Config
-from bakery_app._helpers import CustomJSONEncoder
+from bakery_app._helpers import CustomJSONEncoder, Query
+from bakery_app.instrumentation.metrics import MeteredCache
 
-db = SQLAlchemy()
+db = SQLAlchemy(query_class=Query)
 bcrypt = Bcrypt()
-cache = Cache()
+cache = MeteredCache()
 ma = Marshmallow()
 login_manager = LoginManager()
 login_manager.login_view = 'users.login'
@@ -20,9 +20,8 @@ auth = HTTPTokenAuth(scheme='Bearer')
 
 def create_app(config_class=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
     app.config['JSON_SORT_KEYS'] = False
-    app.config['CACHE_TYPE'] = 'simple'
     app.json_encoder = CustomJSONEncoder
 
     db.init_app(app)
@@ -31,6 +30,9 @@ def create_app(config_class=Config):
     login_manager.init_app(app)
     ma.init_app(app)
 
+    from bakery_app._cache import master_data
+    master_data.init_app(app)
+
     from bakery_app.users.routes import users
     from bakery_app.items.routes import items
     from bakery_app.inventory.routes import inventory
@@ -45,6 +47,9 @@ def create_app(config_class=Config):
     from bakery_app.sap_num.routes import sap_num
     from bakery_app.reports.routes import reports
     from bakery_app.item_request.routes import item_request
+    from bakery_app.instrumentation.routes import instrumentation
+    from bakery_app.instrumentation.sql import sql_instrumentation
+    from bakery_app.instrumentation.metrics import metrics
 
     app.register_blueprint(users) 
     app.register_blueprint(items)
@@ -60,5 +65,8 @@ def create_app(config_class=Config):
     app.register_blueprint(sap_num)
     app.register_blueprint(reports)
     app.register_blueprint(item_request)
+    app.register_blueprint(instrumentation)
+    sql_instrumentation.init_app(app)
+    metrics.init_app(app, cache)
 
     return app
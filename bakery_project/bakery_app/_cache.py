@@ -0,0 +1,268 @@
+import inspect
+import time
+import types
+from collections import OrderedDict
+from threading import RLock
+
+from sqlalchemy import inspect as sa_inspect
+
+from bakery_app import cache
+from bakery_app._events import session_events
+from bakery_app.config import Config
+
+
+class LRUCache:
+    """Per-process, size-bounded LRU mapping with an optional TTL per entry.
+
+    Keeps hit/miss counters so the callers can expose the hit rate.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[1] if entry is not None else default
+
+    def discard_where(self, predicate):
+        """Remove every entry whose value matches the predicate"""
+        with self._lock:
+            keys = [k for k, (_, v) in self._data.items() if predicate(v)]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl,
+                    "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / total, 4) if total else None}
+
+    def __len__(self):
+        return len(self._data)
+
+
+def normalize_code(code):
+    # compare codes like the database collation, case and trailing space insensitive
+    return code.rstrip().lower() if isinstance(code, str) else code
+
+
+class MasterRecord:
+    """Detached, read-only copy of a master data row.
+
+    Plain methods of the model like Warehouses.is_cutoff() work on it too.
+    """
+    __slots__ = ('_model', '_values')
+
+    def __init__(self, model, values):
+        object.__setattr__(self, '_model', model)
+        object.__setattr__(self, '_values', values)
+
+    def __getattr__(self, name):
+        if name in self._values:
+            return self._values[name]
+        attr = getattr(self._model, name, None)
+        if inspect.isfunction(attr):
+            return types.MethodType(attr, self)
+        raise AttributeError(f"{self._model.__name__} record has no attribute '{name}'")
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Master data record is read-only.")
+
+    def __repr__(self):
+        return f"MasterRecord({self._model.__name__}, {self._values})"
+
+
+class MasterDataCache:
+    """Read-through cache of the master tables keyed by entity and code.
+
+    Records are kept per process, next to the entity version they were loaded
+    with. The versions live in the Flask-Caching store and are bumped when a
+    change to the entity is committed. Only a store shared by the workers,
+    redis or memcached, lets every worker see the bump, so the cache stays
+    off with the per process 'simple' store unless MASTER_CACHE_LOCAL says
+    the application runs in a single process. Off, every lookup reads the
+    database.
+    """
+    # Flask-Caching backends seen by every worker of a host
+    shared_backends = ('redis', 'rediscluster', 'redissentinel', 'memcached', 'saslmemcached',
+                       'filesystem')
+
+    def __init__(self, maxsize=10000, ttl=None):
+        self._local = LRUCache(maxsize=maxsize, ttl=ttl)
+        # model: (key columns, volatile columns)
+        self._entities = {}
+        self.enabled = False
+
+    def init_app(self, app):
+        # 'redis' or a class path like 'flask_caching.backends.RedisCache'
+        backend = app.config['CACHE_TYPE'].rsplit('.', 1)[-1].lower()
+        if backend.endswith('cache'):
+            backend = backend[:-len('cache')]
+        self.enabled = backend in self.shared_backends or app.config['MASTER_CACHE_LOCAL']
+        if not self.enabled:
+            app.logger.warning(f"Master data cache disabled, the '{app.config['CACHE_TYPE']}' "
+                               f"store is not shared by the workers.")
+
+    def register(self, model, *keys, volatile=()):
+        """Cache the model by the key columns.
+
+        Volatile columns, e.g. Series.next_num, are left out of the records and
+        changing them does not invalidate the entity.
+        """
+        self._entities[model] = (keys, frozenset(volatile))
+        session_events.listens_for('after_flush', model, 'new')(self._changed)
+        session_events.listens_for('after_flush', model, 'deleted')(self._changed)
+        session_events.listens_for('after_flush', model, 'dirty')(self._updated)
+
+    def _changed(self, sess, obj):
+        # collect the entities changed in the transaction, see master_data_commit
+        sess.info.setdefault('master_data_changed', set()).add(type(obj))
+
+    def _updated(self, sess, obj):
+        if self.has_changes(obj):
+            self._changed(sess, obj)
+
+    def is_registered(self, model):
+        return model in self._entities
+
+    @staticmethod
+    def _version_key(model):
+        return f"master_version:{model.__name__}"
+
+    def version(self, model):
+        if not self.enabled:
+            return None
+        version = cache.get(self._version_key(model))
+        if version is None:
+            # store lost or never set, start from a value no worker has seen
+            version = int(time.time() * 1000)
+            cache.set(self._version_key(model), version, timeout=0)
+        return version
+
+    def bump(self, model):
+        if not self.enabled:
+            return
+        key = self._version_key(model)
+        if cache.get(key) is None:
+            self.version(model)
+        else:
+            cache.cache.inc(key)
+
+    def _make_key(self, model, key):
+        return (model.__name__,) + tuple(normalize_code(k) for k in key)
+
+    def _record(self, model, obj):
+        _, volatile = self._entities[model]
+        values = {col.key: getattr(obj, col.key) for col in sa_inspect(model).column_attrs
+                  if col.key not in volatile}
+        return MasterRecord(model, values)
+
+    def _cached(self, model, key, version):
+        if not self.enabled:
+            return None
+        cache_key = self._make_key(model, key)
+        entry = self._local.get(cache_key)
+        if entry is None:
+            return None
+        if entry[0] != version:
+            # loaded before the last committed change
+            self._local.pop(cache_key)
+            return None
+        return entry[1]
+
+    def _store(self, model, obj, version):
+        keys, _ = self._entities[model]
+        record = self._record(model, obj)
+        if not self.enabled:
+            return record
+        key = tuple(getattr(obj, k) for k in keys)
+        self._local.set(self._make_key(model, key), (version, record))
+        return record
+
+    def get(self, model, *key):
+        """Return the record of the model with the key or None"""
+        version = self.version(model)
+        record = self._cached(model, key, version)
+        if record is None:
+            keys, _ = self._entities[model]
+            obj = model.query.filter_by(**dict(zip(keys, key))).first()
+            if obj is None:
+                return None
+            record = self._store(model, obj, version)
+        return record
+
+    def existing(self, model, codes):
+        """Return the normalized codes that exist, resolving the misses with one IN query"""
+        version = self.version(model)
+        found = set()
+        missing = set()
+        for code in codes:
+            if self._cached(model, (code,), version) is not None:
+                found.add(normalize_code(code))
+            else:
+                missing.add(code)
+        if missing:
+            (column,), _ = self._entities[model]
+            col = getattr(model, column)
+            for obj in model.query.filter(col.in_(missing)):
+                self._store(model, obj, version)
+                found.add(normalize_code(getattr(obj, column)))
+        return found
+
+    def has_changes(self, obj):
+        _, volatile = self._entities[type(obj)]
+        state = sa_inspect(obj)
+        return any(attr.history.has_changes() for attr in state.attrs
+                   if attr.key not in volatile)
+
+    def stats(self):
+        return self._local.stats()
+
+
+master_data = MasterDataCache(maxsize=Config.MASTER_CACHE_SIZE, ttl=Config.MASTER_CACHE_TTL)
+
+
+@session_events.on("after_commit")
+def master_data_commit(sess):
+    # bump only once the change is visible to the other workers
+    for model in sess.info.pop('master_data_changed', ()):
+        master_data.bump(model)
+
+
+@session_events.on("after_rollback")
+def master_data_rollback(sess):
+    sess.info.pop('master_data_changed', None)
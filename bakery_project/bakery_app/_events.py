@@ -0,0 +1,114 @@
+import time
+from collections import defaultdict
+from threading import Lock
+
+from sqlalchemy import event
+
+from bakery_app import db
+
+
+class SessionEvents:
+    """Single listener per session event that dispatches the objects by class.
+
+    The new, dirty and deleted objects of a flush are bucketed by mapped class
+    once and only the handlers registered for that class are called, with the
+    session and the object. Handlers registered with on() are called once per
+    event with the session only, after the class handlers.
+
+    Every handler call is counted and timed, see stats().
+    """
+    flush_events = ('before_flush', 'after_flush')
+    session_events = flush_events + ('before_commit', 'after_commit', 'after_rollback', 'after_transaction_end')
+    states = ('new', 'dirty', 'deleted')
+
+    def __init__(self, session):
+        # (event, state): [(model, handler)]
+        self._handlers = defaultdict(list)
+        # event: [handler]
+        self._session_handlers = defaultdict(list)
+        # (event, state, class): [handler], resolved with the class mro
+        self._resolved = {}
+        self._stats = {}
+        self._lock = Lock()
+        for name in self.session_events:
+            event.listen(session, name, self._listener(name))
+
+    def listens_for(self, event_name, model, state='new'):
+        """Register a handler(sess, obj) for the objects of the model"""
+        if event_name not in self.flush_events or state not in self.states:
+            raise ValueError(f"Invalid session event '{event_name}' / '{state}'")
+
+        def decorator(fn):
+            self._handlers[(event_name, state)].append((model, fn))
+            self._resolved.clear()
+            return fn
+        return decorator
+
+    def on(self, event_name):
+        """Register a handler(sess) called once per event"""
+        if event_name not in self.session_events:
+            raise ValueError(f"Invalid session event '{event_name}'")
+
+        def decorator(fn):
+            self._session_handlers[event_name].append(fn)
+            return fn
+        return decorator
+
+    def _handlers_for(self, event_name, state, cls):
+        key = (event_name, state, cls)
+        handlers = self._resolved.get(key)
+        if handlers is None:
+            handlers = [fn for model, fn in self._handlers[(event_name, state)]
+                        if issubclass(cls, model)]
+            self._resolved[key] = handlers
+        return handlers
+
+    def _listener(self, event_name):
+        def listener(sess, *args):
+            if event_name in self.flush_events:
+                for state in self.states:
+                    self._dispatch(event_name, state, sess)
+            for fn in self._session_handlers[event_name]:
+                self._call(fn, sess)
+        listener.__name__ = f"dispatch_{event_name}"
+        return listener
+
+    def _dispatch(self, event_name, state, sess):
+        if not self._handlers[(event_name, state)]:
+            return
+        # bucket the objects by class, one pass over the identity set
+        buckets = defaultdict(list)
+        for obj in getattr(sess, state):
+            buckets[type(obj)].append(obj)
+
+        for cls, objs in buckets.items():
+            for fn in self._handlers_for(event_name, state, cls):
+                for obj in objs:
+                    self._call(fn, sess, obj)
+
+    def _call(self, fn, sess, *args):
+        start = time.perf_counter()
+        try:
+            return fn(sess, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            name = f"{fn.__module__}.{fn.__name__}"
+            with self._lock:
+                stat = self._stats.setdefault(name, {'calls': 0, 'seconds': 0.0})
+                stat['calls'] += 1
+                stat['seconds'] += elapsed
+
+    def stats(self):
+        """Per handler call count, total and average milliseconds"""
+        with self._lock:
+            return {name: {'calls': s['calls'],
+                           'total_ms': round(s['seconds'] * 1000, 3),
+                           'avg_ms': round(s['seconds'] * 1000 / s['calls'], 3) if s['calls'] else 0}
+                    for name, s in sorted(self._stats.items())}
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+
+session_events = SessionEvents(db.session)
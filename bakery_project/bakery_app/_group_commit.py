@@ -0,0 +1,110 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from flask import current_app
+
+from bakery_app import db
+from bakery_app._idempotency import current_key, mark_committed
+
+
+class GroupCommitQueue:
+    """In-process queue per key, e.g. warehouse, drained by a single writer.
+
+    The writer takes the jobs that arrive within max_wait_ms of the first
+    one, up to max_batch, and runs each in its own savepoint of one
+    transaction. A failing job rolls back only its savepoint and gets its own
+    error, the others are committed together. Terminals of a warehouse then
+    take the WhseInv and customer row locks once per batch instead of once
+    per document.
+    """
+
+    def __init__(self, max_batch=20, max_wait_ms=20, timeout=30, enabled=False):
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max_wait_ms / 1000
+        self.timeout = timeout
+        self.enabled = enabled
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args):
+        """Run fn(*args) in the writer of the key, return its result or raise its error.
+
+        fn must flush its changes and return a result that does not need the
+        session, e.g. a dumped schema. The Idempotency-Key of the request is
+        flagged in the savepoint of its job.
+        """
+        future = Future()
+        self._queue(key).put((fn, args, future, current_key()))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            if future.cancel():
+                raise Exception("Posting queue is busy, please try again!")
+            # already running, its outcome is the answer
+            return future.result()
+
+    def _queue(self, key):
+        with self._lock:
+            jobs = self._queues.get(key)
+            if jobs is None:
+                jobs = self._queues[key] = queue.Queue()
+                app = current_app._get_current_object()
+                threading.Thread(target=self._writer, args=(app, jobs), daemon=True,
+                                 name=f"group-commit-{key}").start()
+            return jobs
+
+    def _batch(self, jobs):
+        batch = [jobs.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(jobs.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _writer(self, app, jobs):
+        while True:
+            batch = self._batch(jobs)
+            with app.app_context():
+                try:
+                    self._commit(batch)
+                finally:
+                    db.session.remove()
+
+    def _commit(self, batch):
+        from bakery_app.branches.models import series_allocator
+
+        sess = db.session()
+        done = []
+        for fn, args, future, key_id in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            numbers = len(sess.info.get('series_numbers', ()))
+            try:
+                with sess.begin_nested():
+                    result = fn(*args)
+                    if key_id is not None:
+                        mark_committed(sess, key_id)
+                done.append((future, result))
+            except Exception as err:
+                # the numbers of the job are not used, the batch may still commit
+                allocated = sess.info.get('series_numbers', [])
+                series_allocator.rolled_back(allocated[numbers:])
+                del allocated[numbers:]
+                future.set_exception(err)
+
+        try:
+            sess.commit()
+        except Exception as err:
+            sess.rollback()
+            for future, _ in done:
+                future.set_exception(err)
+            return
+        for future, result in done:
+            future.set_result(result)
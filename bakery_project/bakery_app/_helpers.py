@@ -1,27 +1,81 @@
+import base64
 import datetime
+import json
 from flask.json import JSONEncoder
+from flask_sqlalchemy import BaseQuery as _FlaskQuery
 from decimal import Decimal
-from sqlalchemy import and_, or_, inspect
+from sqlalchemy import and_, or_, inspect, func, DateTime
 from functools import wraps
 from sqlalchemy.orm import Session
 
+from bakery_app.config import Config
 
-class fakefloat(float):
-    def __init__(self, value):
-        self._value = value
+try:
+    import orjson
+except ImportError:  # optional, the responses are encoded with the json module without it
+    orjson = None
 
-    def __repr__(self):
-        return str(self._value)
+
+def json_default(o):
+    # Decimal as a JSON number, the datetimes in ISO 8601
+    if isinstance(o, Decimal):
+        return float(o)
+    if isinstance(o, (datetime.date, datetime.datetime)):
+        return o.isoformat()
+    raise TypeError(repr(o) + " is not JSON serializable")
 
 
 class CustomJSONEncoder(JSONEncoder):
     def default(self, o):
-        if isinstance(o, Decimal):
-            # Subclass float with custom repr?
-            return fakefloat(o)
-        if isinstance(o, (datetime.date, datetime.datetime)):
-            return o.isoformat()
-        raise TypeError(repr(o) + " is not JSON serializable")
+        return json_default(o)
+
+
+def _json_dumps(obj, sort_keys=True):
+    return json.dumps(obj, default=json_default, sort_keys=sort_keys, separators=(',', ':')).encode()
+
+
+def _orjson_dumps(obj, sort_keys=True):
+    # datetime and date are native, in the same ISO format as isoformat()
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return orjson.dumps(obj, default=json_default, option=option)
+
+
+json_backends = {'json': _json_dumps}
+if orjson is not None:
+    json_backends['orjson'] = _orjson_dumps
+
+
+def json_dumps(obj, sort_keys=True):
+    """Encode to JSON bytes with the JSON_BACKEND, the json module when it is not installed"""
+    return json_backends.get(Config.JSON_BACKEND, _json_dumps)(obj, sort_keys=sort_keys)
+
+
+def dump_options(schema):
+    """Return the loader options of the nested relationships the schema dumps.
+
+    The schemas declare the loader of their nested relationships in
+    relationship_loaders, e.g. {'transrow': selectinload}. Only the nested
+    fields left by only/exclude are loaded, and the options of the nested
+    schema are chained to their relationship.
+    """
+    model = schema.opts.model
+    options = []
+    for name, loader in getattr(schema, 'relationship_loaders', {}).items():
+        field = schema.dump_fields.get(name)
+        if field is None:
+            continue
+        option = loader(getattr(model, field.attribute or name))
+        nested = dump_options(field.schema) if hasattr(field, 'schema') else []
+        options.append(option.options(*nested) if nested else option)
+    return options
+
+
+class Query(_FlaskQuery):
+    """Query class of the session and the models, see SQLAlchemy(query_class=)"""
+
+    def for_dump(self, schema):
+        """Eager load the relationships dumped by the schema, instead of one lazy load per row"""
+        return self.options(*dump_options(schema))
 
 
 dict_filtros_op = {
@@ -33,7 +87,8 @@ dict_filtros_op = {
     '<=': 'le',
     'like': 'like',
     'ilike': 'ilike',
-    'in': 'in'
+    'in': 'in',
+    'on': 'on'
 }
 
 db_session = Session()
@@ -90,6 +145,8 @@ class BaseQuery():
                     raise Exception('Invalid filter column: %s' % column_name)
                 if dict_filtros_op[op] == 'in':
                     filt.append(column.in_(value))
+                elif dict_filtros_op[op] == 'on':
+                    filt_aux.append(cls.on_date(column, value))
                 else:
                     try:
                         attr = \
@@ -109,6 +166,31 @@ class BaseQuery():
                 raise Exception('Invalid filter condition: %s' % condition)
         return filt
 
+    @staticmethod
+    def on_date(column, value):
+        '''
+        return the sargable filter of the rows of a day, the half open range
+        column >= day and column < next day instead of cast(column, DATE) == day,
+        so the index on the column can be used
+        Args:
+            column: datetime column
+            value: date, datetime or 'YYYY-MM-DD' string, None or '' match
+                   the rows without a date, as the cast comparison did
+        Returns:
+            filt: sqlalchemy filter
+         '''
+        if value is None or value == '':
+            return column.is_(None)
+        if isinstance(value, datetime.datetime):
+            value = value.date()
+        elif isinstance(value, str):
+            try:
+                value = datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+            except ValueError:
+                raise Exception('Invalid date: %s' % value)
+        day = datetime.datetime.combine(value, datetime.time.min)
+        return and_(column >= day, column < day + datetime.timedelta(days=1))
+
     @classmethod
     def create_query_columns(cls, model, columns):
         '''
@@ -130,6 +212,117 @@ class BaseQuery():
                 raise Exception('Invalid column name %s' % column)
             cols.append(attr)
         return cols
+
+
+class KeysetPagination:
+    """Opt in keyset pagination of a get_all list.
+
+    Takes the limit, cursor and total arguments out of the request args. The
+    list is ordered by the key columns, the last one being the primary key,
+    and a page starts after the keys of the previous page's last row, so
+    every page costs the same however deep it is. Without limit nor cursor
+    the whole list is returned like before.
+
+    The headers are selected with the primary key IN the filtered query, so
+    the joins of the filters do not return a header once per matching row.
+    """
+
+    def __init__(self, args, *keys, desc=True):
+        self.keys = keys
+        self.desc = desc
+        self.limit = args.pop('limit', None)
+        self.cursor = args.pop('cursor', None)
+        self.with_total = args.pop('total', '').lower() in ('1', 'true', 'yes')
+        self.next_cursor = None
+        self.total = None
+
+    @property
+    def enabled(self):
+        return bool(self.limit or self.cursor)
+
+    def encode(self, obj):
+        values = [getattr(obj, key.key) for key in self.keys]
+        data = json.dumps([v.isoformat() if isinstance(v, datetime.datetime) else v for v in values])
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.keys):
+                raise ValueError
+            return [datetime.datetime.fromisoformat(v) if isinstance(key.type, DateTime) and v else v
+                    for key, v in zip(self.keys, values)]
+        except (ValueError, TypeError):
+            raise Exception('Invalid cursor: %s' % cursor)
+
+    def _after(self, values):
+        # (k1, k2) < (v1, v2) spelled out, SQL Server has no row value comparison
+        clauses = []
+        for i, key in enumerate(self.keys):
+            ahead = key < values[i] if self.desc else key > values[i]
+            clauses.append(and_(*[self.keys[j] == values[j] for j in range(i)], ahead))
+        return or_(*clauses)
+
+    def select(self, query, unique=True, schema=None):
+        """Return the whole list query, one row per key and ordered by the keys.
+
+        unique=False for the queries returning one row per key already. The
+        relationships dumped by the schema are eager loaded.
+        """
+        pk = self.keys[-1]
+        if self.with_total:
+            self.total = query.with_entities(func.count(pk.distinct())).order_by(None).scalar()
+        if unique:
+            query = query.session.query(pk.class_).filter(
+                pk.in_(query.with_entities(pk).order_by(None).as_scalar()))
+        if schema is not None:
+            query = query.for_dump(schema)
+        return query.order_by(None).order_by(*[key.desc() if self.desc else key.asc() for key in self.keys])
+
+    def all(self, query, unique=True, schema=None):
+        """Return the rows of the page, or every row when not paginated"""
+        query = self.select(query, unique=unique, schema=schema)
+        if not self.enabled:
+            return query.all()
+
+        try:
+            limit = int(self.limit) if self.limit else Config.PAGE_SIZE_MAX
+        except ValueError:
+            raise Exception('Invalid limit: %s' % self.limit)
+        limit = max(1, min(limit, Config.PAGE_SIZE_MAX))
+        if self.cursor:
+            query = query.filter(self._after(self.decode(self.cursor)))
+        rows = query.limit(limit + 1).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            self.next_cursor = self.encode(rows[-1])
+        return rows
+
+    def stream(self, query, unique=True, schema=None, chunk=500):
+        """Yield every row of the list, fetched chunk by chunk when iterated.
+
+        Each chunk is a whole query, its cursor is closed before the eager
+        loaders of the schema run, the driver has a single result open at a
+        time. The chunks after the first start after the keys of the last row.
+        """
+        query = self.select(query, unique=unique, schema=schema)
+        after = None
+        while True:
+            rows = (query.filter(self._after(after)) if after else query).limit(chunk).all()
+            yield from rows
+            if len(rows) < chunk:
+                return
+            after = [getattr(rows[-1], key.key) for key in self.keys]
+
+    def meta(self):
+        meta = {}
+        if self.enabled:
+            meta['next_cursor'] = self.next_cursor
+        if self.total is not None:
+            meta['total'] = self.total
+        return meta
+
+
 # check the changes
 def get_model_changes(model):
     """
@@ -0,0 +1,161 @@
+import hashlib
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, g, has_request_context, make_response, request
+from sqlalchemy import and_, exc
+
+from bakery_app import db
+from bakery_app._events import session_events
+from bakery_app._utils import ResponseMessage
+from bakery_app.config import Config
+
+
+class IdempotencyKey(db.Model):
+    """Response of a document creating request, replayed for the retries with the same key"""
+    __tablename__ = "tblidempotency"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    idem_key = db.Column(db.String(100), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    # None while the first request is running, 0 once its document is committed
+    status_code = db.Column(db.Integer)
+    response = db.Column(db.Text)
+    date_created = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    expires = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'idem_key', name='uq_idempotency_key'),)
+
+    @classmethod
+    def purge(cls, limit=5000):
+        """Delete up to limit expired keys, return the number deleted"""
+        table = cls.__table__
+        with db.engine.begin() as conn:
+            ids = [row.id for row in conn.execute(
+                db.select([table.c.id]).where(table.c.expires < datetime.now()).limit(limit))]
+            if ids:
+                conn.execute(table.delete().where(table.c.id.in_(ids)))
+        return len(ids)
+
+
+def _request_hash():
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _lookup(conn, user_id, key):
+    table = IdempotencyKey.__table__
+    return conn.execute(db.select([table]).where(
+        and_(table.c.user_id == user_id, table.c.idem_key == key))).first()
+
+
+def _replay(entry):
+    response = current_app.response_class(entry.response, status=entry.status_code,
+                                          mimetype=current_app.config['JSONIFY_MIMETYPE'])
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(user_id, key, request_hash):
+    """Insert the pending key, return its id or None and the entry found"""
+    table = IdempotencyKey.__table__
+    now = datetime.now()
+    try:
+        # its own transaction, visible to the retries while the request runs
+        with db.engine.begin() as conn:
+            entry = _lookup(conn, user_id, key)
+            if entry is not None:
+                # still pending, the first request can no longer commit once its key is gone
+                abandoned = entry.status_code is None and \
+                    entry.date_created < now - timedelta(seconds=Config.IDEMPOTENCY_PENDING_TIMEOUT)
+                if entry.expires > now and not abandoned:
+                    return None, entry
+                conn.execute(table.delete().where(table.c.id == entry.id))
+            key_id = conn.execute(table.insert().values(
+                user_id=user_id, idem_key=key, request_hash=request_hash, date_created=now,
+                expires=now + timedelta(hours=Config.IDEMPOTENCY_TTL_HOURS))).inserted_primary_key[0]
+    except exc.IntegrityError:
+        # a concurrent retry claimed it first
+        with db.engine.connect() as conn:
+            return None, _lookup(conn, user_id, key)
+    return key_id, None
+
+
+def current_key():
+    """Id of the key claimed by the current request, None without one"""
+    return g.get('idempotency_key_id') if has_request_context() else None
+
+
+def mark_committed(sess, key_id):
+    """Flag the key in the transaction that commits its document.
+
+    Fails when a retry took the key over, the document must not be committed.
+    """
+    table = IdempotencyKey.__table__
+    result = sess.execute(table.update().where(table.c.id == key_id).values(status_code=0))
+    if result.rowcount != 1:
+        raise Exception("Idempotency-Key taken over by a retry, nothing was posted!")
+
+
+@session_events.on("before_commit")
+def mark_key_committed(sess):
+    key_id = current_key()
+    if key_id is not None:
+        mark_committed(sess, key_id)
+
+
+def _release(key_id, response):
+    table = IdempotencyKey.__table__
+    with db.engine.begin() as conn:
+        # the document is committed, whatever the response its retries get it
+        result = conn.execute(table.update().where(and_(table.c.id == key_id, table.c.status_code == 0)).values(
+            status_code=response.status_code, response=response.get_data(as_text=True)))
+        if result.rowcount == 0:
+            # nothing committed, the retry runs the request again
+            conn.execute(table.delete().where(and_(table.c.id == key_id, table.c.status_code.is_(None))))
+
+
+def idempotent(f):
+    """Replay the stored response of a POST retried with the same Idempotency-Key header.
+
+    Goes below token_required, the keys are per user. The key is flagged in
+    the transaction that commits the document, a retry never runs the view
+    again once it is, no series number is taken and nothing is posted twice.
+    The responses of the committed requests are kept for IDEMPOTENCY_TTL_HOURS,
+    the key of a request that committed nothing is released for its retry.
+    """
+    @wraps(f)
+    def decorated(curr_user, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key or request.method != 'POST':
+            return f(curr_user, *args, **kwargs)
+        if len(key) > 100:
+            return ResponseMessage(False, message="Invalid Idempotency-Key!").resp(), 400
+
+        request_hash = _request_hash()
+        key_id, entry = _claim(curr_user.id, key, request_hash)
+        if key_id is None:
+            if entry is not None and entry.request_hash != request_hash:
+                return ResponseMessage(False, message="Idempotency-Key already used by another request!").resp(), 422
+            if entry is not None and entry.status_code == 0:
+                # committed, the response is stored when the request ends
+                return ResponseMessage(False, message="The request with this Idempotency-Key is posted, "
+                                                      "its response is not stored yet!").resp(), 409
+            if entry is None or entry.status_code is None:
+                return ResponseMessage(False, message="A request with this Idempotency-Key is in progress!").resp(), 409
+            return _replay(entry)
+
+        g.idempotency_key_id = key_id
+        try:
+            response = make_response(f(curr_user, *args, **kwargs))
+        except Exception:
+            _release(key_id, current_app.response_class(status=500))
+            raise
+        finally:
+            g.pop('idempotency_key_id', None)
+        _release(key_id, response)
+        return response
+
+    return decorated
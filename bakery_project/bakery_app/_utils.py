@@ -1,4 +1,10 @@
-from flask import jsonify
+import csv
+import io
+from functools import partial
+
+from flask import Response, current_app, stream_with_context
+from bakery_app._cache import master_data, normalize_code
+from bakery_app._helpers import json_dumps
 from bakery_app.branches.models import Warehouses, Branch
 from bakery_app.items.models import (Items, ItemGroup, UnitOfMeasure)
 
@@ -10,7 +16,7 @@ class Check():
             setattr(self, k, v)
 
     def itemcode_exist(self):
-        if Items.query.filter_by(item_code=self.item_code).first():
+        if master_data.get(Items, self.item_code):
             return True
         return False
 
@@ -20,45 +26,116 @@ class Check():
         return False
 
     def uom_exist(self):
-        if UnitOfMeasure.query.filter_by(code=self.uom).first():
+        if master_data.get(UnitOfMeasure, self.uom):
             return True
         return False
 
     def itemgroup_exist(self):
-        if ItemGroup.query.filter_by(code=self.item_group).first():
+        if master_data.get(ItemGroup, self.item_group):
             return True
         return False
 
     def fromwhse_exist(self):
-        if Warehouses.query.filter_by(whsecode=self.from_whse).first():
+        if master_data.get(Warehouses, self.from_whse):
             return True
         return False
 
     def towhse_exist(self):
-        if Warehouses.query.filter_by(whsecode=self.to_whse).first():
+        if master_data.get(Warehouses, self.to_whse):
             return True
         return False
 
     def whsecode_exist(self):
-        if Warehouses.query.filter_by(whsecode=self.whsecode).first():
+        if master_data.get(Warehouses, self.whsecode):
             return True
         return False
 
     def branch_exist(self, code):
-        if Branch.query.filter_by(code=code).first():
+        if master_data.get(Branch, code):
             return True
         return False
 
 
+class DocumentCheck():
+    """Validate all the rows of a document at once.
+
+    Every code referenced by the rows is resolved through the master data
+    cache, the misses with one IN query per table instead of one query per
+    check per row like Check.
+    """
+    # check name: (row key, model, error message)
+    checks = {
+        'itemcode': ('item_code', Items, "Invalid item code!"),
+        'uom': ('uom', UnitOfMeasure, "Invalid uom!"),
+        'itemgroup': ('item_group', ItemGroup, "Invalid item group!"),
+        'fromwhse': ('from_whse', Warehouses, "Invalid from whse code!"),
+        'towhse': ('to_whse', Warehouses, "Invalid to whse code!"),
+        'whsecode': ('whsecode', Warehouses, "Invalid whsecode!"),
+        'branch': ('branch', Branch, "Invalid branch code!"),
+    }
+
+    def __init__(self, rows):
+        self.rows = rows
+        # model: normalized codes that exist / codes already resolved
+        self._found = {}
+        self._resolved = {}
+
+    def _resolve(self, names):
+        wanted = {}
+        for name in names:
+            key, model, _ = self.checks[name]
+            codes = wanted.setdefault(model, set())
+            codes.update(row[key] for row in self.rows if row.get(key))
+
+        for model, codes in wanted.items():
+            resolved = self._resolved.setdefault(model, set())
+            codes = codes - resolved
+            if codes:
+                self._found.setdefault(model, set()).update(master_data.existing(model, codes))
+                resolved.update(codes)
+
+    def exists(self, name, row):
+        key, model, _ = self.checks[name]
+        self._resolve([name])
+        return normalize_code(row.get(key)) in self._found.get(model, ())
+
+    def mark_exists(self, name, row):
+        # for codes added by the document itself, e.g. new items
+        key, model, _ = self.checks[name]
+        self._found.setdefault(model, set()).add(normalize_code(row.get(key)))
+
+    def errors(self, *names):
+        """Return a list of error messages for each row"""
+        self._resolve(names)
+        result = []
+        for row in self.rows:
+            row_errors = []
+            for name in names:
+                key, model, message = self.checks[name]
+                if normalize_code(row.get(key)) not in self._found.get(model, ()):
+                    row_errors.append(message)
+            result.append(row_errors)
+        return result
+
+    def first_error(self, *names):
+        """Return the first error message of the document or None"""
+        for row_errors in self.errors(*names):
+            if row_errors:
+                return row_errors[0]
+        return None
+
+
 class ResponseMessage:
     """First argument is success = True or False"""
 
-    def __init__(self, success, message=None, data=None, token=None, count=None):
+    def __init__(self, success, message=None, data=None, token=None, count=None, page=None):
         self.success = success
         self.message = message
         self.data = data
         self.token = token
         self.count = count
+        # KeysetPagination of the data, adds next_cursor and total
+        self.page = page
 
     def resp(self):
         payload = {"success": self.success}
@@ -67,5 +144,69 @@ class ResponseMessage:
         payload["data"] = self.data
         if self.token:
             payload["token"] = self.token
-        response = jsonify(payload)
+        if self.page is not None:
+            payload.update(self.page.meta())
+        # like jsonify, with the JSON_BACKEND encoder
+        response = current_app.response_class(
+            json_dumps(payload, sort_keys=current_app.config['JSON_SORT_KEYS']) + b'\n',
+            mimetype=current_app.config['JSONIFY_MIMETYPE'])
+        return response
+
+
+class StreamResponse:
+    """Rows written to the response one at a time as they are fetched.
+
+    Selected with ?format=ndjson or ?format=csv, the rows are never held in
+    memory all at once. The ORM lists come in chunks from
+    KeysetPagination.stream, statements are executed inside the stream, when
+    the response body is written.
+    """
+    formats = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+    def __init__(self, args):
+        # popped so the list filters do not see it, any other format is the JSON payload
+        fmt = args.pop('format', None)
+        self.format = fmt if fmt in self.formats else None
+
+    @property
+    def enabled(self):
+        return self.format is not None
+
+    def _rows(self, rows):
+        if callable(rows):
+            return rows()
+        return rows
+
+    def _ndjson(self, items):
+        for item in items:
+            yield json_dumps(item, sort_keys=False) + b'\n'
+
+    def _csv(self, items):
+        buffer = io.StringIO()
+        writer = None
+        for item in items:
+            if writer is None:
+                writer = csv.DictWriter(buffer, fieldnames=list(item))
+                writer.writeheader()
+            writer.writerow({k: json_dumps(v).decode() if isinstance(v, (dict, list)) else v
+                             for k, v in item.items()})
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    def resp(self, rows, schema=None, dump=dict, filename='data'):
+        """Stream the rows of an iterable, or of a callable returning a result.
+
+        Each row is dumped with the schema, a many=True schema is fine, or
+        with the dump function.
+        """
+        if schema is not None:
+            dump = partial(schema.dump, many=False)
+
+        def generate():
+            items = (dump(row) for row in self._rows(rows))
+            yield from getattr(self, f"_{self.format}")(items)
+
+        response = Response(stream_with_context(generate()), mimetype=self.formats[self.format])
+        response.headers['Content-Disposition'] = f"attachment; filename={filename}.{self.format}"
         return response
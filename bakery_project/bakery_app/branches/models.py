@@ -1,6 +1,12 @@
+import atexit
+from collections import namedtuple
 from datetime import datetime
-from sqlalchemy import event
+from threading import Lock
+
 from bakery_app import db
+from bakery_app.config import Config
+from bakery_app._cache import master_data
+from bakery_app._events import session_events
 from bakery_app.items.models import Items
 from bakery_app.inventory.models import WhseInv
 
@@ -45,6 +51,11 @@ class Warehouses(db.Model):
     def is_cutoff(self):
         return self.cutoff
 
+    @classmethod
+    def cutoff_of(cls, whsecode):
+        # read from the database, the posting gates never trust a cached copy
+        return db.session.query(cls.cutoff).filter(cls.whsecode == whsecode).scalar()
+
     def __repr__(self):
         return f"Warehouses('{self.whsecode}', '{self.whsename}'"
 
@@ -92,17 +103,157 @@ class Series(db.Model):
             '{self.start_num}', '{self.next_num}', '{self.end_num}'"
 
 
-@event.listens_for(db.session, "after_flush")
-def insert_update(*args):
-    sess = args[0]
-    for obj in sess.new:
-
-        # Insert Warehouse to WhseInv
-        if isinstance(obj, Warehouses):
-            items = Items.query.all()
-            for i in items:
-                whseinv = WhseInv(item_code=i.item_code, warehouse=obj.whsecode,
-                                  created_by=obj.created_by, updated_by=obj.updated_by)
-                db.session.add(whseinv)
-        else:
-            continue
+class SeriesGap(db.Model):
+    """Series numbers that were reserved but never used by a document"""
+    __tablename__ = "tblseries_gap"
+
+    id = db.Column(db.Integer, primary_key=True)
+    series = db.Column(db.Integer, db.ForeignKey('tblseries.id', ondelete='CASCADE'), nullable=False)
+    seriescode = db.Column(db.String(50), nullable=False)
+    whsecode = db.Column(db.String(100), nullable=False)
+    objtype = db.Column(db.Integer, nullable=False)
+    start_num = db.Column(db.Integer, nullable=False)
+    end_num = db.Column(db.Integer, nullable=False)  # inclusive
+    reason = db.Column(db.String(50), nullable=False)  # rollback / unused
+    date_created = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+
+class SeriesError(Exception):
+    pass
+
+
+SeriesNumber = namedtuple('SeriesNumber', ['series', 'seriescode', 'objtype', 'transnumber', 'reference'])
+
+
+class SeriesAllocator:
+    """Hands out document numbers from blocks reserved per worker process.
+
+    A block of SERIES_BLOCK_SIZE numbers is reserved with a compare and swap of
+    Series.next_num in its own short transaction, so the series row is not
+    locked until the document is committed. The numbers of a block are then
+    given out in memory. Numbers of a rolled back document and the rest of the
+    blocks left when the process exits are recorded in SeriesGap.
+    """
+    retries = 5
+
+    def __init__(self, block_size=1):
+        self.block_size = max(block_size, 1)
+        # (whsecode, objtype): [next number, end of block (exclusive), series, version]
+        self._blocks = {}
+        self._lock = Lock()
+        self._engine = None
+
+    def allocate(self, whse, objcode):
+        """Return the next SeriesNumber of the warehouse document type"""
+        obj = master_data.get(ObjectType, objcode)
+        if not obj:
+            raise SeriesError("Invalid object type!")
+        series = master_data.get(Series, whse, obj.objtype)
+        if not series:
+            raise SeriesError("Invalid series!")
+
+        version = master_data.version(Series)
+        key = (series.whsecode, series.objtype)
+        with self._lock:
+            block = self._blocks.get(key)
+            if block and block[3] != version:
+                # the series was changed, start from the database again
+                self._record_gaps([(block[2], block[0], block[1] - 1, 'unused')])
+                block = None
+            if not block or block[0] >= block[1]:
+                start, end = self._reserve(series)
+                block = self._blocks[key] = [start, end, series, version]
+            number = block[0]
+            block[0] += 1
+
+        num = SeriesNumber(series=series.id, seriescode=series.code, objtype=obj.objtype,
+                           transnumber=number, reference=f"{series.code}-{obj.code}-{number}")
+        # recorded as gap if the transaction ends without commit
+        db.session().info.setdefault('series_numbers', []).append((series, number))
+        return num
+
+    def _reserve(self, series):
+        self._engine = db.engine
+        table = Series.__table__
+        for _ in range(self.retries):
+            with self._engine.begin() as conn:
+                next_num, end_num = conn.execute(
+                    db.select([table.c.next_num, table.c.end_num]).where(table.c.id == series.id)).first()
+                if next_num + 1 > end_num:
+                    raise SeriesError("Series number already in max!")
+                end = min(next_num + self.block_size, end_num)
+                result = conn.execute(table.update().where(
+                    db.and_(table.c.id == series.id, table.c.next_num == next_num)).values(next_num=end))
+                if result.rowcount == 1:
+                    return next_num, end
+        raise SeriesError("Series is busy, please try again!")
+
+    def _record_gaps(self, gaps):
+        if not gaps or self._engine is None:
+            return
+        with self._engine.begin() as conn:
+            conn.execute(SeriesGap.__table__.insert(), [
+                {'series': series.id, 'seriescode': series.code, 'whsecode': series.whsecode,
+                 'objtype': series.objtype, 'start_num': start, 'end_num': end,
+                 'reason': reason, 'date_created': datetime.now()}
+                for series, start, end, reason in gaps])
+
+    def rolled_back(self, numbers):
+        self._record_gaps([(series, number, number, 'rollback') for series, number in numbers])
+
+    def release(self):
+        """Record the unused numbers of the reserved blocks"""
+        with self._lock:
+            gaps = [(series, start, end - 1, 'unused')
+                    for start, end, series, _ in self._blocks.values() if start < end]
+            self._blocks.clear()
+        self._record_gaps(gaps)
+
+
+series_allocator = SeriesAllocator(block_size=Config.SERIES_BLOCK_SIZE)
+
+
+@atexit.register
+def release_series_blocks():
+    try:
+        series_allocator.release()
+    except Exception:
+        # the database may be gone already while exiting
+        pass
+
+
+@session_events.on("after_commit")
+def series_numbers_commit(sess):
+    sess.info.pop('series_numbers', None)
+
+
+@session_events.on("after_transaction_end")
+def series_numbers_rollback(sess):
+    # the outermost transaction ended without commit, rolled back or closed
+    if sess.transaction is not None:
+        return
+    numbers = sess.info.pop('series_numbers', None)
+    if numbers:
+        series_allocator.rolled_back(numbers)
+
+
+master_data.register(Branch, 'code')
+master_data.register(Warehouses, 'whsecode')
+master_data.register(ObjectType, 'code')
+master_data.register(Series, 'whsecode', 'objtype', volatile=('next_num',))
+
+
+# Insert Warehouse to WhseInv, one INSERT ... SELECT of all the items
+@session_events.listens_for("after_flush", Warehouses)
+def insert_update(sess, obj):
+    if Config.WHSEINV_SPARSE:
+        # the rows are created by the first stock movement
+        return
+    items = Items.__table__
+    sess.execute(WhseInv.__table__.insert().from_select(
+        ['item_code', 'warehouse', 'quantity', 'created_by', 'updated_by'],
+        db.select([items.c.item_code,
+                   db.literal(obj.whsecode, WhseInv.warehouse.type),
+                   db.literal(0.0, WhseInv.quantity.type),
+                   db.literal(obj.created_by, WhseInv.created_by.type),
+                   db.literal(obj.updated_by, WhseInv.updated_by.type)])))
@@ -4,8 +4,9 @@ import pyodbc
 from sqlalchemy.exc import IntegrityError, DataError
 from sqlalchemy import or_, and_
 from bakery_app import db
+from bakery_app._cache import master_data
 from bakery_app._helpers import BaseQuery
-from bakery_app._utils import Check, ResponseMessage
+from bakery_app._utils import Check, DocumentCheck, ResponseMessage
 from bakery_app.users.routes import token_required
 from bakery_app.sales.models import SalesHeader, SalesRow
 from bakery_app.inventory_count.models import CountingInventoryHeader, CountingInventoryRow
@@ -33,25 +34,26 @@ def new_warehouse(curr_user):
     success = []
     unsuccess = []
     try:
+        check = DocumentCheck(data)
         for row in data:
             if not row['whsecode'] or not row['whsename'] or not row['branch']:
                 raise Exception("Missing required field!")
 
-            check = Check(**row)
             # initialize dictionary to append in success or unsuccess list
             d = {}
             id = row['whsecode']
             d[id] = []
 
-            if check.whsecode_exist():
+            if check.exists('whsecode', row):
                 raise Exception(f"Warehouse code '{row['whsecode']}' is already exists!")
-            if not check.branch_exist(row['branch']):
+            if not check.exists('branch', row):
                 raise Exception(f"Branch code '{row['branch']}' doesnt exist!")
 
             whse = Warehouses(**row)
             whse.created_by = user.id
             whse.updated_by = user.id
 
+            check.mark_exists('whsecode', row)
             success.append(d)
             db.session.add(whse)
 
@@ -583,7 +585,7 @@ def new_series(curr_user):
         return response.resp()
 
     try:
-        if not Warehouses.query.filter_by(whsecode=whsecode).first():
+        if not master_data.get(Warehouses, whsecode):
             raise Exception("Invalid whsecode")
         if Series.query.filter_by(code=code, objtype=objtype).first():
             raise Exception("Already exist!")
@@ -11,4 +11,64 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     # SQLALCHEMY_BINDS = {
     #     'sap': os.environ.get('SAP_DB')
-    # }
\ No newline at end of file
+    # }
+
+    # verified token -> user snapshot cache used by token_required (per process)
+    TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 2048))
+    TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 300))  # seconds
+    # seconds a user's permission version is cached, bounds how long a revoked
+    # token keeps working on other workers when the cache is not shared
+    PERM_VERSION_CACHE_TIMEOUT = int(os.environ.get('PERM_VERSION_CACHE_TIMEOUT', 60))
+
+    # Flask-Caching store, 'redis' with CACHE_REDIS_URL or 'memcached' with
+    # CACHE_MEMCACHED_SERVERS to share it between the workers
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'simple')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    CACHE_MEMCACHED_SERVERS = [s for s in os.environ.get('CACHE_MEMCACHED_SERVERS', '').split(',') if s]
+
+    # master data cache (Items, UoM, Warehouses, ObjectType, Series ...), on only
+    # with a shared CACHE_TYPE or with MASTER_CACHE_LOCAL for a single process server
+    MASTER_CACHE_LOCAL = os.environ.get('MASTER_CACHE_LOCAL', '').lower() in ('1', 'true', 'yes')
+    MASTER_CACHE_SIZE = int(os.environ.get('MASTER_CACHE_SIZE', 10000))
+    MASTER_CACHE_TTL = int(os.environ.get('MASTER_CACHE_TTL', 600))  # seconds
+
+    # document numbers reserved at once per process and series, numbers left
+    # unused when a process stops are recorded in tblseries_gap
+    SERIES_BLOCK_SIZE = int(os.environ.get('SERIES_BLOCK_SIZE', 1))
+
+    # create WhseInv rows on the first stock movement of an item in a warehouse
+    # instead of one zero row per item and warehouse, see manage.py prune_whseinv
+    WHSEINV_SPARSE = os.environ.get('WHSEINV_SPARSE', '').lower() in ('1', 'true', 'yes')
+
+    # largest page of the keyset paginated get_all lists
+    PAGE_SIZE_MAX = int(os.environ.get('PAGE_SIZE_MAX', 1000))
+
+    # encoder of the API responses, 'orjson' when installed or 'json'
+    JSON_BACKEND = os.environ.get('JSON_BACKEND', 'orjson')
+
+    # statement count and database time per request, in the X-SQL-Count and
+    # X-SQL-Time headers, left out of the streamed lists, and the
+    # bakery_app.sql log, off by default
+    SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+    # statements slower than this are logged with their parameters
+    SQL_SLOW_QUERY_MS = float(os.environ.get('SQL_SLOW_QUERY_MS', 500))
+
+    # new sales of a warehouse committed together by one writer per process,
+    # up to SALES_GROUP_MAX arriving within SALES_GROUP_WAIT_MS, off by default
+    SALES_GROUP_COMMIT = os.environ.get('SALES_GROUP_COMMIT', '').lower() in ('1', 'true', 'yes')
+    SALES_GROUP_MAX = int(os.environ.get('SALES_GROUP_MAX', 20))
+    SALES_GROUP_WAIT_MS = float(os.environ.get('SALES_GROUP_WAIT_MS', 20))
+    # seconds a request waits for its batch
+    SALES_GROUP_TIMEOUT = float(os.environ.get('SALES_GROUP_TIMEOUT', 30))
+
+    # offline sales batches, posted by a pool of threads per process
+    SALES_BATCH_WORKERS = int(os.environ.get('SALES_BATCH_WORKERS', 2))
+    SALES_BATCH_MAX = int(os.environ.get('SALES_BATCH_MAX', 1000))
+
+    # responses of the document POSTs kept for the retries with the same Idempotency-Key
+    IDEMPOTENCY_TTL_HOURS = float(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24))
+    # a key pending this many seconds goes to its retry, the first request then can no longer commit
+    IDEMPOTENCY_PENDING_TIMEOUT = int(os.environ.get('IDEMPOTENCY_PENDING_TIMEOUT', 120))
+
+    # Prometheus /metrics, needs prometheus_client, off by default
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
@@ -1,6 +1,9 @@
+from collections import defaultdict
 from datetime import datetime
-from sqlalchemy import event
+from sqlalchemy import event, bindparam, and_
 from bakery_app import db, ma
+from bakery_app._cache import master_data
+from bakery_app._events import session_events
 
 
 # from bakery_app.sales.models import SalesHeader
@@ -22,6 +25,8 @@ class Customer(db.Model):
     updated_by = db.Column(db.Integer, db.ForeignKey('tbluser.id'))
     balance = db.Column(db.Float, nullable=False, default=0.00)
     dep_balance = db.Column(db.Float, default=0.00)
+    # balance changes appended to CustomerBalanceDelta instead of updating the row
+    deferred_balance = db.Column(db.Boolean, default=False)
     custtype = db.relationship('CustomerType', backref='custtype', lazy=True)
 
 
@@ -36,3 +41,138 @@ class CustomerType(db.Model):
     date_updated = db.Column(db.DateTime, nullable=False, default=datetime.now)
     created_by = db.Column(db.Integer, db.ForeignKey('tbluser.id'))
     updated_by = db.Column(db.Integer, db.ForeignKey('tbluser.id'))
+
+
+class CustomerBalanceDelta(db.Model):
+    """Pending balance changes of the customers with deferred_balance.
+
+    The shared walk-in customers, the Cash and AR Sales ones of a warehouse,
+    take a sale or a payment from every terminal. Their changes are appended
+    here, which never waits on the customer row, and folded into
+    Customer.balance by manage.py fold_balances. Until then the balance column
+    lags by the pending sum: /api/customer/get_all adds it, it is the only
+    route returning the balance, and the sales and payment routes never read
+    it. Any new read of the balance of such a customer has to add
+    pending([code]) as well.
+    """
+    __tablename__ = "tblcustbaldelta"
+
+    id = db.Column(db.Integer, primary_key=True)
+    # no foreign key, the insert must not touch the customer
+    cust_code = db.Column(db.String(100), nullable=False, index=True)
+    amount = db.Column(db.Float, nullable=False)
+    date_created = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    @classmethod
+    def pending(cls, codes=None):
+        """Sum of the deltas not folded yet per customer code"""
+        query = db.session.query(cls.cust_code, db.func.sum(cls.amount)).group_by(cls.cust_code)
+        if codes is not None:
+            query = query.filter(cls.cust_code.in_(codes))
+        return dict(query.all())
+
+    @classmethod
+    def with_pending(cls, pending, item):
+        """Add the pending deltas to the balance of a dumped customer"""
+        if item['code'] in pending:
+            item['balance'] += pending[item['code']]
+        return item
+
+    @classmethod
+    def fold(cls, sess, limit=1000):
+        """Move the oldest deltas into Customer.balance, return the number folded.
+
+        The rows are deleted before they are applied, a fold running at the
+        same time skips them on MSSQL and otherwise fails to delete them all,
+        then nothing is applied and the caller must roll back. A delta
+        committed meanwhile is left for the next fold.
+        """
+        delta = cls.__table__
+        rows = sess.execute(db.select([delta.c.id, delta.c.cust_code, delta.c.amount]).
+                            with_hint(delta, 'WITH (UPDLOCK, READPAST)', dialect_name='mssql').
+                            order_by(delta.c.id).limit(limit)).fetchall()
+        if not rows:
+            return 0
+        result = sess.execute(delta.delete().where(delta.c.id.in_([row.id for row in rows])))
+        if result.rowcount != len(rows):
+            raise Exception("Balance deltas already folded by another run!")
+        totals = defaultdict(float)
+        for row in rows:
+            totals[row.cust_code] += row.amount
+        BalancePosting.update(sess, totals)
+        return len(rows)
+
+
+class BalancePosting:
+    """Customer balance changes of one flush, applied once per customer.
+
+    A document adds its delta once, whatever its number of rows. After the
+    flush each customer gets a single UPDATE adding the net delta in the
+    database, so no Customer is loaded and concurrent postings never lose
+    an update. The deltas of the customers with deferred_balance are
+    appended to CustomerBalanceDelta instead.
+    """
+
+    def __init__(self):
+        self.deltas = defaultdict(float)
+        # (objtype, document id) already added
+        self.documents = set()
+
+    @classmethod
+    def of(cls, sess):
+        """Return the posting of the session's current flush"""
+        return sess.info.setdefault('balance_posting', cls())
+
+    def add(self, cust_code, delta, document=None):
+        """Add the delta to the balance of the customer, once per document"""
+        if document is not None:
+            if document in self.documents:
+                return
+            self.documents.add(document)
+        self.deltas[cust_code] += delta or 0
+
+    @staticmethod
+    def update(sess, deltas):
+        """Add the deltas to Customer.balance in the database"""
+        cust = Customer.__table__
+        update = cust.update().where(cust.c.code == bindparam('_code')). \
+            values(balance=cust.c.balance + bindparam('_delta'))
+        # sorted to always change the rows in the same order
+        params = [{'_code': code, '_delta': delta} for code, delta in sorted(deltas.items()) if delta]
+        if params:
+            sess.execute(update, params)
+
+    def post(self, sess):
+        if not self.deltas:
+            return
+        # a plain select on the flush's connection, no ORM load inside the flush
+        cust = Customer.__table__
+        flagged = {row.code for row in sess.execute(
+            db.select([cust.c.code]).where(and_(cust.c.code.in_(list(self.deltas)),
+                                                cust.c.deferred_balance == True)))}
+        deferred = {}
+        direct = {}
+        for code, delta in self.deltas.items():
+            (deferred if code in flagged else direct)[code] = delta
+
+        self.update(sess, direct)
+        now = datetime.now()
+        rows = [{'cust_code': code, 'amount': delta, 'date_created': now}
+                for code, delta in deferred.items() if delta]
+        if rows:
+            sess.execute(CustomerBalanceDelta.__table__.insert(), rows)
+
+
+master_data.register(Customer, 'code', volatile=('balance', 'dep_balance', 'date_updated', 'updated_by'))
+
+
+@session_events.on("after_flush")
+def post_balance_changes(sess):
+    posting = sess.info.pop('balance_posting', None)
+    if posting:
+        posting.post(sess)
+
+
+@session_events.on("after_rollback")
+def discard_balance_changes(sess):
+    sess.info.pop('balance_posting', None)
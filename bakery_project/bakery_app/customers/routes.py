@@ -3,11 +3,11 @@ from datetime import datetime
 from sqlalchemy import exc
 from flask import Blueprint, request, jsonify
 from bakery_app import db, auth
-from bakery_app._helpers import BaseQuery
-from bakery_app._utils import ResponseMessage
+from bakery_app._helpers import BaseQuery, KeysetPagination
+from bakery_app._utils import ResponseMessage, StreamResponse
 from bakery_app.users.routes import token_required
 
-from .models import Customer, CustomerType
+from .models import Customer, CustomerType, CustomerBalanceDelta
 from .customers_schema import CustomerSchema, CustTypeSchema
 
 customers = Blueprint('customers', __name__)
@@ -48,6 +48,8 @@ def create_customer(curr_user):
 def get_all_customer(curr_user):
     try:
         data = request.args.to_dict()
+        page = KeysetPagination(data, Customer.id, desc=False)
+        stream = StreamResponse(data)
         if 'transtype' in data:
             if data['transtype'].upper() == 'SALES':
                 filt = []
@@ -70,12 +72,18 @@ def get_all_customer(curr_user):
                     filt.append(('cust_type', 'in', filt_cust_type))
 
                 cust_filter = BaseQuery.create_query_filter(Customer, filters={'and': filt})
-                customers = db.session.query(Customer).filter(*cust_filter).all()
+                customers = db.session.query(Customer).filter(*cust_filter)
         else:
-            customers = db.session.query(Customer).all()
+            customers = db.session.query(Customer)
         cust_schema = CustomerSchema(many=True)
-        result = cust_schema.dump(customers)
-        return ResponseMessage(True, count=len(result), data=result).resp()
+        # the deltas of the deferred balances not folded yet
+        pending = CustomerBalanceDelta.pending()
+        if stream.enabled:
+            return stream.resp(page.stream(customers, unique=False), filename='customers',
+                               dump=lambda c: CustomerBalanceDelta.with_pending(pending, cust_schema.dump(c, many=False)))
+        result = [CustomerBalanceDelta.with_pending(pending, item)
+                  for item in cust_schema.dump(page.all(customers, unique=False))]
+        return ResponseMessage(True, count=len(result), data=result, page=page).resp()
 
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
         return ResponseMessage(False, message=f"{err}").resp(), 500
@@ -0,0 +1,134 @@
+import os
+import time
+from collections import Counter as _Tally
+
+from flask import g, request
+from flask_caching import Cache
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+try:
+    from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+                                   Histogram, generate_latest, multiprocess)
+except ImportError:  # optional, /metrics is disabled without it
+    Counter = None
+
+if Counter is not None:
+    REQUEST_LATENCY = Histogram('http_request_duration_seconds', "Request latency by route",
+                                ['blueprint', 'endpoint', 'method'])
+    REQUEST_ERRORS = Counter('http_request_errors_total', "Responses with an error status by route",
+                             ['blueprint', 'endpoint', 'status'])
+    POOL_CHECKOUT_WAIT = Histogram('db_pool_checkout_wait_seconds', "Time waited for a pool connection")
+    POOL_IN_USE = Gauge('db_pool_connections_in_use', "Pool connections checked out",
+                        multiprocess_mode='livesum')
+    CACHE_REQUESTS = Counter('cache_requests_total', "Flask-Caching gets by result", ['result'])
+    ROWS_POSTED = Counter('document_rows_posted_total', "Committed new rows by model", ['model'])
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool observing how long a checkout waits for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+class MeteredCache(Cache):
+    """Flask-Caching Cache counting the hits and misses of get once metrics are enabled"""
+    metered = False
+
+    def get(self, *args, **kwargs):
+        value = super().get(*args, **kwargs)
+        if self.metered:
+            CACHE_REQUESTS.labels('hit' if value is not None else 'miss').inc()
+        return value
+
+
+class Metrics:
+    """Prometheus metrics of the requests, the connection pool, the cache and the posted rows.
+
+    Off unless METRICS_ENABLED is set and prometheus_client is installed.
+    The counters live in the process. With several gunicorn workers, set
+    prometheus_multiproc_dir to an empty directory shared by the workers.
+    The values are then kept in memory mapped files that /metrics
+    aggregates. The gunicorn child_exit hook should call
+    prometheus_client.multiprocess.mark_process_dead(worker.pid).
+    """
+
+    def __init__(self):
+        self.enabled = False
+
+    def init_app(self, app, cache=None):
+        if not app.config.get('METRICS_ENABLED') or Counter is None:
+            return
+        self.enabled = True
+        if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+            app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {}).setdefault('poolclass', TimedQueuePool)
+        if cache is not None:
+            cache.metered = True
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        self._register_listeners()
+
+    def _register_listeners(self):
+        if getattr(Metrics, '_listening', False):
+            return
+        Metrics._listening = True
+        from bakery_app import db
+        from bakery_app._events import session_events
+
+        event.listen(TimedQueuePool, 'checkout', lambda *args: POOL_IN_USE.inc())
+        event.listen(TimedQueuePool, 'checkin', lambda *args: POOL_IN_USE.dec())
+
+        @session_events.listens_for('after_flush', db.Model, 'new')
+        def metrics_new_row(sess, obj):
+            sess.info.setdefault('metrics_rows', _Tally())[type(obj).__name__] += 1
+
+        @session_events.on('after_commit')
+        def metrics_rows_commit(sess):
+            for model, count in sess.info.pop('metrics_rows', {}).items():
+                ROWS_POSTED.labels(model).inc(count)
+
+        @session_events.on('after_rollback')
+        def metrics_rows_rollback(sess):
+            sess.info.pop('metrics_rows', None)
+
+    def _labels(self):
+        return request.blueprint or '', request.endpoint or 'unmatched'
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+
+    def _after_request(self, response):
+        if 'metrics_start' in g:
+            blueprint, endpoint = self._labels()
+            REQUEST_LATENCY.labels(blueprint, endpoint, request.method).observe(
+                time.perf_counter() - g.metrics_start)
+            if response.status_code >= 400:
+                REQUEST_ERRORS.labels(blueprint, endpoint, str(response.status_code)).inc()
+            g.metrics_observed = True
+        return response
+
+    def _teardown_request(self, exc):
+        # unhandled exception, after_request did not run
+        if exc is not None and 'metrics_start' in g and 'metrics_observed' not in g:
+            blueprint, endpoint = self._labels()
+            REQUEST_LATENCY.labels(blueprint, endpoint, request.method).observe(
+                time.perf_counter() - g.metrics_start)
+            REQUEST_ERRORS.labels(blueprint, endpoint, '500').inc()
+
+    def render(self):
+        """The metrics in the Prometheus text format, of every worker in multiprocess mode"""
+        if 'prometheus_multiproc_dir' in os.environ:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+metrics = Metrics()
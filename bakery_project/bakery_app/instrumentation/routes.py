@@ -0,0 +1,32 @@
+from flask import Blueprint, Response, request
+
+from bakery_app._events import session_events
+from bakery_app._utils import ResponseMessage
+from bakery_app.instrumentation.metrics import metrics
+from bakery_app.users.routes import token_required
+
+instrumentation = Blueprint('instrumentation', __name__)
+
+
+# Session event handlers call count and time
+@instrumentation.route('/api/instrumentation/session_events')
+@token_required
+def session_event_stats(curr_user):
+    if not curr_user.is_admin():
+        return ResponseMessage(False, message="Unauthorized user!").resp(), 401
+
+    data = session_events.stats()
+    if request.args.get('reset') in ('1', 'true'):
+        session_events.reset_stats()
+
+    return ResponseMessage(True, data=data).resp()
+
+
+# Prometheus scrape target, unauthenticated
+@instrumentation.route('/metrics')
+def metrics_endpoint():
+    if not metrics.enabled:
+        return ResponseMessage(False, message="Metrics are disabled.").resp(), 404
+
+    data, content_type = metrics.render()
+    return Response(data, content_type=content_type)
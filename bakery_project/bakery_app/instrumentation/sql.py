@@ -0,0 +1,101 @@
+import json
+import logging
+import time
+
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('bakery_app.sql')
+
+
+class SQLInstrumentation:
+    """Statement count and database time of every request.
+
+    Off unless SQL_INSTRUMENTATION is set. When on, the responses carry the
+    X-SQL-Count and X-SQL-Time headers, one JSON log line is written per
+    request and the statements slower than SQL_SLOW_QUERY_MS are logged with
+    their parameters.
+
+    A streamed response runs its statements while the body is sent, after
+    the headers are written and outside the request's g. It gets no headers,
+    its log line is marked streamed and only counts the statements run
+    before the body.
+    """
+    params_length = 1000
+
+    def __init__(self, app=None):
+        self.slow_query_ms = None
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('SQL_INSTRUMENTATION'):
+            return
+        self.slow_query_ms = app.config.get('SQL_SLOW_QUERY_MS')
+        # the stderr handler of flask, not left to whether app.logger was set up
+        if not logger.handlers:
+            logger.addHandler(default_handler)
+            logger.propagate = False
+        if not logger.level:
+            logger.setLevel(logging.INFO)
+        if not self._listening:
+            # every engine, the cursor events are not tied to an application
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(Engine, 'handle_error', self._handle_error)
+            self._listening = True
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _before_request(self):
+        g.sql_count = 0
+        g.sql_seconds = 0.0
+        g.sql_request_start = time.perf_counter()
+
+    def _after_request(self, response):
+        if 'sql_request_start' not in g:
+            return response
+        db_ms = round(g.sql_seconds * 1000, 3)
+        line = {'method': request.method, 'path': request.path, 'status': response.status_code,
+                'statements': g.sql_count, 'db_ms': db_ms,
+                'request_ms': round((time.perf_counter() - g.sql_request_start) * 1000, 3)}
+        if response.is_streamed:
+            line['streamed'] = True
+        else:
+            response.headers['X-SQL-Count'] = str(g.sql_count)
+            response.headers['X-SQL-Time'] = f"{db_ms}ms"
+        logger.info(json.dumps(line))
+        return response
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('sql_start', []).append((context, time.perf_counter()))
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._record(conn.info['sql_start'].pop()[1], statement, parameters, executemany)
+
+    def _handle_error(self, context):
+        # a statement that raised has no after_cursor_execute, its start is
+        # popped here so the stack of the connection does not grow
+        starts = context.connection.info.get('sql_start') if context.connection is not None else None
+        if starts and starts[-1][0] is context.execution_context:
+            self._record(starts.pop()[1], context.statement, context.parameters,
+                         context.execution_context is not None and context.execution_context.executemany)
+
+    def _record(self, start, statement, parameters, executemany):
+        elapsed = time.perf_counter() - start
+        if has_request_context() and 'sql_count' in g:
+            g.sql_count += 1
+            g.sql_seconds += elapsed
+        if self.slow_query_ms is not None and elapsed * 1000 >= self.slow_query_ms:
+            # the parameters are only formatted for the slow statements
+            logger.warning(json.dumps({
+                'slow_query_ms': round(elapsed * 1000, 3),
+                'path': request.path if has_request_context() else None,
+                'statement': statement, 'executemany': executemany,
+                'parameters': repr(parameters)[:self.params_length]}))
+
+
+sql_instrumentation = SQLInstrumentation()
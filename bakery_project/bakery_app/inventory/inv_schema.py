@@ -1,3 +1,5 @@
+from sqlalchemy.orm import selectinload
+
 from bakery_app import ma
 from .models import (WhseInv, InvTransaction, TransferRow, TransferHeader,
                      ReceiveRow, ReceiveHeader)
@@ -42,6 +44,8 @@ class TransferHeaderSchema(ma.SQLAlchemyAutoSchema):
 
     transrow = ma.Nested(TransferRowSchema, many=True)
 
+    relationship_loaders = {'transrow': selectinload}
+
 
 class ReceiveRowSchema(ma.SQLAlchemyAutoSchema):
     class Meta:
@@ -58,3 +62,5 @@ class ReceiveHeaderSchema(ma.SQLAlchemyAutoSchema):
 
     recrow = ma.Nested(ReceiveRowSchema, many=True)
 
+    relationship_loaders = {'recrow': selectinload}
+
@@ -1,10 +1,30 @@
-from datetime import datetime
-from sqlalchemy import event, and_
+from collections import defaultdict
+from datetime import datetime, date, timedelta
+from sqlalchemy import Date, and_, bindparam, case, cast, false, func, literal, select, union_all
 from bakery_app import db
+from bakery_app._events import session_events
+from bakery_app.config import Config
 from bakery_app._helpers import get_model_changes
 from bakery_app.sapb1.models import ITRow, ITHeader, PORow, POHeader
 
 
+# held until the commit also on the keys with no row, a concurrent posting of
+# the same key then waits and updates the row inserted here instead of
+# inserting a duplicate of it
+KEY_RANGE_LOCK = 'WITH (UPDLOCK, SERIALIZABLE)'
+
+
+def _existing_keys(sess, columns, keys):
+    """Return the keys, tuples of the values of the columns, that have a row.
+
+    One select for all the keys, their rows and gaps stay locked on MSSQL.
+    """
+    table = columns[0].table
+    query = select(columns).where(and_(*[col.in_({key[i] for key in keys}) for i, col in enumerate(columns)])). \
+        with_hint(table, KEY_RANGE_LOCK, dialect_name='mssql')
+    return {tuple(row) for row in sess.execute(query)} & set(keys)
+
+
 class WhseInv(db.Model):
     __tablename__ = "tblwhseinv"
 
@@ -20,6 +40,15 @@ class WhseInv(db.Model):
 
     item = db.relationship("Items", backref="whseinv", lazy=True)
 
+    __table_args__ = (db.UniqueConstraint('warehouse', 'item_code', name='uq_whseinv_whse_item'),)
+
+    @classmethod
+    def on_hand(cls, warehouse, item_code):
+        """Quantity of the item in the warehouse, zero when it has no row"""
+        quantity = db.session.query(cls.quantity).filter_by(
+            warehouse=warehouse, item_code=item_code).scalar()
+        return quantity or 0
+
     def __repr__(self):
         return f"WhseInv('{self.item_code}', '{self.item_name}', '{self.quantity}')"
 
@@ -53,6 +82,175 @@ class InvTransaction(db.Model):
     remarks = db.Column(db.String(150))
 
 
+class InvMovementDaily(db.Model):
+    """In and out quantities per warehouse, item, day and movement.
+
+    Kept up to date by StockPosting in the same transaction as the ledger,
+    manage.py rollup_whsmovement rebuilds it from tblwhstransaction.
+    """
+    __tablename__ = "tblwhsmovement_daily"
+
+    # movement per objtype, receipts of transfers are told apart
+    movements = {1: 'transferred', 2: 'received', 3: 'sold', 9: 'adj_in', 11: 'pullout', 12: 'adj_out'}
+
+    id = db.Column(db.Integer, primary_key=True)
+    warehouse = db.Column(db.String(100), nullable=False)
+    item_code = db.Column(db.String(100), nullable=False)
+    movement_date = db.Column(db.Date, nullable=False)
+    movement = db.Column(db.String(20), nullable=False)
+    inqty = db.Column(db.Float, nullable=False, default=0)
+    outqty = db.Column(db.Float, nullable=False, default=0)
+
+    __table_args__ = (db.UniqueConstraint('warehouse', 'movement_date', 'item_code', 'movement',
+                                          name='uq_whsmovement_daily'),)
+
+    @classmethod
+    def movement_of(cls, objtype, transtype=None):
+        if objtype == 2 and transtype == 'TRFR':
+            return 'transfer_in'
+        return cls.movements.get(objtype, 'other')
+
+    @classmethod
+    def add(cls, sess, totals):
+        """Add {(warehouse, item_code, movement_date, movement): [inqty, outqty]} to the rollup"""
+        if not totals:
+            return
+        table = cls.__table__
+        existing = _existing_keys(sess, [table.c.warehouse, table.c.item_code, table.c.movement_date,
+                                         table.c.movement], totals)
+        update = table.update().where(
+            and_(table.c.warehouse == bindparam('_whse'), table.c.movement_date == bindparam('_date'),
+                 table.c.item_code == bindparam('_item'), table.c.movement == bindparam('_movement'))
+        ).values(inqty=table.c.inqty + bindparam('_in'), outqty=table.c.outqty + bindparam('_out'))
+
+        updates = []
+        missing = []
+        for (whse, item, day, movement), (inqty, outqty) in sorted(totals.items()):
+            if (whse, item, day, movement) in existing:
+                updates.append({'_whse': whse, '_date': day, '_item': item, '_movement': movement,
+                                '_in': inqty, '_out': outqty})
+            else:
+                missing.append({'warehouse': whse, 'item_code': item, 'movement_date': day,
+                                'movement': movement, 'inqty': inqty, 'outqty': outqty})
+        if updates:
+            sess.execute(update, updates)
+        if missing:
+            sess.execute(table.insert(), missing)
+
+    @classmethod
+    def rebuild(cls, from_date, to_date):
+        """Replace the rollup of the date range with the totals of the ledger, return the rows written"""
+        table = cls.__table__
+        trans = InvTransaction.__table__
+        receive = ReceiveHeader.__table__
+        db.session.execute(table.delete().where(
+            and_(table.c.movement_date >= from_date, table.c.movement_date <= to_date)))
+
+        movement = case([(and_(trans.c.objtype == 2, receive.c.transtype == 'TRFR'), 'transfer_in')] +
+                        [(trans.c.objtype == objtype, name) for objtype, name in cls.movements.items()],
+                        else_='other')
+        rows = select([trans.c.warehouse, trans.c.item_code,
+                       cast(trans.c.transdate, Date).label('movement_date'),
+                       movement.label('movement'), trans.c.inqty, trans.c.outqty]
+                      ).select_from(trans.outerjoin(receive, and_(trans.c.objtype == receive.c.objtype,
+                                                                  trans.c.trans_id == receive.c.id))
+                                    ).where(and_(trans.c.transdate >= from_date,
+                                                 trans.c.transdate < to_date + timedelta(days=1))
+                                            ).alias('rows')
+        # grouped outside, the movement case has bound parameters
+        totals = select([rows.c.warehouse, rows.c.item_code, rows.c.movement_date, rows.c.movement,
+                         func.sum(rows.c.inqty), func.sum(rows.c.outqty)]
+                        ).group_by(rows.c.warehouse, rows.c.item_code, rows.c.movement_date, rows.c.movement)
+        result = db.session.execute(table.insert().from_select(
+            ['warehouse', 'item_code', 'movement_date', 'movement', 'inqty', 'outqty'], totals))
+        return result.rowcount
+
+
+class WhseInvSnapshot(db.Model):
+    """Closing balance per warehouse and item at the end of a day.
+
+    Written by manage.py snapshot_whseinv. A balance at the start of a date is
+    the latest snapshot before it plus the daily movements since that snapshot.
+    Only the non zero balances are kept.
+    """
+    __tablename__ = "tblwhseinv_snapshot"
+
+    id = db.Column(db.Integer, primary_key=True)
+    warehouse = db.Column(db.String(100), nullable=False)
+    item_code = db.Column(db.String(100), nullable=False)
+    snapshot_date = db.Column(db.Date, nullable=False)
+    quantity = db.Column(db.Float, nullable=False, default=0)
+    date_created = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    __table_args__ = (db.UniqueConstraint('warehouse', 'snapshot_date', 'item_code',
+                                          name='uq_whseinv_snapshot'),)
+
+    @classmethod
+    def latest_dates(cls, warehouses, before):
+        """Latest snapshot date before the date per warehouse"""
+        return dict(db.session.query(cls.warehouse, func.max(cls.snapshot_date)).filter(
+            and_(cls.warehouse.in_(warehouses), cls.snapshot_date < before)
+        ).group_by(cls.warehouse))
+
+    @classmethod
+    def balances(cls, warehouses, before):
+        """Select of (warehouse, item_code, quantity) at the start of the date"""
+        daily = InvMovementDaily.__table__
+        snap = cls.__table__
+        latest = cls.latest_dates(warehouses, before)
+
+        # the warehouses sharing the same snapshot date are read together
+        by_date = defaultdict(list)
+        for whse in warehouses:
+            by_date[latest.get(whse)].append(whse)
+
+        def movements(*criteria):
+            return select([daily.c.warehouse, daily.c.item_code,
+                           (daily.c.inqty - daily.c.outqty).label('quantity')]).where(and_(*criteria))
+
+        parts = []
+        for snapshot_date, whses in by_date.items():
+            if snapshot_date:
+                parts.append(select([snap.c.warehouse, snap.c.item_code, snap.c.quantity]).where(
+                    and_(snap.c.warehouse.in_(whses), snap.c.snapshot_date == snapshot_date)))
+                parts.append(movements(daily.c.warehouse.in_(whses), daily.c.movement_date < before,
+                                       daily.c.movement_date > snapshot_date))
+            else:
+                parts.append(movements(daily.c.warehouse.in_(whses), daily.c.movement_date < before))
+
+        if not parts:
+            # no warehouse, no rows
+            parts.append(movements(false()))
+
+        rows = (union_all(*parts) if len(parts) > 1 else parts[0]).alias('balance_rows')
+        return select([rows.c.warehouse, rows.c.item_code, func.sum(rows.c.quantity).label('quantity')]
+                      ).group_by(rows.c.warehouse, rows.c.item_code)
+
+    @classmethod
+    def take(cls, snapshot_date, warehouses):
+        """Replace the snapshot of the day of the warehouses, return the rows written"""
+        snap = cls.__table__
+        db.session.execute(snap.delete().where(
+            and_(snap.c.snapshot_date == snapshot_date, snap.c.warehouse.in_(warehouses))))
+
+        balances = cls.balances(warehouses, snapshot_date + timedelta(days=1)).alias('balances')
+        result = db.session.execute(snap.insert().from_select(
+            ['warehouse', 'item_code', 'snapshot_date', 'quantity', 'date_created'],
+            select([balances.c.warehouse, balances.c.item_code,
+                    literal(snapshot_date, cls.snapshot_date.type), balances.c.quantity,
+                    literal(datetime.now(), cls.date_created.type)]
+                   ).where(balances.c.quantity != 0)))
+        return result.rowcount
+
+    @classmethod
+    def invalidate(cls, sess, earliest):
+        """Drop the snapshots a backdated movement made stale, {warehouse: earliest date}"""
+        snap = cls.__table__
+        for whse, transdate in earliest.items():
+            sess.execute(snap.delete().where(
+                and_(snap.c.warehouse == whse, snap.c.snapshot_date >= transdate)))
+
+
 class TransferHeader(db.Model):
     __tablename__ = "tbltransfer"
 
@@ -65,7 +263,7 @@ class TransferHeader(db.Model):
     objtype = db.Column(db.Integer, nullable=False)
     sap_number = db.Column(db.Integer, nullable=True, default=None)
     docstatus = db.Column(db.String(10), nullable=False, default='O')
-    transdate = db.Column(db.DateTime)
+    transdate = db.Column(db.DateTime, index=True)
     reference2 = db.Column(db.String(100))
     remarks = db.Column(db.String(250))
     created_by = db.Column(db.Integer, db.ForeignKey('tbluser.id', ondelete='NO ACTION'),
@@ -119,7 +317,7 @@ class ReceiveHeader(db.Model):
     sap_number = db.Column(db.Integer, nullable=True, default=None)
     docstatus = db.Column(db.String(10), nullable=False, default='O')
     transtype = db.Column(db.String(100))
-    transdate = db.Column(db.DateTime)
+    transdate = db.Column(db.DateTime, index=True)
     reference = db.Column(db.String(100))
     reference2 = db.Column(db.String(100))
     remarks = db.Column(db.String(250), nullable=True)
@@ -162,142 +360,259 @@ class ReceiveRow(db.Model):
     recheader = db.relationship("ReceiveHeader", back_populates="recrow", lazy=True)
 
 
-@event.listens_for(db.session, "before_flush")
-def insert_update(*args):
-    sess = args[0]
-    for obj in sess.new:
-
-        # Transfer Transaction 
-        # Insert to InvTransaction and Update Whse Inv
-        if isinstance(obj, TransferRow):
-
-            t_h = TransferHeader.query.filter_by(id=obj.transfer_id).first()
-            whseinv = WhseInv.query.filter_by(warehouse=obj.from_whse,
-                                              item_code=obj.item_code).first()
-            whseinv.quantity -= obj.quantity
-
-            invtrans = InvTransaction(series_code=t_h.seriescode, trans_id=obj.transfer_id,
-                                      trans_num=t_h.transnumber, objtype=t_h.objtype, item_code=obj.item_code,
-                                      outqty=obj.quantity, uom=obj.uom, warehouse=obj.from_whse, warehouse2=obj.to_whse,
-                                      transdate=t_h.transdate, created_by=t_h.created_by, updated_by=t_h.updated_by,
-                                      reference=t_h.reference, sap_number=obj.sap_number)
-
-            db.session.add_all([invtrans])
-
-        # Receive Transaction
-        # Insert to InvTransaction
-        # Update the qty of WhseInv
-        elif isinstance(obj, ReceiveRow):
-            r_h = ReceiveHeader.query.filter_by(id=obj.receive_id).first()
-
-            whseinv = WhseInv.query.filter_by(warehouse=obj.to_whse,
-                                              item_code=obj.item_code).first()
-            if not whseinv:
-                raise Exception("No warehouse inv item/whse.")
-
-            # if from transfer quantity will be add to whse inv and inv transaction
-            whseinv.quantity += obj.quantity if r_h.transtype == 'TRFR' else obj.actualrec
-
-            invtrans = InvTransaction(series_code=r_h.seriescode, trans_id=obj.receive_id,
-                                      trans_num=r_h.transnumber, objtype=r_h.objtype, item_code=obj.item_code,
-                                      inqty=obj.quantity if r_h.transtype == 'TRFR' else obj.actualrec, uom=obj.uom,
-                                      warehouse=obj.to_whse, warehouse2=obj.from_whse, transdate=r_h.transdate,
-                                      created_by=r_h.created_by, updated_by=r_h.updated_by, reference=r_h.reference,
-                                      sap_number=obj.sap_number, reference2=r_h.reference2)
-            
-            # Check if the transtype is SAPIT then update the table of SAPIT
-            if r_h.transtype == 'SAPIT':
-                it_row = ITRow.query.filter(and_(ITRow.itemcode == obj.item_code, ITRow.docnum == obj.sap_number)).first()
-                if it_row.actual_rec:
-                    continue
-                it_row.actual_rec = obj.actualrec
-
-            # Check if the transtype is SAPO then update the table of SAPPO
-            if r_h.transtype == 'SAPPO':
-                po_row = PORow.query.filter(and_(PORow.itemcode == obj.item_code, PORow.docnum == obj.sap_number)).first()
-                if po_row.actual_rec:
-                    continue
-                po_row.actual_rec = obj.actualrec
-                
-            db.session.add_all([invtrans])
-        else:
-            continue
-
-    
-    for obj in sess.dirty:
-        # Update When Receive Transaction Canceled
-        if isinstance(obj, ReceiveHeader):
-            # check if the update is cancel and The header is not cancel
-            changes = get_model_changes(obj)
-            for i in changes:
-                if i == 'docstatus':
-                    if changes[i][1] == 'N':
-                        rec_row = ReceiveRow.query.filter_by(receive_id=obj.id).all()
-                        for row in rec_row:
-                            # add to inventory transaction the void transaction
-                            inv_trans = InvTransaction(trans_id=obj.id, trans_num=obj.transnumber,
-                                                       objtype=obj.objtype, item_code=row.item_code,
-                                                       outqty=row.actualrec, uom=row.uom,
-                                                       warehouse=row.to_whse, warehouse2=row.from_whse,
-                                                       transdate=obj.transdate, created_by=obj.created_by,
-                                                       reference=obj.reference, reference2=obj.reference2,
-                                                       remarks=obj.remarks, series_code=obj.seriescode,
-                                                       updated_by=obj.updated_by)
-
-                            # deduct the canceled qty to whse
-                            whseinv = WhseInv.query.filter_by(warehouse=row.to_whse,
-                                                              item_code=row.item_code).first()
-                            whseinv.quantity -= row.actualrec
-
-                            row.status = 2
-
-                            db.session.add(inv_trans)
-                        
-                        # Update the SAP IT Table When Cancel
-                        if obj.transtype == 'SAPIT':
-                            it_header = ITHeader.query.filter(ITHeader.docnum == obj.sap_number).first()
-                            it_header.docstatus = 'O'
-                            it_row = ITRow.query.filter(ITRow.docnum == obj.sap_number).all()
-                            for i in it_row:
-                                i.actual_rec = None
-
-                        # Update the SAP PO Table When Cancel
-                        if obj.transtype == 'SAPPO':
-                            po_header = POHeader.query.filter(POHeader.docnum == obj.sap_number).first()
-                            po_header.docstatus = 'O'
-                            po_row = PORow.query.filter(PORow.docnum == obj.sap_number).all()
-                            for i in po_row:
-                                i.actual_rec = None
-                            
-        
-        # Update if the Transfer is Canceled
-        if isinstance(obj, TransferHeader):
-            changes = get_model_changes(obj)
-            for i in changes:
-                if i == 'docstatus':
-                    if changes[i][1] == 'N':
-                        trans_row = TransferHeader.query.filter_by(
-                            transfer_id=obj.id).all()
-
-                        for row in trans_row:
-                            # add to inventory transaction the void transaction
-                            inv_trans = InvTransaction(trans_id=obj.id, trans_num=obj.transnumber,
-                                                       objtype=obj.objtype, item_code=row.item_code,
-                                                       inqty=row.actualrec, uom=row.uom,
-                                                       warehouse=row.from_whse, warehouse2=row.to_whse,
-                                                       transdate=obj.transdate, created_by=obj.created_by,
-                                                       reference=obj.reference, reference2=obj.reference2,
-                                                       remarks=obj.remarks, series_code=obj.seriescode,
-                                                       updated_by=obj.updated_by)
-
-                            # deduct the canceled qty to whse
-                            whseinv = WhseInv.query.filter_by(warehouse=row.from_whse,
-                                                              item_code=row.item_code).first()
-                            whseinv.quantity += row.actualrec
-
-                            row.status = 2
-
-                            db.session.add(inv_trans)
-
-        else:
-            continue
+class StockShortage(Exception):
+    """Raised when a stock decrement would bring a WhseInv row below zero"""
+
+    def __init__(self, rows):
+        # list of (warehouse, item_code, requested quantity)
+        self.rows = rows
+        items = ', '.join(item.title() for _, item, _ in rows)
+        super().__init__(f"{items} below qty!")
+
+
+class StockPosting:
+    """Stock movements of one flush, posted to WhseInv and the ledger at once.
+
+    The before_flush listeners only record the movements. After the flush the
+    deltas are aggregated per (warehouse, item_code) and added by the database,
+    so concurrent postings never lose an update. A decrement with check_stock
+    is a conditional UPDATE of its own row, its rowcount tells a shortage. The
+    other deltas are one executemany UPDATE after one select of the rows that
+    exist. The InvTransaction rows are bulk inserted and their daily totals
+    added to InvMovementDaily the same way, so only the checked decrements
+    cost a statement per item.
+    """
+    ledger_fields = ('series_code', 'trans_id', 'trans_num', 'objtype', 'item_code', 'inqty',
+                     'outqty', 'uom', 'warehouse', 'warehouse2', 'transdate', 'reference',
+                     'reference2', 'created_by', 'updated_by', 'sap_number', 'remarks',
+                     'date_created', 'date_updated')
+
+    def __init__(self):
+        self.movements = []
+        # (warehouse, item_code) that must not go below zero
+        self.checked = set()
+        # (warehouse, item_code, date, movement): [inqty, outqty]
+        self.daily = defaultdict(lambda: [0.0, 0.0])
+
+    @classmethod
+    def of(cls, sess):
+        """Return the posting of the session's current flush"""
+        return sess.info.setdefault('stock_posting', cls())
+
+    def add(self, warehouse, item_code, inqty=0, outqty=0, check_stock=False, movement=None, **ledger):
+        """Record a stock movement and its ledger row.
+
+        With check_stock the movement fails with StockShortage when the
+        warehouse has less than the net quantity going out. The movement of
+        the daily rollup defaults to the one of the objtype.
+        """
+        now = datetime.now()
+        row = dict.fromkeys(self.ledger_fields)
+        row.update(ledger)
+        row.update(warehouse=warehouse, item_code=item_code, inqty=inqty or 0, outqty=outqty or 0)
+        row['transdate'] = row['transdate'] or now
+        row['date_created'] = row['date_updated'] = now
+        self.movements.append(row)
+
+        transdate = row['transdate']
+        day = transdate.date() if isinstance(transdate, datetime) else transdate
+        totals = self.daily[(warehouse, item_code, day, movement or InvMovementDaily.movement_of(row['objtype']))]
+        totals[0] += row['inqty']
+        totals[1] += row['outqty']
+        if check_stock:
+            self.checked.add((warehouse, item_code))
+
+    def deltas(self):
+        """Net quantity change per (warehouse, item_code)"""
+        totals = defaultdict(float)
+        for row in self.movements:
+            totals[(row['warehouse'], row['item_code'])] += row['inqty'] - row['outqty']
+        return totals
+
+    def post(self, sess):
+        if not self.movements:
+            return
+        whseinv = WhseInv.__table__
+        key = and_(whseinv.c.warehouse == bindparam('_whse'),
+                   whseinv.c.item_code == bindparam('_item'))
+        update = whseinv.update().where(key). \
+            values(quantity=whseinv.c.quantity + bindparam('_delta'))
+        # decrement only when the stock is still enough
+        checked_update = whseinv.update().where(
+            and_(key, whseinv.c.quantity >= bindparam('_required'))). \
+            values(quantity=whseinv.c.quantity + bindparam('_delta'))
+
+        deltas = self.deltas()
+        # sorted to always change the rows in the same order
+        checked = sorted(k for k, delta in deltas.items() if delta < 0 and k in self.checked)
+        unchecked = sorted(k for k, delta in deltas.items() if delta and not (delta < 0 and k in self.checked))
+
+        shortage = []
+        for whse, item in checked:
+            # a missing row has no stock either
+            result = sess.execute(checked_update, {'_whse': whse, '_item': item, '_delta': deltas[(whse, item)],
+                                                   '_required': -deltas[(whse, item)]})
+            if result.rowcount == 0:
+                shortage.append((whse, item, -deltas[(whse, item)]))
+        if shortage:
+            raise StockShortage(shortage)
+
+        if unchecked:
+            existing = _existing_keys(sess, [whseinv.c.warehouse, whseinv.c.item_code], unchecked)
+            missing = [k for k in unchecked if k not in existing]
+            if missing and not Config.WHSEINV_SPARSE:
+                whse, item = missing[0]
+                raise Exception(f"No warehouse inv item/whse. {item} / {whse}")
+            updates = [{'_whse': whse, '_item': item, '_delta': deltas[(whse, item)]}
+                       for whse, item in unchecked if (whse, item) in existing]
+            if updates:
+                sess.execute(update, updates)
+            if missing:
+                # sparse WhseInv, the row is created by the first movement
+                rows = {(row['warehouse'], row['item_code']): row for row in self.movements}
+                sess.execute(whseinv.insert(), [
+                    {'warehouse': whse, 'item_code': item, 'quantity': deltas[(whse, item)],
+                     'created_by': rows[(whse, item)]['created_by'],
+                     'updated_by': rows[(whse, item)]['updated_by']}
+                    for whse, item in missing])
+
+        sess.execute(InvTransaction.__table__.insert(), self.movements)
+        InvMovementDaily.add(sess, self.daily)
+
+        # movements dated before today change the snapshots from that day on
+        today = date.today()
+        backdated = {}
+        for row in self.movements:
+            transdate = row['transdate']
+            day = transdate.date() if isinstance(transdate, datetime) else transdate
+            if isinstance(day, date) and day < backdated.get(row['warehouse'], today):
+                backdated[row['warehouse']] = day
+        if backdated:
+            WhseInvSnapshot.invalidate(sess, backdated)
+
+        self.movements = []
+        self.checked = set()
+        self.daily.clear()
+
+
+# Transfer Transaction 
+# Record the movement to InvTransaction and Whse Inv
+@session_events.listens_for("before_flush", TransferRow)
+def transfer_row_insert(sess, obj):
+    t_h = TransferHeader.query.get(obj.transfer_id)
+    StockPosting.of(sess).add(obj.from_whse, obj.item_code, outqty=obj.quantity, check_stock=True,
+                              series_code=t_h.seriescode, trans_id=obj.transfer_id,
+                              trans_num=t_h.transnumber, objtype=t_h.objtype, uom=obj.uom,
+                              warehouse2=obj.to_whse, transdate=t_h.transdate,
+                              created_by=t_h.created_by, updated_by=t_h.updated_by,
+                              reference=t_h.reference, sap_number=obj.sap_number)
+
+
+# Receive Transaction
+# Record the movement to InvTransaction and Whse Inv
+@session_events.listens_for("before_flush", ReceiveRow)
+def receive_row_insert(sess, obj):
+    r_h = ReceiveHeader.query.get(obj.receive_id)
+
+    # if from transfer quantity will be add to whse inv and inv transaction
+    StockPosting.of(sess).add(obj.to_whse, obj.item_code,
+                              inqty=obj.quantity if r_h.transtype == 'TRFR' else obj.actualrec,
+                              movement=InvMovementDaily.movement_of(r_h.objtype, r_h.transtype),
+                              series_code=r_h.seriescode, trans_id=obj.receive_id,
+                              trans_num=r_h.transnumber, objtype=r_h.objtype, uom=obj.uom,
+                              warehouse2=obj.from_whse, transdate=r_h.transdate,
+                              created_by=r_h.created_by, updated_by=r_h.updated_by,
+                              reference=r_h.reference, sap_number=obj.sap_number,
+                              reference2=r_h.reference2)
+
+    # Check if the transtype is SAPIT then update the table of SAPIT
+    if r_h.transtype == 'SAPIT':
+        it_row = ITRow.query.filter(and_(ITRow.itemcode == obj.item_code, ITRow.docnum == obj.sap_number)).first()
+        if it_row.actual_rec:
+            return
+        it_row.actual_rec = obj.actualrec
+
+    # Check if the transtype is SAPO then update the table of SAPPO
+    if r_h.transtype == 'SAPPO':
+        po_row = PORow.query.filter(and_(PORow.itemcode == obj.item_code, PORow.docnum == obj.sap_number)).first()
+        if po_row.actual_rec:
+            return
+        po_row.actual_rec = obj.actualrec
+
+
+# Update When Receive Transaction Canceled
+@session_events.listens_for("before_flush", ReceiveHeader, state='dirty')
+def receive_cancel(sess, obj):
+    # check if the update is cancel and The header is not cancel
+    changes = get_model_changes(obj)
+    for i in changes:
+        if i == 'docstatus':
+            if changes[i][1] == 'N':
+                posting = StockPosting.of(sess)
+                rec_row = ReceiveRow.query.filter_by(receive_id=obj.id).all()
+                for row in rec_row:
+                    # add to inventory transaction the void transaction
+                    # and deduct the canceled qty to whse
+                    posting.add(row.to_whse, row.item_code, outqty=row.actualrec,
+                                movement=InvMovementDaily.movement_of(obj.objtype, obj.transtype),
+                                trans_id=obj.id, trans_num=obj.transnumber,
+                                objtype=obj.objtype, uom=row.uom, warehouse2=row.from_whse,
+                                transdate=obj.transdate, created_by=obj.created_by,
+                                reference=obj.reference, reference2=obj.reference2,
+                                remarks=obj.remarks, series_code=obj.seriescode,
+                                updated_by=obj.updated_by)
+
+                    row.status = 2
+
+                # Update the SAP IT Table When Cancel
+                if obj.transtype == 'SAPIT':
+                    it_header = ITHeader.query.filter(ITHeader.docnum == obj.sap_number).first()
+                    it_header.docstatus = 'O'
+                    it_row = ITRow.query.filter(ITRow.docnum == obj.sap_number).all()
+                    for i in it_row:
+                        i.actual_rec = None
+
+                # Update the SAP PO Table When Cancel
+                if obj.transtype == 'SAPPO':
+                    po_header = POHeader.query.filter(POHeader.docnum == obj.sap_number).first()
+                    po_header.docstatus = 'O'
+                    po_row = PORow.query.filter(PORow.docnum == obj.sap_number).all()
+                    for i in po_row:
+                        i.actual_rec = None
+
+
+# Update if the Transfer is Canceled
+@session_events.listens_for("before_flush", TransferHeader, state='dirty')
+def transfer_cancel(sess, obj):
+    changes = get_model_changes(obj)
+    for i in changes:
+        if i == 'docstatus':
+            if changes[i][1] == 'N':
+                posting = StockPosting.of(sess)
+                trans_row = TransferRow.query.filter_by(
+                    transfer_id=obj.id).all()
+
+                for row in trans_row:
+                    # add to inventory transaction the void transaction
+                    # and return the canceled qty to whse
+                    posting.add(row.from_whse, row.item_code, inqty=row.quantity,
+                                trans_id=obj.id, trans_num=obj.transnumber,
+                                objtype=obj.objtype, uom=row.uom, warehouse2=row.to_whse,
+                                transdate=obj.transdate, created_by=obj.created_by,
+                                reference=obj.reference, reference2=obj.reference2,
+                                remarks=obj.remarks, series_code=obj.seriescode,
+                                updated_by=obj.updated_by)
+
+                    row.status = 2
+
+
+@session_events.on("after_flush")
+def post_stock_movements(sess):
+    posting = sess.info.pop('stock_posting', None)
+    if posting:
+        posting.post(sess)
+
+
+@session_events.on("after_rollback")
+def discard_stock_movements(sess):
+    sess.info.pop('stock_posting', None)
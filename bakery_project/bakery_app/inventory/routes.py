@@ -2,18 +2,19 @@ import pyodbc
 
 from datetime import datetime
 from flask import Blueprint, request
-from sqlalchemy import exc, and_, or_, DATE, func
+from sqlalchemy import exc, and_, or_, func, case, literal_column, select, union_all
 
 from bakery_app import db
-from bakery_app._utils import Check, ResponseMessage
-from bakery_app._helpers import BaseQuery
+from bakery_app._utils import DocumentCheck, ResponseMessage, StreamResponse
+from bakery_app._idempotency import idempotent
+from bakery_app._helpers import BaseQuery, KeysetPagination
 from bakery_app.users.models import User
-from bakery_app.branches.models import Series, ObjectType, Warehouses
+from bakery_app.branches.models import Warehouses, series_allocator
 from bakery_app.users.routes import token_required
 from bakery_app.items.models import PriceListRow, Items
 
 from .models import (TransferHeader, TransferRow, ReceiveHeader, ReceiveRow,
-                     WhseInv, ITRow, ITHeader, POHeader, PORow)
+                     WhseInv, ITRow, ITHeader, POHeader, PORow, InvMovementDaily, WhseInvSnapshot)
 from .inv_schema import (TransferHeaderSchema, ReceiveHeaderSchema,
                          WhseInvSchema)
 
@@ -23,13 +24,13 @@ inventory = Blueprint('inventory', __name__)
 # Create Transfer
 @inventory.route('/api/inv/trfr/new', methods=['POST'])
 @token_required
+@idempotent
 def create_transfer(curr_user):
     if not curr_user.can_transfer():
         return ResponseMessage(False, message="Unauthorized to transfer!").resp(), 401
 
     # query the whse
-    whse = Warehouses.query.filter_by(whsecode=curr_user.whse).first()
-    if whse.is_cutoff():
+    if Warehouses.cutoff_of(curr_user.whse):
         return ResponseMessage(False, message="Your warehouse cutoff is enable!").resp(), 401
 
     data = request.get_json()
@@ -43,60 +44,34 @@ def create_transfer(curr_user):
         return ResponseMessage(False, message="No data in details argument!").resp()
 
     try:
-        obj = ObjectType.query.filter_by(code='TRFR').first()
-        series = Series.query.filter_by(
-            whsecode=curr_user.whse, objtype=obj.objtype).first()
-        if series.next_num + 1 > series.end_num:
-            raise Exception("Series number already in max!")
-        if not series:
-            raise Exception("Invalid Series")
-
-        reference = f"{series.code}-{obj.code}-{series.next_num}"
-
-        t_h = TransferHeader(series=series.id, seriescode=series.code,
-                             transnumber=series.next_num, reference=reference,
-                             created_by=curr_user.id, updated_by=curr_user.id,
+        num = series_allocator.allocate(curr_user.whse, 'TRFR')
+        t_h = TransferHeader(**num._asdict(), created_by=curr_user.id, updated_by=curr_user.id,
                              **data['header'])
-        t_h.objtype = obj.objtype
 
-        # add 1 to series next num
-        series.next_num += 1
-
-        db.session.add_all([t_h, series])
+        db.session.add(t_h)
         db.session.flush()
 
         for row in details:
             # add to user whse to data dictionary as from whse
             row['from_whse'] = curr_user.whse
-            check = Check(**row)
 
-            # check if valid
-            if not check.itemcode_exist():
-                raise Exception("Invalid itemcode!")
-            elif not check.uom_exist():
-                raise Exception("Invalid uom!")
-            elif not check.towhse_exist():
-                raise Exception("Invalid to whse code!")
+        # check if valid
+        error = DocumentCheck(details).first_error('itemcode', 'uom', 'towhse')
+        if error:
+            raise Exception(error)
+
+        for row in details:
             if row['from_whse'] != curr_user.whse:
                 raise Exception("Invalid from_whse!")
             if not row['quantity']:
                 raise Exception("Quantity is less than 1.")
 
-            # query first the quantity of inventory
-            whseinv = WhseInv.query.filter_by(warehouse=row['from_whse'],
-                                              item_code=row['item_code']).first()
-
-            # if below quantity raise an error!
-            if row['quantity'] > whseinv.quantity:
-                raise Exception("Below quantity stock!")
-
             # table row
             t_r = TransferRow(transfer_id=t_h.id, transnumber=t_h.transnumber,
                               created_by=curr_user.id, updated_by=curr_user.id,
                               sap_number=t_h.sap_number, objtype=t_h.objtype, **row)
 
             db.session.add(t_r)
-            db.session.flush()
 
         db.session.commit()
         trans_schema = TransferHeaderSchema()
@@ -120,6 +95,9 @@ def get_all_transfer(curr_user):
     try:
 
         data = request.args.to_dict()
+        # transdate is nullable, the transfers are paged by id
+        page = KeysetPagination(data, TransferHeader.id)
+        stream = StreamResponse(data)
         date = ''
         user_filt = []
         filt = []
@@ -154,7 +132,7 @@ def get_all_transfer(curr_user):
         whse_filters = BaseQuery.create_query_filter(Warehouses, filters={"and": whse_filt})
 
         if date:
-            trans_filters.append((func.cast(TransferHeader.transdate, DATE) == date))
+            trans_filters.append((BaseQuery.on_date(TransferHeader.transdate, date)))
 
         transfer = db.session.query(TransferHeader).\
             select_from(TransferHeader).\
@@ -165,12 +143,14 @@ def get_all_transfer(curr_user):
                  *trans_filters,
                  *user_filters,
                  *row_filters,
-                 *whse_filters)).all()
+                 *whse_filters))
 
         trans_schema = TransferHeaderSchema(many=True, only=("id", "transnumber", "sap_number",
                                                              "transdate", "remarks", "docstatus", "reference"))
-        result = trans_schema.dump(transfer)
-        return ResponseMessage(True, data=result).resp()
+        if stream.enabled:
+            return stream.resp(page.stream(transfer, schema=trans_schema), schema=trans_schema, filename='transfer')
+        result = trans_schema.dump(page.all(transfer, schema=trans_schema))
+        return ResponseMessage(True, count=len(result), data=result, page=page).resp()
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
         return ResponseMessage(True, message=f'{err}').resp(), 500
     except Exception as err:
@@ -186,7 +166,7 @@ def transfer_details(curr_user, id):
     trans_schema = TransferHeaderSchema(only=("id", "transnumber", "sap_number",
                                               "transdate", "remarks", "docstatus", "reference", "transrow"))
     try:
-        transfer = TransferHeader.query.get(id)
+        transfer = TransferHeader.query.for_dump(trans_schema).get(id)
 
         result = trans_schema.dump(transfer)
         return ResponseMessage(True, data=result).resp()
@@ -206,8 +186,7 @@ def cancel_transfer(curr_user, id):
         return ResponseMessage(False, message="Unauthorized user!").resp(), 401
 
     # query the whse
-    whse = Warehouses.query.filter_by(whsecode=curr_user.whse).first()
-    if whse.is_cutoff():
+    if Warehouses.cutoff_of(curr_user.whse):
         return ResponseMessage(False, message="Your warehouse cutoff is enable!").resp(), 401
 
     data = request.get_json()
@@ -250,12 +229,15 @@ def get_for_receive(curr_user):
         return ResponseMessage(False, message="Unauthorized user!").resp(), 401
 
     try:
-        transfer = db.session.query(TransferHeader).join(TransferRow).filter(and_(
-            TransferHeader.docstatus == 'O', TransferRow.to_whse == curr_user.whse)).all()
-
         trans_schema = TransferHeaderSchema(many=True, only=(
             "id", "seriescode", "transnumber", "reference", "objtype", "sap_number", "docstatus", "transdate",
             "remarks", "transrow"))
+        # once per transfer, with all its rows loaded in one query
+        transfer = db.session.query(TransferHeader).filter(and_(
+            TransferHeader.docstatus == 'O',
+            TransferHeader.transrow.any(TransferRow.to_whse == curr_user.whse))).\
+            for_dump(trans_schema).all()
+
         result = trans_schema.dump(transfer)
         return ResponseMessage(True, data=result).resp()
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
@@ -267,13 +249,13 @@ def get_for_receive(curr_user):
 # Create Receive
 @inventory.route('/api/inv/recv/new', methods=['POST'])
 @token_required
+@idempotent
 def create_receive(curr_user):
     if not curr_user.can_receive():
         return ResponseMessage(False, message="Unauthorized user!").resp(), 401
 
     # query the whse
-    whse = Warehouses.query.filter_by(whsecode=curr_user.whse).first()
-    if whse.is_cutoff():
+    if Warehouses.cutoff_of(curr_user.whse):
         return ResponseMessage(False, message="Your warehouse cutoff is enable!").resp(), 401
 
     data = request.get_json()
@@ -295,36 +277,19 @@ def create_receive(curr_user):
             return ResponseMessage(False, message="No data in details argument!").resp(), 401
 
     try:
-        obj = ObjectType.query.filter_by(code='RCVE').first()
-        series = Series.query.filter_by(
-            whsecode=curr_user.whse, objtype=obj.objtype).first()
-        if series.next_num + 1 > series.end_num:
-            raise Exception("Series number already in max!")
-        if not series:
-            raise Exception("Invalid Series")
-
-        reference = f"{series.code}-{obj.code}-{series.next_num}"
-
-        # add to header
-        data['header']['series'] = series.id
-        data['header']['objtype'] = obj.objtype
-        data['header']['seriescode'] = series.code
-        data['header']['transnumber'] = series.next_num
-        data['header']['reference'] = reference
-
-        r_h = ReceiveHeader(**data['header'])
-
-        # add 1 to series next num
-        series.next_num += 1
-
-        it = ITHeader.query.filter(and_(ITHeader.docnum == r_h.sap_number, 
+        it = ITHeader.query.filter(and_(ITHeader.docnum == data['header'].get('sap_number'),
                                         ITHeader.docstatus.in_(['C', 'N']))).first()
         if it:
             if it.docstatus == 'C':
                 raise Exception("Document is already closed!")
             raise Exception("Document is already canceled!")
 
-        db.session.add_all([r_h, series])
+        # add to header
+        data['header'].update(series_allocator.allocate(curr_user.whse, 'RCVE')._asdict())
+
+        r_h = ReceiveHeader(**data['header'])
+
+        db.session.add(r_h)
         db.session.flush()
 
         # if SAP IT
@@ -336,15 +301,12 @@ def create_receive(curr_user):
                 else:
                     r_h.docstatus = 'C'
 
+            # check if valid
+            error = DocumentCheck(details).first_error('itemcode', 'uom', 'towhse')
+            if error:
+                raise Exception(error)
+
             for row in details:
-                check = Check(**row)
-                # check if valid
-                if not check.itemcode_exist():
-                    raise Exception("Invalid itemcode!")
-                elif not check.uom_exist():
-                    raise Exception("Invalid uom!")
-                elif not check.towhse_exist():
-                    raise Exception("Invalid to whse code!")
                 if row['to_whse'] != curr_user.whse:
                     raise Exception(
                         "Invalid to_whse must be current user whse!")
@@ -365,17 +327,14 @@ def create_receive(curr_user):
                 else:
                     r_h.docstatus = 'C'
 
+            # check if valid
+            error = DocumentCheck(details).first_error('itemcode', 'uom', 'towhse')
+            if error:
+                raise Exception(error)
+
             for row in details:
-                check = Check(**row)
                 data['from_whse'] = data['header']['supplier']
                 data['to_whse'] = curr_user.whse
-                # check if valid
-                if not check.itemcode_exist():
-                    raise Exception("Invalid itemcode!")
-                elif not check.uom_exist():
-                    raise Exception("Invalid uom!")
-                elif not check.towhse_exist():
-                    raise Exception("Invalid to whse code!")
                 if row['to_whse'] != curr_user.whse:
                     raise Exception("Invalid to_whse must be current user whse!")
 
@@ -402,15 +361,12 @@ def create_receive(curr_user):
                 if not trans_row:
                     raise Exception("No transfer rows!")
 
+                # check if valid
+                error = DocumentCheck(details).first_error('itemcode', 'uom', 'towhse')
+                if error:
+                    raise Exception(error)
+
                 for row in details:
-                    check = Check(**row)
-                    # check if valid
-                    if not check.itemcode_exist():
-                        raise Exception("Invalid item code!")
-                    elif not check.uom_exist():
-                        raise Exception("Invalid uom!")
-                    elif not check.towhse_exist():
-                        raise Exception("Invalid to whse code!")
                     if row['to_whse'] != curr_user.whse:
                         raise Exception(
                             "Invalid to_whse must be current user whse!")
@@ -427,17 +383,16 @@ def create_receive(curr_user):
         elif data['header']['transtype'] not in ['TRFR', 'SAPIT', 'SAPPO']:
             for row in details:
                 row['to_whse'] = curr_user.whse
-                check = Check(**row)
-                # check if valid
-                if r_h.type2.upper() == 'SAPIT':
-                    if not check.fromwhse_exist():
-                        raise Exception("Invalid from whse code!")
-                if not check.itemcode_exist():
-                    raise Exception("Invalid item code!")
-                elif not check.uom_exist():
-                    raise Exception("Invalid uom!")
-                elif not check.towhse_exist():
-                    raise Exception("Invalid from whse code!")
+
+            # check if valid
+            checks = ['itemcode', 'uom', 'towhse']
+            if r_h.type2.upper() == 'SAPIT':
+                checks.insert(0, 'fromwhse')
+            error = DocumentCheck(details).first_error(*checks)
+            if error:
+                raise Exception(error)
+
+            for row in details:
                 if row['to_whse'] != curr_user.whse:
                     raise Exception("Invalid to_whse!")
 
@@ -485,6 +440,9 @@ def get_all_recv(curr_user):
     try:
 
         data = request.args.to_dict()
+        # transdate is nullable, the receipts are paged by id
+        page = KeysetPagination(data, ReceiveHeader.id)
+        stream = StreamResponse(data)
         date = ''
         filt = []
         row_filt = []
@@ -514,7 +472,7 @@ def get_all_recv(curr_user):
         whse_filters = BaseQuery.create_query_filter(Warehouses, filters={"and": whse_filt})
 
         if date:
-            rec_filters.append((func.cast(ReceiveHeader.transdate, DATE) == date))
+            rec_filters.append((BaseQuery.on_date(ReceiveHeader.transdate, date)))
 
         receive = db.session.query(ReceiveHeader).\
             select_from(ReceiveHeader).\
@@ -522,16 +480,17 @@ def get_all_recv(curr_user):
             join(Warehouses, ReceiveRow.to_whse == Warehouses.whsecode).\
             filter(and_(*rec_filters,
                         *row_filters,
-                        *whse_filters)).\
-            all()
+                        *whse_filters))
 
         recv_schema = ReceiveHeaderSchema(many=True, only=("id", "series", "seriescode", "transnumber",
                                                            "sap_number", "docstatus", "transtype", "transdate",
                                                            "reference",
                                                            "reference2",
                                                            "remarks"))
-        result = recv_schema.dump(receive)
-        return ResponseMessage(True, count=len(result), data=result).resp()
+        if stream.enabled:
+            return stream.resp(page.stream(receive, schema=recv_schema), schema=recv_schema, filename='receive')
+        result = recv_schema.dump(page.all(receive, schema=recv_schema))
+        return ResponseMessage(True, count=len(result), data=result, page=page).resp()
 
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
         return ResponseMessage(True, message=f'{err}').resp(), 500
@@ -551,7 +510,7 @@ def get_recv_details(curr_user, id):
                                             "remarks", "recrow"))
 
     try:
-        receive = ReceiveHeader.query.get(id)
+        receive = ReceiveHeader.query.for_dump(recv_schema).get(id)
         result = recv_schema.dump(receive)
         return ResponseMessage(True, data=result).resp()
 
@@ -571,8 +530,7 @@ def cancel_recv(curr_user, id):
         return ResponseMessage(False, message="Unauthorized user!").resp(), 401
 
     # query the whse
-    whse = Warehouses.query.filter_by(whsecode=curr_user.whse).first()
-    if whse.is_cutoff():
+    if Warehouses.cutoff_of(curr_user.whse):
         return ResponseMessage(False, message="Your warehouse cutoff is enable!").resp(), 401
 
     data = request.get_json()
@@ -669,73 +627,67 @@ def get_whseinv(curr_user):
 @token_required
 def get_inventory_report_per_whse(curr_user):
     try:
+        stream = StreamResponse(request.args.to_dict())
         branch = request.args.get('branch')
         whse = request.args.get('whse')
         from_date = request.args.get('from_date')
         to_date = request.args.get('to_date')
-        query = """
-            Declare @branch varchar(100)
-            Declare @whse varchar(100)
-            Declare @fromdate varchar(100)
-            Declare @todate varchar(100)
-            
-            SET @branch = '{}'
-            SET @whse = '{}'
-            SET @fromdate = '{}'
-            SET @todate = '{}'
-            
-            SELECT x.*
-            , x.[Beginning] + x.[Received] + x.TransferIn + x.AdjIn [TotalIn]
-            , x.[Beginning] + x.[Received] + x.TransferIn + x.AdjIn - x.AdjOut - x.[Transferred] - x.PullOut - x.[Sold] [Available]
-            FROM(
-            SELECT 
-                a1.item_code,
-                ISNULL((SELECT SUM(T1.inqty-T1.outqty) 
-                    FROM tblwhstransaction T1 inner join tblwhses T2 on T1.warehouse = T2.whsecode
-                    WHERE T1.item_code = a1.item_code 
-                    and (@whse IS NULL OR T1.warehouse = @whse) and (@branch IS NULL or T2.branch = @branch)
-                    and (@fromdate IS NULL OR T1.transdate < @fromdate)
-                    ),0) [Beginning],
-
-                SUM(ISNULL(CASE WHEN a1.objtype = 2 and a3.transtype != 'TRFR' and (@fromdate IS NULL OR CAST(a1.transdate as DATE) >= @fromdate) 
-            and (@todate IS NULL OR CAST(a1.transdate as DATE) <= @todate) 
-                    THEN a1.inqty - a1.outqty
-                    END,0)) [Received],
-
-				SUM(ISNULL(CASE WHEN a1.objtype = 2 and a3.transtype = 'TRFR' and (@fromdate IS NULL OR CAST(a1.transdate as DATE) >= @fromdate) 
-            and (@todate IS NULL OR CAST(a1.transdate as DATE) <= @todate) 
-                    THEN a1.inqty - a1.outqty
-                    END,0)) [TransferIn],
-
-				SUM(ISNULL(CASE WHEN a1.objtype = 9 and (@fromdate IS NULL OR CAST(a1.transdate as DATE) >= @fromdate) 
-            and (@todate IS NULL OR CAST(a1.transdate as DATE) <= @todate) 
-                    THEN a1.inqty - a1.outqty
-                    END,0)) [AdjIn],
-				SUM(ISNULL(CASE WHEN a1.objtype = 12 and (@fromdate IS NULL OR CAST(a1.transdate as DATE) >= @fromdate) 
-            and (@todate IS NULL OR CAST(a1.transdate as DATE) <= @todate) 
-                    THEN a1.outqty - a1.inqty
-                    END,0)) [AdjOut],
-                SUM(ISNULL(CASE WHEN a1.objtype = 1 and (@fromdate IS NULL OR CAST(a1.transdate as DATE) >= @fromdate) 
-            and (@todate IS NULL OR CAST(a1.transdate as DATE) <= @todate) 
-                    THEN a1.outqty - a1.inqty
-                    END,0)) [Transferred],
-				SUM(ISNULL(CASE WHEN a1.objtype = 11 and (@fromdate IS NULL OR CAST(a1.transdate as DATE) >= @fromdate) 
-            and (@todate IS NULL OR CAST(a1.transdate as DATE) <= @todate) 
-                    THEN a1.outqty - a1.inqty
-                    END,0)) [PullOut],
-                SUM(ISNULL(CASE WHEN a1.objtype = 3 and (@fromdate IS NULL OR CAST(a1.transdate as DATE) >= @fromdate) 
-            and (@todate IS NULL OR CAST(a1.transdate as DATE) <= @todate) 
-                    THEN  a1.outqty - a1.inqty
-                    END,0)) [Sold]
-            
-            FROM tblwhstransaction a1 
-            inner join tblwhses a2 on a1.warehouse = a2.whsecode
-			left join tblreceive a3 on a1.objtype = a3.objtype and a1.trans_id = a3.id
-            where (@branch IS NULL OR branch = @branch)
-            and (@whse IS NULL OR warehouse = @whse)
-            GROUP BY a1.item_code)x"""
-        execute = db.engine.execute(query.format(branch, whse, from_date, to_date))
-        result = [dict(row) for row in execute]
+        whses = db.session.query(Warehouses.whsecode)
+        if branch:
+            whses = whses.filter(Warehouses.branch == branch)
+        if whse:
+            whses = whses.filter(Warehouses.whsecode == whse)
+        whsecodes = [w.whsecode for w in whses]
+
+        # movements of the period per type, from the daily rollup
+        daily = InvMovementDaily
+        filters = [daily.warehouse.in_(whsecodes)]
+        if from_date:
+            filters.append(daily.movement_date >= from_date)
+        if to_date:
+            filters.append(daily.movement_date <= to_date)
+        in_qty = daily.inqty - daily.outqty
+        out_qty = daily.outqty - daily.inqty
+
+        def total(movement, quantity):
+            return func.sum(case([(daily.movement == movement, quantity)], else_=0))
+
+        movements = db.session.query(
+            daily.item_code.label('item_code'),
+            literal_column('0').label('Beginning'),
+            total('received', in_qty).label('Received'),
+            total('transfer_in', in_qty).label('TransferIn'),
+            total('adj_in', in_qty).label('AdjIn'),
+            total('adj_out', out_qty).label('AdjOut'),
+            total('transferred', out_qty).label('Transferred'),
+            total('pullout', out_qty).label('PullOut'),
+            total('sold', out_qty).label('Sold')
+        ).filter(and_(*filters)).group_by(daily.item_code)
+        parts = [movements.subquery().select()]
+
+        # latest snapshot and the movements since, instead of the whole history
+        if from_date:
+            beginning = WhseInvSnapshot.balances(whsecodes, from_date).alias('beginning')
+            zero = literal_column('0')
+            parts.append(select([beginning.c.item_code, beginning.c.quantity.label('Beginning'),
+                                 zero.label('Received'), zero.label('TransferIn'), zero.label('AdjIn'),
+                                 zero.label('AdjOut'), zero.label('Transferred'), zero.label('PullOut'),
+                                 zero.label('Sold')]))
+
+        x = union_all(*parts).alias('x')
+        columns = ('Beginning', 'Received', 'TransferIn', 'AdjIn', 'AdjOut', 'Transferred', 'PullOut', 'Sold')
+        report = select([x.c.item_code] + [func.sum(x.c[col]).label(col) for col in columns]
+                        ).group_by(x.c.item_code).order_by(x.c.item_code)
+
+        def report_row(row):
+            row = dict(row)
+            row['TotalIn'] = row['Beginning'] + row['Received'] + row['TransferIn'] + row['AdjIn']
+            row['Available'] = row['TotalIn'] - row['AdjOut'] - row['Transferred'] - row['PullOut'] - row['Sold']
+            return row
+
+        if stream.enabled:
+            return stream.resp(lambda: db.session.execute(report), dump=report_row, filename='inventory_report')
+        result = [report_row(row) for row in db.session.execute(report)]
         return ResponseMessage(True, data=result).resp()
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
         return ResponseMessage(False, message=f"{err}").resp(), 500
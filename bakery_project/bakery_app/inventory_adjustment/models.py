@@ -1,7 +1,7 @@
 from datetime import datetime
 from bakery_app import db
-from bakery_app.inventory.models import WhseInv, InvTransaction
-from sqlalchemy import event
+from bakery_app._events import session_events
+from bakery_app.inventory.models import StockPosting
 
 
 class ItemAdjustmentIn(db.Model):
@@ -84,27 +84,25 @@ class ItemAdjustmentOutRow(db.Model):
     date_updated = db.Column(db.DateTime, nullable=False, default=datetime.now)
 
 
-@event.listens_for(db.session, "before_flush")
-def insert_update(*args):
-    sess = args[0]
-    for obj in sess.new:
-
-        # Insert to InvTransaction and Update Whse Inv if Adjustment In transaction
-        if isinstance(obj, ItemAdjustmentInRow):
-            header = ItemAdjustmentIn.query.filter_by(
-                id=obj.adjustin_id).first()
-            whseinv = WhseInv.query.filter_by(warehouse=obj.whsecode,
-                                              item_code=obj.item_code).first()
-            whseinv.quantity += obj.quantity
-
-            invtrans = InvTransaction(series_code=header.seriescode, trans_id=obj.adjustin_id,
-                                      trans_num=header.transnumber, objtype=header.objtype, item_code=obj.item_code,
-                                      inqty=obj.quantity, uom=obj.uom, warehouse=obj.whsecode, warehouse2=obj.whsecode,
-                                      transdate=header.transdate, created_by=header.created_by,
-                                      updated_by=header.updated_by,
-                                      reference=header.reference, sap_number=header.sap_number)
-
-            db.session.add_all([whseinv, invtrans])
-
-        else:
-            continue
+# Insert to InvTransaction and Update Whse Inv if Adjustment In transaction
+@session_events.listens_for("before_flush", ItemAdjustmentInRow)
+def adjustment_in_insert(sess, obj):
+    header = ItemAdjustmentIn.query.get(obj.adjustin_id)
+    StockPosting.of(sess).add(obj.whsecode, obj.item_code, inqty=obj.quantity,
+                              series_code=header.seriescode, trans_id=obj.adjustin_id,
+                              trans_num=header.transnumber, objtype=header.objtype, uom=obj.uom,
+                              warehouse2=obj.whsecode, transdate=header.transdate,
+                              created_by=header.created_by, updated_by=header.updated_by,
+                              reference=header.reference, sap_number=header.sap_number)
+
+
+# Insert to InvTransaction and Update Whse Inv if Adjustment Out transaction
+@session_events.listens_for("before_flush", ItemAdjustmentOutRow)
+def adjustment_out_insert(sess, obj):
+    header = ItemAdjustmentOut.query.get(obj.adjustout_id)
+    StockPosting.of(sess).add(obj.whsecode, obj.item_code, outqty=obj.quantity, check_stock=True,
+                              series_code=header.seriescode, trans_id=obj.adjustout_id,
+                              trans_num=header.transnumber, objtype=header.objtype, uom=obj.uom,
+                              warehouse2=obj.whsecode, transdate=header.transdate,
+                              created_by=header.created_by, updated_by=header.updated_by,
+                              reference=header.reference, sap_number=header.sap_number)
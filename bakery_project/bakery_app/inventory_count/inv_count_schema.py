@@ -1,3 +1,5 @@
+from sqlalchemy.orm import selectinload
+
 from bakery_app import ma
 from .models import CountingInventoryHeader, CountingInventoryRow, FinalInvCountRow, FinalInvCount
 
@@ -56,3 +58,5 @@ class FinalCountSchema(ma.SQLAlchemyAutoSchema):
         include_fk = True
 
     row = ma.Nested(FinalCountRowSchema, many=True)
+
+    relationship_loaders = {'row': selectinload}
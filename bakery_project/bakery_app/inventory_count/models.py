@@ -12,7 +12,7 @@ class CountingInventoryHeader(db.Model):
     seriescode = db.Column(db.String(50), nullable=False)  # series code
     transnumber = db.Column(db.Integer, nullable=False)  # series next_num
     objtype = db.Column(db.Integer, db.ForeignKey('tblobjtype.objtype'), nullable=False)
-    transdate = db.Column(db.DateTime, nullable=False)
+    transdate = db.Column(db.DateTime, nullable=False, index=True)
     reference = db.Column(db.String(100), nullable=False)  # seriescode + number
     remarks = db.Column(db.String(250))
     docstatus = db.Column(db.String(10), default='C', nullable=False)
@@ -52,7 +52,7 @@ class FinalInvCount(db.Model):
     seriescode = db.Column(db.String(50), nullable=False)  # series code
     transnumber = db.Column(db.Integer, nullable=False)  # series next_num
     objtype = db.Column(db.Integer, db.ForeignKey('tblobjtype.objtype'), nullable=False)
-    transdate = db.Column(db.DateTime, nullable=False)
+    transdate = db.Column(db.DateTime, nullable=False, index=True)
     reference = db.Column(db.String(100), nullable=False)  # seriescode + number
     remarks = db.Column(db.String(250))
     docstatus = db.Column(db.String(10), default='C', nullable=False)
@@ -2,13 +2,14 @@ import pyodbc
 
 from datetime import datetime
 from flask import Blueprint, request
-from sqlalchemy import exc, and_, cast, DATE, func, case
+from sqlalchemy import exc, and_, DATE, String, bindparam, func, case, text
 
 from bakery_app import db
-from bakery_app._utils import Check, ResponseMessage
+from bakery_app._helpers import BaseQuery
+from bakery_app._utils import DocumentCheck, ResponseMessage
 from bakery_app.customers.models import Customer
 from bakery_app.sales.models import SalesHeader, SalesRow
-from bakery_app.branches.models import Series, ObjectType, Warehouses
+from bakery_app.branches.models import Warehouses, SeriesError, series_allocator
 from bakery_app.users.routes import token_required
 from bakery_app.items.models import PriceListRow, PriceListHeader, Items
 from bakery_app.inventory.models import WhseInv
@@ -29,8 +30,7 @@ def create_inv_count(curr_user):
     if not curr_user.is_admin() and not curr_user.is_allow_ending():
         return ResponseMessage(False, message="Unauthorized user!").resp(), 401
 
-    whse = Warehouses.query.filter_by(whsecode=curr_user.whse).first()
-    if not whse.is_cutoff():
+    if not Warehouses.cutoff_of(curr_user.whse):
         return ResponseMessage(False, message="Cutoff is disable").resp(), 401
 
     date = request.args.get('date')
@@ -38,15 +38,16 @@ def create_inv_count(curr_user):
     if request.method == 'GET':
         try:
             if not curr_user.is_manager():
-                whse_inv_case = case([(WhseInv.quantity != 0, 1)], else_=0)
-                inv = db.session.query(WhseInv.item_code,
-                                       WhseInv.item_code,
-                                       WhseInv.quantity,
+                # all the items, no WhseInv row is zero quantity
+                quantity = func.isnull(WhseInv.quantity, 0)
+                whse_inv_case = case([(quantity != 0, 1)], else_=0)
+                inv = db.session.query(Items.item_code,
+                                       quantity.label('quantity'),
                                        Items.uom
-                                       ).filter(WhseInv.warehouse == curr_user.whse
-                                                ).outerjoin(
-                    Items, Items.item_code == WhseInv.item_code
-                ).order_by(whse_inv_case.desc(), WhseInv.item_code
+                                       ).outerjoin(
+                    WhseInv, and_(WhseInv.item_code == Items.item_code,
+                                  WhseInv.warehouse == curr_user.whse)
+                ).order_by(whse_inv_case.desc(), Items.item_code
                            ).all()
                 inv_schema = WhseInvSchema(many=True)
                 result = inv_schema.dump(inv)
@@ -58,7 +59,7 @@ def create_inv_count(curr_user):
                 auditor_case = case([(count_header.user_type == 'auditor', count_row.actual_count)])
                 inv = db.session.query(
                     count_row.item_code,
-                    WhseInv.quantity.label('quantity'),
+                    func.isnull(WhseInv.quantity, 0).label('quantity'),
                     func.sum(func.isnull(sales_case, 0)).label('sales_count'),
                     func.sum(func.isnull(auditor_case, 0)).label('auditor_count'),
                     func.sum(func.isnull(sales_case, 0) - func.isnull(auditor_case, 0)).label('variance'),
@@ -66,7 +67,7 @@ def create_inv_count(curr_user):
                 ).outerjoin(WhseInv,
                             and_(count_row.whsecode == WhseInv.warehouse, WhseInv.item_code == count_row.item_code)
                             ).filter(
-                    and_(cast(count_header.transdate, DATE) == date,
+                    and_(BaseQuery.on_date(count_header.transdate, date),
                          count_row.whsecode == curr_user.whse,
                          count_header.id == count_row.counting_id,
                          False == count_header.confirm
@@ -102,52 +103,28 @@ def create_inv_count(curr_user):
 
             if CountingInventoryHeader.query.filter(
                     and_(CountingInventoryHeader.user_type == header['user_type'],
-                         func.cast(CountingInventoryHeader.transdate, DATE) == header['transdate'],
+                         BaseQuery.on_date(CountingInventoryHeader.transdate, header['transdate']),
                          CountingInventoryHeader.docstatus == 'C',
                          False == CountingInventoryHeader.confirm)).first():
                 return ResponseMessage(False, message=f"You're already added ending inventory this day").resp(), 401
 
-            obj = ObjectType.query.filter_by(code='ICNT').first()
-
-            # Check if has objtype
-            if not obj:
-                return ResponseMessage(False, message="Object type not found!").resp(), 401
-
-            # query the series
-            series = Series.query.filter_by(whsecode=curr_user.whse, objtype=obj.objtype).first()
-
-            # check if has series
-            if not series:
-                return ResponseMessage(False, message="Series not found!").resp(), 401
-
-            # check if next num is not greater done end num
-            if series.next_num + 1 > series.end_num:
-                return ResponseMessage(False, message="Series number is greater than next num!").resp(), 401
-
-            # construct reference
-            reference = f"{series.code}-{obj.code}-{series.next_num}"
-
-            # add to header
-            header['series'] = series.id
-            header['objtype'] = obj.objtype
-            header['seriescode'] = series.code
-            header['transnumber'] = series.next_num
-            header['reference'] = reference
-
-            # add 1 to next series
-            series.next_num += 1
+            # add the series number to header
+            try:
+                header.update(series_allocator.allocate(curr_user.whse, 'ICNT')._asdict())
+            except SeriesError as err:
+                return ResponseMessage(False, message=f"{err}").resp(), 401
 
             inv_count_header = CountingInventoryHeader(**header)
-            db.session.add_all([series, inv_count_header])
+            db.session.add(inv_count_header)
             db.session.flush()
 
+            # check if valid
+            error = DocumentCheck(rows).first_error('itemcode')
+            if error:
+                raise Exception(error)
+
             for row in rows:
                 row['whsecode'] = curr_user.whse
-                check = Check(**row)
-                # check if valid
-                if not check.itemcode_exist():
-                    raise Exception("Invalid item code!")
-
                 inv_count_row = CountingInventoryRow(counting_id=inv_count_header.id, **row)
                 inv_count_row.objtype = inv_count_header.objtype
                 inv_count_row.created_by = inv_count_header.created_by
@@ -169,27 +146,13 @@ def create_inv_count(curr_user):
             db.session.close()
 
 
-# Confirm Actual Ending
-@inventory_count.route('/count/confirm', methods=['GET', 'PUT'])
-@token_required
-def inv_count_confirm(curr_user):
-    if (not curr_user.is_manager() or not curr_user.is_admin()) and not curr_user.is_allow_ending():
-        return ResponseMessage(False, message="Unauthorized user!").resp(), 401
-
-    date = request.args.get('transdate')
-
-    # create an instance
-    count_header = CountingInventoryHeader
-    count_row = CountingInventoryRow
-    po_req_header = PullOutHeaderRequest
-    po_req_row = PullOutRowRequest
-
-    final_count = """
-        DECLARE @date varchar(20)
+# System quantity against the final sales/auditor/manager count and pull out of the day
+FINAL_COUNT = text("""
+        DECLARE @date datetime
         DECLARE @whse varchar(30)
         
-        SET @date = '{}' 
-        SET @whse = '{}'
+        SET @date = CAST(:date AS DATE)
+        SET @whse = :whse
 
         SELECT
         y.item_code, y.quantity, 
@@ -220,64 +183,82 @@ def inv_count_confirm(curr_user):
             , x.uom
 
             FROM
-            (SELECT tblwhseinv.item_code, tblwhseinv.quantity AS quantity, 
+            (SELECT tblitems.item_code, ISNULL(tblwhseinv.quantity, 0) AS quantity, 
         
             (SELECT sum(tblcounting_inv_row.actual_count) AS sum_1 FROM tblcounting_inv_row, tblcounting_inv WHERE 
-            CAST(tblcounting_inv.transdate AS DATE) = @date AND tblcounting_inv.confirm = 0 AND tblwhseinv.item_code 
+            tblcounting_inv.transdate >= @date AND tblcounting_inv.transdate < DATEADD(day, 1, @date) AND tblcounting_inv.confirm = 0 AND tblitems.item_code 
             = tblcounting_inv_row.item_code and tblcounting_inv_row.counting_id = tblcounting_inv.id and 
             tblcounting_inv.user_type = 'sales') AS ending_sales_count 
         
             ,(SELECT sum(tblcounting_inv_row.actual_count) AS sum_1 FROM tblcounting_inv_row, tblcounting_inv WHERE 
-            CAST(tblcounting_inv.transdate AS DATE) = @date AND tblcounting_inv.confirm = 0 AND tblwhseinv.item_code 
+            tblcounting_inv.transdate >= @date AND tblcounting_inv.transdate < DATEADD(day, 1, @date) AND tblcounting_inv.confirm = 0 AND tblitems.item_code 
             = tblcounting_inv_row.item_code and tblcounting_inv_row.counting_id = tblcounting_inv.id and 
             tblcounting_inv.user_type = 'auditor') AS ending_auditor_count 
         
             ,(SELECT sum(tblcounting_inv_row.actual_count) AS sum_1 FROM tblcounting_inv_row, tblcounting_inv WHERE 
-            CAST(tblcounting_inv.transdate AS DATE) = @date AND tblcounting_inv.confirm = 0 AND tblwhseinv.item_code 
+            tblcounting_inv.transdate >= @date AND tblcounting_inv.transdate < DATEADD(day, 1, @date) AND tblcounting_inv.confirm = 0 AND tblitems.item_code 
             = tblcounting_inv_row.item_code and tblcounting_inv_row.counting_id = tblcounting_inv.id and 
             tblcounting_inv.user_type = 'manager') AS ending_manager_count 
         
-            , (SELECT sum(tblpulloutreqrow.quantity) AS sum_2 FROM tblpulloutreqrow, tblpulloutreq WHERE CAST(
-            tblpulloutreq.transdate AS DATE) = @date AND tblpulloutreq.confirm = 0 AND tblwhseinv.item_code = 
+            , (SELECT sum(tblpulloutreqrow.quantity) AS sum_2 FROM tblpulloutreqrow, tblpulloutreq WHERE tblpulloutreq.transdate >= @date
+            AND tblpulloutreq.transdate < DATEADD(day, 1, @date) AND tblpulloutreq.confirm = 0 AND tblitems.item_code = 
             tblpulloutreqrow.item_code and tblpulloutreqrow.pulloutreq_id = tblpulloutreq.id and 
             tblpulloutreq.user_type = 'sales') AS po_sales_count 
         
-            , (SELECT sum(tblpulloutreqrow.quantity) AS sum_2 FROM tblpulloutreqrow, tblpulloutreq WHERE CAST(
-            tblpulloutreq.transdate AS DATE) = @date AND tblpulloutreq.confirm = 0 AND tblwhseinv.item_code = 
+            , (SELECT sum(tblpulloutreqrow.quantity) AS sum_2 FROM tblpulloutreqrow, tblpulloutreq WHERE tblpulloutreq.transdate >= @date
+            AND tblpulloutreq.transdate < DATEADD(day, 1, @date) AND tblpulloutreq.confirm = 0 AND tblitems.item_code = 
             tblpulloutreqrow.item_code and tblpulloutreqrow.pulloutreq_id = tblpulloutreq.id and 
             tblpulloutreq.user_type = 'auditor') AS po_auditor_count 
         
-            , (SELECT sum(tblpulloutreqrow.quantity) AS sum_2 FROM tblpulloutreqrow, tblpulloutreq WHERE CAST(
-            tblpulloutreq.transdate AS DATE) = @date AND tblpulloutreq.confirm = 0 AND tblwhseinv.item_code = 
+            , (SELECT sum(tblpulloutreqrow.quantity) AS sum_2 FROM tblpulloutreqrow, tblpulloutreq WHERE tblpulloutreq.transdate >= @date
+            AND tblpulloutreq.transdate < DATEADD(day, 1, @date) AND tblpulloutreq.confirm = 0 AND tblitems.item_code = 
             tblpulloutreqrow.item_code and tblpulloutreqrow.pulloutreq_id = tblpulloutreq.id and 
             tblpulloutreq.user_type = 'manager') AS po_manager_count 
 
 			,(SELECT TOP 1 tbluser.username FROM tblcounting_inv_row, tblcounting_inv, tbluser WHERE 
-            CAST(tblcounting_inv.transdate AS DATE) = @date AND tblcounting_inv.confirm = 0 AND tblwhseinv.item_code 
+            tblcounting_inv.transdate >= @date AND tblcounting_inv.transdate < DATEADD(day, 1, @date) AND tblcounting_inv.confirm = 0 AND tblitems.item_code 
             = tblcounting_inv_row.item_code and tblcounting_inv_row.counting_id = tblcounting_inv.id and 
             tblcounting_inv.user_type = 'sales' and tblcounting_inv.created_by = tbluser.id) AS sales_user
 
 			,(SELECT TOP 1tbluser.username FROM tblcounting_inv_row, tblcounting_inv, tbluser WHERE 
-            CAST(tblcounting_inv.transdate AS DATE) = @date AND tblcounting_inv.confirm = 0 AND tblwhseinv.item_code 
+            tblcounting_inv.transdate >= @date AND tblcounting_inv.transdate < DATEADD(day, 1, @date) AND tblcounting_inv.confirm = 0 AND tblitems.item_code 
             = tblcounting_inv_row.item_code and tblcounting_inv_row.counting_id = tblcounting_inv.id and 
             tblcounting_inv.user_type = 'auditor' and tblcounting_inv.created_by = tbluser.id) AS auditor_user
 
 			,(SELECT TOP 1 tbluser.username FROM tblcounting_inv_row, tblcounting_inv, tbluser WHERE 
-            CAST(tblcounting_inv.transdate AS DATE) = @date AND tblcounting_inv.confirm = 0 AND tblwhseinv.item_code 
+            tblcounting_inv.transdate >= @date AND tblcounting_inv.transdate < DATEADD(day, 1, @date) AND tblcounting_inv.confirm = 0 AND tblitems.item_code 
             = tblcounting_inv_row.item_code and tblcounting_inv_row.counting_id = tblcounting_inv.id and 
             tblcounting_inv.user_type = 'manager' and tblcounting_inv.created_by = tbluser.id) AS manager_user
         
             , tblitems.uom 
-            FROM tblwhseinv LEFT OUTER JOIN tblitems ON tblwhseinv.item_code = tblitems.item_code 
-            WHERE tblwhseinv.warehouse = @whse)x)y
+            FROM tblitems LEFT OUTER JOIN tblwhseinv ON tblwhseinv.item_code = tblitems.item_code 
+            AND tblwhseinv.warehouse = @whse)x)y
             WHERE y.ending_final_count IS NOT NULL or y.po_final_count IS NOT NULL
-            ORDER BY y.item_code""".format(date, curr_user.whse)
+            ORDER BY y.item_code""").bindparams(
+    bindparam('date', type_=String), bindparam('whse', type_=String))
+
+
+# Confirm Actual Ending
+@inventory_count.route('/count/confirm', methods=['GET', 'PUT'])
+@token_required
+def inv_count_confirm(curr_user):
+    if (not curr_user.is_manager() or not curr_user.is_admin()) and not curr_user.is_allow_ending():
+        return ResponseMessage(False, message="Unauthorized user!").resp(), 401
+
+    date = request.args.get('transdate')
 
-    inv = db.engine.execute(final_count)
+    # create an instance
+    count_header = CountingInventoryHeader
+    count_row = CountingInventoryRow
+    po_req_header = PullOutHeaderRequest
+    po_req_row = PullOutRowRequest
+
+    # fetched up front, the confirm below writes on the same connection
+    inv = db.session.execute(FINAL_COUNT, {'date': date, 'whse': curr_user.whse}).fetchall()
 
     # query if there's inventory count to confirm
     count_inv = count_header.query.filter(
-        and_(count_header.confirm == False, cast(count_header.transdate, DATE) == date)).first()
+        and_(count_header.confirm == False, BaseQuery.on_date(count_header.transdate, date))).first()
     # if none return error message
     if not count_inv:
         return ResponseMessage(False, message="No inventory count to confirm").resp(), 401
@@ -312,30 +293,13 @@ def inv_count_confirm(curr_user):
             for_charge = [] # append here if variance is positive
             for_po = [] # append here if has final_po
 
-            # get the obj type of adjustment in
-            obj = ObjectType.query.filter_by(code='FNLC').first()
-
-            # Check if has objtype
-            if not obj:
-                return ResponseMessage(False, message="Object type not found!").resp(), 401
-
-            # query the series
-            series = Series.query.filter_by(whsecode=curr_user.whse, objtype=obj.objtype).first()
-
-            if not series:
-                return ResponseMessage(False, message="Series not found!").resp(), 401
-            # check if next num is not greater done end num
-            if series.next_num + 1 > series.end_num:
-                return ResponseMessage(False, message="Series number is greater than next num!").resp(), 401
-            # construct reference
-            reference = f"{series.code}-{obj.code}-{series.next_num}"
-
-            # check if next num is not greater done end num
-            # add to header
-            header = {'series': series.id, 'objtype': obj.objtype, 'seriescode': series.code,
-                    'transnumber': series.next_num, 'reference': reference,
-                    'remarks': 'Final Count', 'created_by': curr_user.id,
-                    'updated_by': curr_user.id, 'transdate': transdate}
+            # add the series number to header
+            try:
+                header = series_allocator.allocate(curr_user.whse, 'FNLC')._asdict()
+            except SeriesError as err:
+                return ResponseMessage(False, message=f"{err}").resp(), 401
+            header.update({'remarks': 'Final Count', 'created_by': curr_user.id,
+                           'updated_by': curr_user.id, 'transdate': transdate})
 
             f_c = FinalInvCount(**header)
             db.session.add(f_c)
@@ -344,8 +308,6 @@ def inv_count_confirm(curr_user):
             auditor_u = set()
             manager_u = set()
             for item in inv:
-                # get first then whse inv
-                item_bal = WhseInv.query.filter_by(item_code=item.item_code, warehouse=curr_user.whse).first()
                 # if the variance is negative which is the system inv is less than the actual
                 # then for adjustment in
                 if item.variance > 0:
@@ -386,41 +348,18 @@ def inv_count_confirm(curr_user):
             f_c.manager_user = str(manager_u).replace('{', '').replace('}', '')
             
             db.session.query(count_header).filter(
-                and_(count_header.confirm == False, cast(count_header.transdate, DATE) == date)
+                and_(count_header.confirm == False, BaseQuery.on_date(count_header.transdate, date))
             ).update({'confirm': True},synchronize_session=False)
 
             # if there's for adjustment in
             if for_adjustment_in:
-                # get the obj type of adjustment in
-                obj = ObjectType.query.filter_by(code='ADJI').first()
-                # Check if has objtype
-                if not obj:
-                    raise Exception("Object type not found!")
-
-                # query the series
-                series = Series.query.filter_by(whsecode=curr_user.whse, objtype=obj.objtype).first()
-                if not series:
-                    raise Exception("Series not found!")
-
-                # check if next num is not greater done end num
-                if series.next_num + 1 > series.end_num:
-                    raise Exception("Series number is greater than next num!")
-
-                # construct reference
-                reference = f"{series.code}-{obj.code}-{series.next_num}"
-
-                # check if next num is not greater done end num
-                # add to header
-                header = {'series': series.id, 'objtype': obj.objtype, 'seriescode': series.code,
-                        'transnumber': series.next_num, 'reference': reference,
-                        'remarks': 'Based on Ending balance variance', 'created_by': curr_user.id,
-                        'updated_by': curr_user.id, 'transdate': transdate}
+                # add the series number to header
+                header = series_allocator.allocate(curr_user.whse, 'ADJI')._asdict()
+                header.update({'remarks': 'Based on Ending balance variance', 'created_by': curr_user.id,
+                               'updated_by': curr_user.id, 'transdate': transdate})
 
                 adj_in = ItemAdjustmentIn(**header)
-                # add 1 to next series
-                series.next_num += 1
-
-                db.session.add_all([series, adj_in])
+                db.session.add(adj_in)
                 db.session.flush()
 
                 for row in for_adjustment_in:
@@ -439,51 +378,22 @@ def inv_count_confirm(curr_user):
             
             # if there's for charge
             if for_charge:
-                # get the obj type of adjustment in
-                obj = ObjectType.query.filter_by(code='SLES').first()
-                # Check if has objtype
-                if not obj:
-                    raise Exception("Object type not found!")
-                # query the series
-                series = Series.query.filter_by(whsecode=curr_user.whse, objtype=obj.objtype).first()
-                # check if has series
-                if not series:
-                    raise Exception("Series not found!")
-                # check if next num is not greater done end num
-                if series.next_num + 1 > series.end_num:
-                    raise Exception("Series number is greater than next num!")
-                # construct reference
-                reference = f"{series.code}-{obj.code}-{series.next_num}"
-
-                # add to data header
-                header = {'objtype': obj.objtype, 'series': series.id, 'seriescode': series.code,
-                        'transnumber': series.next_num, 'reference': reference,
-                        'remarks': 'Based on Ending balance variance', 'created_by': curr_user.id,
-                        'updated_by': curr_user.id, 'transtype': 'AR Sales', 'transdate': transdate}
-
                 cust = db.session.query(Customer).filter(
                     and_(Customer.whse == curr_user.whse,
                          Customer.code.contains('Inv Short'))
                 ).first()
-                header['cust_code'] = cust.code
-                header['cust_name'] = cust.name
-
-                sales = SalesHeader(**header)
 
-                # add 1 to next series
-                series.next_num += 1
+                # add the series number to data header
+                header = series_allocator.allocate(curr_user.whse, 'SLES')._asdict()
+                header.update({'remarks': 'Based on Ending balance variance', 'created_by': curr_user.id,
+                               'updated_by': curr_user.id, 'transtype': 'AR Sales', 'transdate': transdate,
+                               'cust_code': cust.code, 'cust_name': cust.name})
 
-                db.session.add_all([series, sales])
+                sales = SalesHeader(**header)
+                db.session.add(sales)
                 db.session.flush()
 
                 for row in for_charge:
-                    # query the inventory of warehouse
-                    whseinv = WhseInv.query.filter_by(item_code=row.item_code, warehouse=curr_user.whse).first()
-                    # check the quantity
-                    if row.variance > whseinv.quantity:
-                        raise Exception(f"{row['item_code'].title()} below qty!")
-
-                    item_bal = WhseInv.query.filter_by(item_code=row.item_code, warehouse=curr_user.whse).first()
                     sales_row = SalesRow()
                     sales_row.sales_id = sales.id
                     sales_row.item_code = row.item_code
@@ -520,49 +430,17 @@ def inv_count_confirm(curr_user):
             if for_po:
                 to_whse = data['po_whse']
                 sap_number = data['po_sap']
-                # get the obj type of adjustment in
-                obj = ObjectType.query.filter_by(code='POUT').first()
-                # Check if has objtype
-                if not obj:
-                    raise Exception("Object type not found!")
-
-                # query the series
-                series = Series.query.filter_by(
-                    whsecode=curr_user.whse, objtype=obj.objtype).first()
-                if not series:
-                    raise Exception("Series not found!")
-
-                # check if next num is not greater done end num
-                if series.next_num + 1 > series.end_num:
-                    raise Exception("Series number is greater than next num!")
-
-                # construct reference
-                reference = f"{series.code}-{obj.code}-{series.next_num}"
-
-                # check if next num is not greater done end num
-                # add to header
-                header = {'series': series.id, 'objtype': obj.objtype, 'seriescode': series.code,
-                        'transnumber': series.next_num, 'reference': reference, 'created_by': curr_user.id,
-                        'updated_by': curr_user.id, 'transdate': transdate,
-                        'sap_number': sap_number if sap_number else None, 'confirm': True}
+                # add the series number to header
+                header = series_allocator.allocate(curr_user.whse, 'POUT')._asdict()
+                header.update({'created_by': curr_user.id, 'updated_by': curr_user.id, 'transdate': transdate,
+                               'sap_number': sap_number if sap_number else None, 'confirm': True})
 
                 po_header = PullOutHeader(**header)
-
-                # add 1 to next series
-                series.next_num += 1
-
-                db.session.add_all([series, po_header])
+                db.session.add(po_header)
                 db.session.flush()
 
                 for row in for_po:
-                    # get first then whse inv
-                    item_bal = WhseInv.query.filter_by(
-                        item_code=row.item_code, warehouse=curr_user.whse).first()
-
-                    # check if final count is greater than whse bal
-                    if row.po_final_count > item_bal.quantity:
-                        raise Exception(f"{row.item_code.title()} is below quantity.")
-
+                    # the stock is checked when the pullout rows are posted
                     row = {'objtype': po_header.objtype, 'item_code': row.item_code,
                         'quantity': row.po_final_count, 'uom': row.uom, 'whsecode': curr_user.whse,
                         'created_by': po_header.created_by, 'updated_by': po_header.updated_by,
@@ -575,7 +453,7 @@ def inv_count_confirm(curr_user):
 
                 db.session.query(po_req_header).filter(
                     and_(po_req_header.confirm == False,
-                        cast(po_req_header.transdate, DATE) == date,
+                        BaseQuery.on_date(po_req_header.transdate, date),
                         po_req_header.docstatus == 'O')
                 ).update({'confirm': True, 'docstatus': 'C'}, synchronize_session=False)
 
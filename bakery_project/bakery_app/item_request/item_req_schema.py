@@ -1,3 +1,5 @@
+from sqlalchemy.orm import selectinload
+
 from bakery_app import ma
 from .models import ItemRequest, ItemRequestRow
 
@@ -15,4 +17,6 @@ class ItemRequestSchema(ma.SQLAlchemyAutoSchema):
         ordered = True
         include_fk = True
 
-    request_rows = ma.Nested(ItemRequestRowSchema, many=True)
\ No newline at end of file
+    request_rows = ma.Nested(ItemRequestRowSchema, many=True)
+
+    relationship_loaders = {'request_rows': selectinload}
@@ -12,7 +12,7 @@ class ItemRequest(db.Model):
     transnumber = db.Column(db.Integer, nullable=False)
     docstatus = db.Column(db.String(10), default='O', nullable=False)
     reference = db.Column(db.String(100))
-    transdate = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    transdate = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
     duedate = db.Column(db.DateTime, nullable=False, default=datetime.now)
     reference2 = db.Column(db.String(100))
     remarks = db.Column(db.String(250))
@@ -2,11 +2,11 @@ import pyodbc
 
 from datetime import datetime
 from flask import Blueprint, request
-from sqlalchemy import exc, and_, or_, DATE, func
+from sqlalchemy import exc, and_, or_
 from bakery_app import db
-from bakery_app._utils import Check, ResponseMessage
-from bakery_app._helpers import BaseQuery
-from bakery_app.branches.models import Series, ObjectType, Warehouses
+from bakery_app._utils import DocumentCheck, ResponseMessage, StreamResponse
+from bakery_app._helpers import BaseQuery, KeysetPagination
+from bakery_app.branches.models import Warehouses, series_allocator
 from bakery_app.users.routes import token_required
 
 from .models import ItemRequestRow, ItemRequest
@@ -22,42 +22,24 @@ def create_item_request(curr_user):
         data = request.get_json()
         header = data['header']
         details = data['rows']
-        obj = ObjectType.query.filter_by(code='REQT').first()
-        series = Series.query.filter_by(
-            whsecode=curr_user.whse, objtype=obj.objtype).first()
-        if series.next_num + 1 > series.end_num:
-            raise Exception("Series number already in max!")
-        if not series:
-            raise Exception("Invalid Series")
-
-        reference = f"{series.code}-{obj.code}-{series.next_num}"
-        req_header = ItemRequest(series=series.id, seriescode=series.code,
-                                 transnumber=series.next_num, reference=reference,
-                                 objtype=obj.objtype, **header)
+        num = series_allocator.allocate(curr_user.whse, 'REQT')
+        req_header = ItemRequest(**num._asdict(), **header)
         req_header.created_by = curr_user.id
         req_header.updated_by = curr_user.id
 
-        # add 1 to next num series
-        series.next_num += 1
-
-        db.session.add_all([req_header, series])
+        db.session.add(req_header)
         db.session.flush()
 
         for row in details:
             # add user whse to row
             row['to_whse'] = curr_user.whse
 
-            check = Check(**row)
-            # check if valid
-            if not check.itemcode_exist():
-                raise Exception("Invalid item code!")
-            elif not check.uom_exist():
-                raise Exception("Invalid uom!")
-            elif not check.fromwhse_exist():
-                raise Exception("Invalid from whse code!")
-            elif not check.towhse_exist():
-                raise Exception("Invalid to whse code!")
+        # check if valid
+        error = DocumentCheck(details).first_error('itemcode', 'uom', 'fromwhse', 'towhse')
+        if error:
+            raise Exception(error)
 
+        for row in details:
             req_row = ItemRequestRow(request_id=req_header.id, objtype=req_header.objtype,
                                      created_by=req_header.created_by,
                                      updated_by=req_header.updated_by,
@@ -82,6 +64,8 @@ def create_item_request(curr_user):
 def get_all_item_request(curr_user):
     try:
         data = request.args.to_dict()
+        page = KeysetPagination(data, ItemRequest.transdate, ItemRequest.id)
+        stream = StreamResponse(data)
         header_filt = []
         row_filt = []
         duedate = ''
@@ -109,20 +93,23 @@ def get_all_item_request(curr_user):
         # print(header_filt, row_filt)
         req_header_filter = BaseQuery.create_query_filter(ItemRequest, filters={'and': header_filt})
         req_row_filter = BaseQuery.create_query_filter(ItemRequestRow, filters={'and': row_filt})
+        # the row filters apply to the rows of the request
+        item_req = db.session.query(ItemRequest). \
+            join(ItemRequestRow, ItemRequestRow.request_id == ItemRequest.id)
         if duedate:
-            item_req = db.session.query(ItemRequest). \
-                filter(and_(cast(ItemRequest.transdate, DATE) == duedate,
-                            *req_header_filter, 
-                            *req_row_filter)).all()
+            item_req = item_req.filter(and_(BaseQuery.on_date(ItemRequest.transdate, duedate),
+                                            *req_header_filter,
+                                            *req_row_filter))
         else:
-            item_req = db.session.query(ItemRequest). \
-                filter(and_(*req_header_filter, 
-                            *req_row_filter)).all()
+            item_req = item_req.filter(and_(*req_header_filter,
+                                            *req_row_filter))
 
         request_schema = ItemRequestSchema(many=True,
                                            exclude=("date_created", "date_updated", "created_by", "updated_by"))
-        result = request_schema.dump(item_req)
-        return ResponseMessage(True, data=result).resp()
+        if stream.enabled:
+            return stream.resp(page.stream(item_req, schema=request_schema), schema=request_schema, filename='item_request')
+        result = request_schema.dump(page.all(item_req, schema=request_schema))
+        return ResponseMessage(True, count=len(result), data=result, page=page).resp()
 
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
         return ResponseMessage(False, message=f"{err}").resp(), 500
@@ -135,8 +122,8 @@ def get_all_item_request(curr_user):
 @token_required
 def get_item_request_details(curr_user, id):
     try:
-        item_req = ItemRequest.query.get(id)
         request_schema = ItemRequestSchema()
+        item_req = ItemRequest.query.for_dump(request_schema).get(id)
         result = request_schema.dump(item_req)
         return ResponseMessage(True, message="Successfully added!", data=result).resp()
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
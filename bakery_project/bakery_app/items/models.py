@@ -1,6 +1,8 @@
 from datetime import datetime
 from bakery_app import db
-from sqlalchemy import event
+from bakery_app._cache import master_data
+from bakery_app._events import session_events
+from bakery_app.config import Config
 from bakery_app.inventory.models import WhseInv
 import bakery_app.branches.models as branch
 
@@ -93,37 +95,63 @@ class PriceListRow(db.Model):
     updated_by = db.Column(db.Integer, db.ForeignKey('tbluser.id'))
 
 
-@event.listens_for(db.session, "after_flush")
-def create_price_list(*args):
-    sess = args[0]
-    for obj in sess.new:
-        if isinstance(obj, PriceListHeader):
-            items = Items.query.all()
-            for item in items:
-                price_list_row = PriceListRow(pricelist_id=obj.id, item_code=item.item_code,
-                                              created_by=obj.created_by, updated_by=obj.updated_by)
-                db.session.add(price_list_row)
-
-        elif isinstance(obj, Items):
-            price_lists = PriceListHeader.query.all()
-            for price_list in price_lists:
-                price_list_row = PriceListRow(pricelist_id=price_list.id, item_code=obj.item_code,
-                                              created_by=obj.created_by, updated_by=obj.updated_by)
-                db.session.add(price_list_row)
-
-        else:
-            continue
-
-
-@event.listens_for(db.session, "before_flush")
-def insert_update(*args):
-    sess = args[0]
-    for obj in sess.new:
-
-        # Insert Item to WhseInv
-        if isinstance(obj, Items):
-            whses = branch.Warehouses.query.all()
-            for i in whses:
-                whseinv = WhseInv(item_code=obj.item_code, warehouse=i.whsecode,
-                                  created_by=obj.created_by, updated_by=obj.updated_by)
-                db.session.add(whseinv)
+master_data.register(Items, 'item_code')
+master_data.register(ItemGroup, 'code')
+master_data.register(UnitOfMeasure, 'code')
+
+
+# Add all the items to the new price list, one INSERT ... SELECT
+@session_events.listens_for("after_flush", PriceListHeader)
+def create_price_list(sess, obj):
+    now = datetime.now()
+    items = Items.__table__
+    sess.execute(PriceListRow.__table__.insert().from_select(
+        ['pricelist_id', 'item_code', 'price', 'date_created', 'date_updated', 'created_by', 'updated_by'],
+        db.select([db.literal(obj.id, PriceListRow.pricelist_id.type),
+                   items.c.item_code,
+                   db.literal(0.0, PriceListRow.price.type),
+                   db.literal(now, PriceListRow.date_created.type),
+                   db.literal(now, PriceListRow.date_updated.type),
+                   db.literal(obj.created_by, PriceListRow.created_by.type),
+                   db.literal(obj.updated_by, PriceListRow.updated_by.type)])))
+
+
+# Add the new item to all the price lists
+@session_events.listens_for("after_flush", Items)
+def create_item_price(sess, obj):
+    now = datetime.now()
+    price_lists = PriceListHeader.__table__
+    select = db.select([price_lists.c.id,
+                        db.literal(obj.item_code, PriceListRow.item_code.type),
+                        db.literal(0.0, PriceListRow.price.type),
+                        db.literal(now, PriceListRow.date_created.type),
+                        db.literal(now, PriceListRow.date_updated.type),
+                        db.literal(obj.created_by, PriceListRow.created_by.type),
+                        db.literal(obj.updated_by, PriceListRow.updated_by.type)])
+    # price lists of the same flush already got all the items
+    new_ids = [o.id for o in sess.new if isinstance(o, PriceListHeader)]
+    if new_ids:
+        select = select.where(price_lists.c.id.notin_(new_ids))
+    sess.execute(PriceListRow.__table__.insert().from_select(
+        ['pricelist_id', 'item_code', 'price', 'date_created', 'date_updated', 'created_by', 'updated_by'],
+        select))
+
+
+# Insert Item to WhseInv of all the warehouses
+@session_events.listens_for("after_flush", Items)
+def insert_update(sess, obj):
+    if Config.WHSEINV_SPARSE:
+        # the rows are created by the first stock movement
+        return
+    whses = branch.Warehouses.__table__
+    select = db.select([db.literal(obj.item_code, WhseInv.item_code.type),
+                        whses.c.whsecode,
+                        db.literal(0.0, WhseInv.quantity.type),
+                        db.literal(obj.created_by, WhseInv.created_by.type),
+                        db.literal(obj.updated_by, WhseInv.updated_by.type)])
+    # warehouses of the same flush already got all the items
+    new_whses = [o.whsecode for o in sess.new if isinstance(o, branch.Warehouses)]
+    if new_whses:
+        select = select.where(whses.c.whsecode.notin_(new_whses))
+    sess.execute(WhseInv.__table__.insert().from_select(
+        ['item_code', 'warehouse', 'quantity', 'created_by', 'updated_by'], select))
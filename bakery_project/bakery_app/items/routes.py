@@ -7,8 +7,9 @@ from flask_login import current_user
 from sqlalchemy import exc, and_, or_
 
 from bakery_app import db, auth
-from bakery_app._utils import Check, ResponseMessage
-from bakery_app._helpers import BaseQuery
+from bakery_app._cache import master_data
+from bakery_app._utils import Check, DocumentCheck, ResponseMessage, StreamResponse
+from bakery_app._helpers import BaseQuery, KeysetPagination
 from bakery_app.users.routes import token_required
 
 from .models import Items, ItemGroup, UnitOfMeasure, PriceListHeader, PriceListRow, branch
@@ -32,6 +33,7 @@ def create_item(curr_user):
 
         success = []
         unsuccess = []
+        check = DocumentCheck(data)
 
         for row in data:
             row['created_by'] = curr_user.id
@@ -40,30 +42,30 @@ def create_item(curr_user):
             if not row['item_code'] or not row['item_name'] or not row['item_group'] or not row['price']:
                 return ResponseMessage(
                     False, message="Missing required fields!").resp(), 401
-            check = Check(**row)
 
             # initialize dictionary to append in success or unsuccess list
             d = {}
             id = row['item_code']
             d[id] = []
 
-            if not check.uom_exist():
+            if not check.exists('uom', row):
                 d[id].append(f"Uom '{row['uom']}' not exists!")
                 unsuccess.append(d)
                 continue
 
-            if not check.itemgroup_exist():
+            if not check.exists('itemgroup', row):
                 unsuccess.append(d)
                 d[id].append(f"Item group '{row['item_group']}' not exists!")
                 continue
 
-            if check.itemcode_exist():
+            if check.exists('itemcode', row):
                 unsuccess.append(d)
                 d[id].append(f"Item code '{row['item_code']}' already exists!")
                 continue
 
             item = Items(**row)
             item.barcode = hash(row['item_code'])
+            check.mark_exists('itemcode', row)
             success.append(d)
             db.session.add(item)
 
@@ -84,8 +86,11 @@ def create_item(curr_user):
 @token_required
 def get_all_items(curr_user):
 
+    args = request.args.to_dict()
+    page = KeysetPagination(args, Items.id, desc=False)
+    stream = StreamResponse(args)
     q = request.args.get('q')
-    whse = branch.Warehouses.query.filter_by(whsecode=curr_user.whse).first()
+    whse = master_data.get(branch.Warehouses, curr_user.whse)
     if q:
         items = db.session.query(
             Items.id,
@@ -95,9 +100,9 @@ def get_all_items(curr_user):
             Items.uom,
             PriceListRow.price).\
             outerjoin(PriceListRow, PriceListRow.item_code == Items.item_code). \
-            filter(and_(or_(Items.item_code. ontains(q.upper()),
+            filter(and_(or_(Items.item_code.contains(q.upper()),
                             Items.item_name.contains(q.upper())),
-                        PriceListRow.pricelist_id == whse.pricelist)).all()
+                        PriceListRow.pricelist_id == whse.pricelist))
     else:
         items = db.session.query(
             Items.id,
@@ -107,12 +112,15 @@ def get_all_items(curr_user):
             Items.uom,
             PriceListRow.price). \
             outerjoin(PriceListRow, PriceListRow.item_code == Items.item_code).\
-            filter(and_(PriceListRow.pricelist_id == whse.pricelist)).all()
+            filter(and_(PriceListRow.pricelist_id == whse.pricelist))
 
     item_schema = ItemsSchema(many=True, only=("id", "item_code", "item_name", "min_stock",
                                                "max_stock", "uom", "item_group", "price",))
-    result = item_schema.dump(items)
-    return ResponseMessage(True, data=result).resp()
+    # one price per item and price list
+    if stream.enabled:
+        return stream.resp(page.stream(items, unique=False), schema=item_schema, filename='items')
+    result = item_schema.dump(page.all(items, unique=False))
+    return ResponseMessage(True, count=len(result), data=result, page=page).resp()
 
 
 # Get Item detail
@@ -237,7 +245,7 @@ def create_itemgroup(curr_user):
     if not data['code'] or not data['description']:
         return ResponseMessage(False, message="Missing required fields!").resp(), 401
 
-    if ItemGroup.query.filter_by(code=data['code']).first():
+    if master_data.get(ItemGroup, data['code']):
         return ResponseMessage(False, message="Item group code already exist").resp(), 401
 
     try:
@@ -313,7 +321,7 @@ def update_itemgrp(curr_user, id):
 
     data = request.get_json()
 
-    if ItemGroup.query.filter_by(code=data['code']).first():
+    if master_data.get(ItemGroup, data['code']):
         return ResponseMessage(False, message="Item group code already exist").resp()
     if data['code']:
         group.code = data['code']
@@ -378,7 +386,7 @@ def create_uom(curr_user):
     code = request.args.get('code')
     description = request.args.get('description')
 
-    if UnitOfMeasure.query.filter_by(code=code).first():
+    if master_data.get(UnitOfMeasure, code):
         return ResponseMessage(False, message="UoM code is already exists!").resp()
     try:
         uom = UnitOfMeasure(code=code, description=description,
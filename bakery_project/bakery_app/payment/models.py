@@ -1,7 +1,7 @@
 from datetime import datetime
-from sqlalchemy import event
 from bakery_app import db, ma
-from bakery_app.customers.models import Customer
+from bakery_app._events import session_events
+from bakery_app.customers.models import Customer, BalancePosting
 from bakery_app.sales.models import SalesHeader
 from bakery_app.inventory.models import InvTransaction, WhseInv
 from bakery_app._helpers import get_model_changes
@@ -19,7 +19,7 @@ class PayTransHeader(db.Model):
         'tblobjtype.objtype'), nullable=False)
     # seriescode + number
     reference = db.Column(db.String(100), nullable=False)
-    transdate = db.Column(db.DateTime, nullable=False)
+    transdate = db.Column(db.DateTime, nullable=False, index=True)
     base_id = db.Column(db.Integer, db.ForeignKey(
         'tblsales.id', ondelete='CASCADE'))  # sales id
     base_num = db.Column(db.Integer)  # sales transnum
@@ -138,7 +138,7 @@ class CashTransaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     trans_id = db.Column(db.Integer, nullable=False)
     trans_num = db.Column(db.Integer, nullable=False)
-    transdate = db.Column(db.DateTime, nullable=False)
+    transdate = db.Column(db.DateTime, nullable=False, index=True)
     objtype = db.Column(db.Integer, db.ForeignKey(
         'tblobjtype.objtype'), nullable=False)
     amount = db.Column(db.Float, nullable=False)
@@ -148,200 +148,191 @@ class CashTransaction(db.Model):
         db.Integer, db.ForeignKey('tbluser.id'), nullable=False)
     updated_by = db.Column(
         db.Integer, db.ForeignKey('tbluser.id'), nullable=False)
-    date_created = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    date_created = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
     date_updated = db.Column(db.DateTime, nullable=False, default=datetime.now)
 
 
 # Payment Before Flush Event
-@event.listens_for(db.session, "before_flush")
-def payment_before_flush(*args):
-    sess = args[0]
-    for obj in sess.new:
-
-        if isinstance(obj, PayTransRow):
-            pay_header = PayTransHeader.query.filter_by(
-                id=obj.payment_id).first()
-            cust = Customer.query.filter_by(code=pay_header.cust_code).first()
+@session_events.listens_for("before_flush", PayTransRow)
+def payment_row_insert(sess, obj):
+    pay_header = PayTransHeader.query.filter_by(
+        id=obj.payment_id).first()
+    sales = SalesHeader.query.filter_by(id=pay_header.base_id).first()
+
+    # Update Sales Amount Due and Sales Applied Amount
+    sales.amount_due -= obj.amount
+    sales.appliedamt += obj.amount
+    # Update Customer Balance, once per payment
+    BalancePosting.of(sess).add(pay_header.cust_code, -pay_header.total_paid,
+                                document=(pay_header.objtype, pay_header.id))
+
+    if obj.payment_type in ['FDEPS']:
+        # query the deposit
+        dep = Deposit.query.get(obj.deposit_id)
+        # minus the row amount to deposit balance
+        dep.balance -= obj.amount
+        # update the customer deposit balance
+        customer = Customer.query.filter_by(code=dep.cust_code).first()
+        customer.dep_balance -= obj.amount
+
+        # if the deposit balance is 0 then close the status
+        if dep.balance == 0:
+            dep.status = 'C'
+
+        db.session.add_all([dep, customer])
+
+    if sales.amount_due == 0:
+        sales.docstatus = 'C'
+
+    sales.confirm = True
+
+    # Add to Cash Transaction
+    cash_trans = CashTransaction(trans_id=pay_header.id,
+                                 trans_num=pay_header.transnumber,
+                                 transdate=pay_header.transdate,
+                                 objtype=pay_header.objtype,
+                                 amount=obj.amount,
+                                 reference=pay_header.reference,
+                                 transtype=obj.payment_type,
+                                 created_by=pay_header.created_by,
+                                 updated_by=pay_header.updated_by)
+
+    db.session.add_all([sales, cash_trans])
+
+
+@session_events.listens_for("before_flush", Deposit)
+def deposit_insert(sess, obj):
+    customer = Customer.query.filter_by(code=obj.cust_code).first()
+    customer.dep_balance += obj.amount
+    db.session.add(customer)
+
+
+# If Update
+@session_events.listens_for("before_flush", PayTransHeader, state='dirty')
+def payment_cancel(sess, obj):
+    # query the changes
+    changes = get_model_changes(obj)
+    for i in changes:
+        if i == 'status':
+            # get the pay_header
+            pay_header = PayTransHeader.query.get(obj.id)
             sales = SalesHeader.query.filter_by(id=pay_header.base_id).first()
 
-            # Update Sales Amount Due and Sales Applied Amount
-            sales.amount_due -= obj.amount
-            sales.appliedamt += obj.amount
-            # Update Customer Balance
-            cust.balance -= pay_header.total_paid
-
-            if obj.payment_type in ['FDEPS']:
-                # query the deposit
-                dep = Deposit.query.get(obj.deposit_id)
-                # minus the row amount to deposit balance
-                dep.balance -= obj.amount
-                # update the customer deposit balance
-                customer = Customer.query.filter_by(code=dep.cust_code).first()
+            # check if the update is for canceled
+            # check if the header is still open then proceed.
+            if changes[i][1] == 'N':
+                # open the sales document
+                sales.docstatus = 'O'
+                # get the payment rows
+                payment_rows = PayTransRow.query.filter_by(
+                    payment_id=obj.id).all()
+
+                # loop the payment rows
+                for row in payment_rows:
+                    # check if the payment row as deposit
+                    # if has deposit, update deposit
+                    if row.payment_type in ['FDEPS']:
+                        # query the deposit
+                        dep = Deposit.query.get(row.deposit_id)
+                        # update the customer deposit balance also
+                        customer = Customer.query.filter_by(code=dep.cust_code).first()
+                        customer.dep_balance += obj.amount
+                        # check if the status is close then open it
+                        if dep.status != 'O':
+                            dep.status = 'O'
+                        # add the row amount to deposit balance
+                        dep.balance += row.amount
+                        db.session.add_all([dep, customer])
+
+                    # Update Sales Amount Due and Sales Applied Amount
+                    sales.amount_due += obj.amount
+                    sales.appliedamt -= obj.amount
+
+                    # Update Customer Balance, once per payment
+                    BalancePosting.of(sess).add(pay_header.cust_code, pay_header.total_paid,
+                                                document=(pay_header.objtype, pay_header.id))
+
+                    # Add to Cash Transaction
+                    cash_trans = CashTransaction(trans_id=pay_header.id,
+                                                 trans_num=pay_header.transnumber,
+                                                 transdate=pay_header.transdate,
+                                                 objtype=pay_header.objtype,
+                                                 reference=pay_header.reference,
+                                                 amount=-row.amount,
+                                                 transtype=row.payment_type,
+                                                 created_by=pay_header.created_by,
+                                                 updated_by=pay_header.updated_by)
+
+                    db.session.add_all([sales, cash_trans])
+
+
+# Add to cash transaction
+@session_events.listens_for("before_flush", Deposit, state='dirty')
+def deposit_cancel(sess, obj):
+    changes = get_model_changes(obj)
+
+    for i in changes:
+        if i == 'status':
+            if changes[i][1] == 'N':
+                customer = Customer.query.filter_by(code=obj.cust_code).first()
                 customer.dep_balance -= obj.amount
-
-                # if the deposit balance is 0 then close the status
-                if dep.balance == 0:
-                    dep.status = 'C'
-
-                db.session.add_all([dep, customer])
-
-            if sales.amount_due == 0:
-                sales.docstatus = 'C'
-
-            sales.confirm = True
-
-            # Add to Cash Transaction
-            cash_trans = CashTransaction(trans_id=pay_header.id,
-                                         trans_num=pay_header.transnumber,
-                                         transdate=pay_header.transdate,
-                                         objtype=pay_header.objtype,
-                                         amount=obj.amount,
-                                         reference=pay_header.reference,
-                                         transtype=obj.payment_type,
-                                         created_by=pay_header.created_by,
-                                         updated_by=pay_header.updated_by)
-
-            db.session.add_all([cust, sales, cash_trans])
-
-
-        elif isinstance(obj, Deposit):
-            customer = Customer.query.filter_by(code=obj.cust_code).first()
-            customer.dep_balance += obj.amount
-            db.session.add(customer)
-
-        else:
-            continue
-
-    # If Update
-    for obj in sess.dirty:
-        if isinstance(obj, PayTransHeader):
-            # query the changes
-            changes = get_model_changes(obj)
-            for i in changes:
-                if i == 'status':
-                    # get the pay_header
-                    pay_header = PayTransHeader.query.get(obj.id)
-                    cust = Customer.query.filter_by(code=pay_header.cust_code).first()
-                    sales = SalesHeader.query.filter_by(id=pay_header.base_id).first()
-
-                    # check if the update is for canceled
-                    # check if the header is still open then proceed.
-                    if changes[i][1] == 'N':
-                        # open the sales document
-                        sales.docstatus = 'O'
-                        # get the payment rows
-                        payment_rows = PayTransRow.query.filter_by(
-                            payment_id=obj.id).all()
-
-                        # loop the payment rows
-                        for row in payment_rows:
-                            # check if the payment row as deposit
-                            # if has deposit, update deposit
-                            if row.payment_type in ['FDEPS']:
-                                # query the deposit
-                                dep = Deposit.query.get(row.deposit_id)
-                                # update the customer deposit balance also
-                                customer = Customer.query.filter_by(code=dep.cust_code).first()
-                                customer.dep_balance += obj.amount
-                                # check if the status is close then open it
-                                if dep.status != 'O':
-                                    dep.status = 'O'
-                                # add the row amount to deposit balance
-                                dep.balance += row.amount
-                                db.session.add_all([dep, customer])
-
-                            # Update Sales Amount Due and Sales Applied Amount
-                            sales.amount_due += obj.amount
-                            sales.appliedamt -= obj.amount
-
-                            # Update Customer Balance
-                            cust.balance += pay_header.total_paid
-
-                            # Add to Cash Transaction
-                            cash_trans = CashTransaction(trans_id=pay_header.id,
-                                                         trans_num=pay_header.transnumber,
-                                                         transdate=pay_header.transdate,
-                                                         objtype=pay_header.objtype,
-                                                         reference=pay_header.reference,
-                                                         amount=-row.amount,
-                                                         transtype=row.payment_type,
-                                                         created_by=pay_header.created_by,
-                                                         updated_by=pay_header.updated_by)
-
-                            db.session.add_all([cust, sales, cash_trans])
-
-        # Add to cash transaction
-        elif isinstance(obj, Deposit):
-            changes = get_model_changes(obj)
-
-            for i in changes:
-                if i == 'status':
-                    if changes[i][1] == 'N':
-                        customer = Customer.query.filter_by(code=obj.cust_code).first()
-                        customer.dep_balance -= obj.amount
-                        cash_trans = CashTransaction(trans_id=obj.id,
-                                                     trans_num=obj.transnumber,
-                                                     transdate=obj.transdate,
-                                                     objtype=obj.objtype,
-                                                     amount=-obj.amount,
-                                                     reference=obj.reference,
-                                                     transtype='DEPS',
-                                                     created_by=obj.created_by,
-                                                     updated_by=obj.updated_by)
-                        db.session.add_all([cash_trans, customer])
-
-        # Add to cash transaction
-        elif isinstance(obj, CashOut):
-            changes = get_model_changes(obj)
-
-            for i in changes:
-                if i == 'status':
-                    if changes[i][1] == 'N':
-                        cash_trans = CashTransaction(trans_id=obj.id,
-                                                     trans_num=obj.transnumber,
-                                                     transdate=obj.transdate,
-                                                     objtype=obj.objtype,
-                                                     reference=obj.reference,
-                                                     amount=-obj.amount,
-                                                     transtype='CASHOUT',
-                                                     created_by=obj.created_by,
-                                                     updated_by=obj.updated_by)
-                        db.session.add(cash_trans)
-        else:
-            continue
-
-
-@event.listens_for(db.session, "after_flush")
-def after_flush_event(*args):
-    sess = args[0]
-    for obj in sess.new:
-
-        # Add to cash transaction
-        if isinstance(obj, Deposit):
-            cash_trans = CashTransaction(trans_id=obj.id,
-                                         trans_num=obj.transnumber,
-                                         transdate=obj.transdate,
-                                         objtype=obj.objtype,
-                                         amount=obj.amount,
-                                         reference=obj.reference,
-                                         transtype='DEPS',
-                                         created_by=obj.created_by,
-                                         updated_by=obj.updated_by)
-            db.session.add(cash_trans)
-
-
-        # Add to cash transaction
-        elif isinstance(obj, CashOut):
-            cash_trans = CashTransaction(trans_id=obj.id,
-                                         trans_num=obj.transnumber,
-                                         transdate=obj.transdate,
-                                         objtype=obj.objtype,
-                                         reference=obj.reference,
-                                         amount=obj.amount,
-                                         transtype='CASHOUT',
-                                         created_by=obj.created_by,
-                                         updated_by=obj.updated_by)
-            db.session.add(cash_trans)
-
-        else:
-            continue
+                cash_trans = CashTransaction(trans_id=obj.id,
+                                             trans_num=obj.transnumber,
+                                             transdate=obj.transdate,
+                                             objtype=obj.objtype,
+                                             amount=-obj.amount,
+                                             reference=obj.reference,
+                                             transtype='DEPS',
+                                             created_by=obj.created_by,
+                                             updated_by=obj.updated_by)
+                db.session.add_all([cash_trans, customer])
+
+
+# Add to cash transaction
+@session_events.listens_for("before_flush", CashOut, state='dirty')
+def cashout_cancel(sess, obj):
+    changes = get_model_changes(obj)
+
+    for i in changes:
+        if i == 'status':
+            if changes[i][1] == 'N':
+                cash_trans = CashTransaction(trans_id=obj.id,
+                                             trans_num=obj.transnumber,
+                                             transdate=obj.transdate,
+                                             objtype=obj.objtype,
+                                             reference=obj.reference,
+                                             amount=-obj.amount,
+                                             transtype='CASHOUT',
+                                             created_by=obj.created_by,
+                                             updated_by=obj.updated_by)
+                db.session.add(cash_trans)
+
+
+# Add to cash transaction
+@session_events.listens_for("after_flush", Deposit)
+def deposit_cash_transaction(sess, obj):
+    cash_trans = CashTransaction(trans_id=obj.id,
+                                 trans_num=obj.transnumber,
+                                 transdate=obj.transdate,
+                                 objtype=obj.objtype,
+                                 amount=obj.amount,
+                                 reference=obj.reference,
+                                 transtype='DEPS',
+                                 created_by=obj.created_by,
+                                 updated_by=obj.updated_by)
+    db.session.add(cash_trans)
+
+
+# Add to cash transaction
+@session_events.listens_for("after_flush", CashOut)
+def cashout_cash_transaction(sess, obj):
+    cash_trans = CashTransaction(trans_id=obj.id,
+                                 trans_num=obj.transnumber,
+                                 transdate=obj.transdate,
+                                 objtype=obj.objtype,
+                                 reference=obj.reference,
+                                 amount=obj.amount,
+                                 transtype='CASHOUT',
+                                 created_by=obj.created_by,
+                                 updated_by=obj.updated_by)
+    db.session.add(cash_trans)
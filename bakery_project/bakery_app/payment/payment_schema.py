@@ -1,3 +1,5 @@
+from sqlalchemy.orm import selectinload
+
 from bakery_app import ma
 
 from .models import PaymentType, PayTransRow, PayTransHeader, Deposit, CashTransaction
@@ -24,6 +26,8 @@ class PaymentHeaderSchema(ma.SQLAlchemyAutoSchema):
 
     payrows = ma.Nested(PaymentRowSchema, many=True)
 
+    relationship_loaders = {'payrows': selectinload}
+
 
 class DepositSchema(ma.SQLAlchemyAutoSchema):
     class Meta:
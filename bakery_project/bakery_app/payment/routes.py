@@ -1,17 +1,18 @@
 import json
 import pyodbc
 from datetime import datetime
-from sqlalchemy import exc, and_, or_, func, DATE, outerjoin
+from sqlalchemy import exc, and_, or_, func, outerjoin
 from flask import Blueprint, request, jsonify
 
 from bakery_app import db
 from bakery_app._helpers import BaseQuery
 from bakery_app.sales.models import (SalesHeader, SalesRow)
 from bakery_app.sales.sales_schema import SalesHeaderSchema, SalesRowSchema
-from bakery_app.branches.models import Series, ObjectType, Warehouses
+from bakery_app.branches.models import Warehouses, SeriesError, series_allocator
 from bakery_app.users.models import User
 from bakery_app.users.routes import token_required
 from bakery_app._utils import Check, ResponseMessage
+from bakery_app._idempotency import idempotent
 
 from .models import (PaymentType, PayTransHeader,
                      PayTransRow, Deposit, CashTransaction, CashOut)
@@ -141,27 +142,12 @@ def new_deposit(curr_user):
     data['updated_by'] = curr_user.id
 
     try:
-        obj = ObjectType.query.filter_by(code='DEPS').first()
-        series = Series.query.filter_by(
-            whsecode=curr_user.whse, objtype=obj.objtype).first()
-        if series.next_num + 1 > series.end_num:
-            raise Exception("Series number already in max!")
-        if not series:
-            raise Exception("Invalid Series")
-
         # add to the header
-        data['series'] = series.id
-        data['seriescode'] = series.code
-        data['transnumber'] = series.next_num
-        data['reference'] = f"{series.code}-{obj.code}-{series.next_num}"
-        data['objtype'] = obj.objtype
+        data.update(series_allocator.allocate(curr_user.whse, 'DEPS')._asdict())
         dep = Deposit(**data)
         dep.balance = dep.amount
 
-        # add 1 to series next num
-        series.next_num += 1
-
-        db.session.add_all([dep, series])
+        db.session.add(dep)
         db.session.commit()
         dep_schema = DepositSchema(
             exclude=("date_created", "date_updated", "created_by", "updated_by"))
@@ -273,6 +259,7 @@ def cancel_deposit(curr_user, id):
 # Create New Payment
 @payment.route('/api/payment/new', methods=['POST', 'GET'])
 @token_required
+@idempotent
 def payment_new(curr_user):
     if not curr_user.is_cashier() and not curr_user.is_admin():
         return ResponseMessage(False, message="Unauthorized user!").resp(), 401
@@ -303,7 +290,7 @@ def payment_new(curr_user):
                 sales = db.session.query(SalesHeader).join(SalesRow). \
                     join(Warehouses, Warehouses.whsecode == SalesRow.whsecode).filter(
                     and_(Warehouses.branch == curr_user.branch,
-                         func.cast(SalesHeader.date_created, DATE) == date_created,
+                         BaseQuery.on_date(SalesHeader.date_created, date_created),
                          or_(and_(SalesHeader.confirm != True, SalesHeader.transtype == 'CASH'),
                              and_(SalesHeader.confirm == True, SalesHeader.transtype != 'CASH')),
                          *sales_filter)).all()
@@ -336,23 +323,11 @@ def payment_new(curr_user):
             for data in datas:
                 details = data['rows']
 
-                obj = ObjectType.query.filter_by(code='PMNT').first()
-                if not obj:
-                    return ResponseMessage(False, message="No object type!").resp(), 401
-
-                # query the series
-                series = Series.query.filter_by(
-                    whsecode=curr_user.whse, objtype=obj.objtype).first()
-                # check if has an series
-                if not series:
-                    return ResponseMessage(False, message="No series found!").resp(), 401
-
                 # add to the header
-                data['header']['series'] = series.id
-                data['header']['seriescode'] = series.code
-                data['header']['transnumber'] = series.next_num
-                data['header']['reference'] = f"{series.code}-{obj.code}-{series.next_num}"
-                data['header']['objtype'] = obj.objtype
+                try:
+                    data['header'].update(series_allocator.allocate(curr_user.whse, 'PMNT')._asdict())
+                except SeriesError as err:
+                    return ResponseMessage(False, message=f"{err}").resp(), 401
 
                 # check if has transdate and convert to datetime object
                 if data['header']['transdate']:
@@ -372,10 +347,7 @@ def payment_new(curr_user):
                 payment.created_by = curr_user.id
                 payment.updated_by = curr_user.id
 
-                # add 1 to series next num
-                series.next_num += 1
-
-                db.session.add_all([series, payment])
+                db.session.add(payment)
                 db.session.flush()
                 sales = SalesHeader.query.get(payment.base_id)
 
@@ -434,9 +406,9 @@ def payment_new(curr_user):
 @token_required
 def payment_details(curr_user, id):
     try:
-        pay_details = PayTransHeader.query.get(id)
-
         payment_schema = PaymentHeaderSchema()
+        pay_details = PayTransHeader.query.for_dump(payment_schema).get(id)
+
         result = payment_schema.dump(pay_details)
         return ResponseMessage(True, count=len(result), data=result).resp()
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
@@ -485,26 +457,12 @@ def create_cashout(curr_user):
         data['created_by'] = curr_user.id
         data['updated_by'] = curr_user.id
 
-        obj = ObjectType.query.filter_by(code='CSHT').first()
-        series = Series.query.filter_by(whsecode=curr_user.whse, objtype=obj.objtype).first()
-        if series.next_num + 1 > series.end_num:
-            raise Exception("Series number already in max!")
-        if not series:
-            raise Exception("Invalid Series")
-
         # add to the header
-        data['series'] = series.id
-        data['seriescode'] = series.code
-        data['transnumber'] = series.next_num
-        data['reference'] = f"{series.code}-{obj.code}-{series.next_num}"
-        data['objtype'] = obj.objtype
+        data.update(series_allocator.allocate(curr_user.whse, 'CSHT')._asdict())
 
         cash_out = CashOut(**data)
 
-        # add plus 1 to series
-        series.next_num += 1
-
-        db.session.add_all([cash_out, series])
+        db.session.add(cash_out)
         db.session.commit()
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
         return ResponseMessage(False, message=f"{err}").resp(), 500
@@ -635,7 +593,7 @@ def count_for_payment_sales(curr_user):
         transdate = request.args.get('transdate')
         for_payment = db.session.query(SalesHeader
                                        ).filter(
-            and_(func.cast(SalesHeader.transdate, DATE) == transdate,
+            and_(BaseQuery.on_date(SalesHeader.transdate, transdate),
                  or_(and_(SalesHeader.confirm == True, SalesHeader.transtype != 'CASH'),
                      and_(SalesHeader.confirm != True, SalesHeader.transtype == 'CASH')),
                  SalesHeader.docstatus == 'O'
@@ -643,7 +601,7 @@ def count_for_payment_sales(curr_user):
         ).count()
         for_confirmation = db.session.query(SalesHeader
                                             ).filter(
-            and_(func.cast(SalesHeader.transdate, DATE) == transdate,
+            and_(BaseQuery.on_date(SalesHeader.transdate, transdate),
                  SalesHeader.confirm != True,
                  SalesHeader.transtype != 'CASH',
                  SalesHeader.docstatus == 'O'
@@ -1,8 +1,8 @@
 from datetime import datetime
-from sqlalchemy import event
 from bakery_app._helpers import get_model_changes
-from bakery_app.inventory.models import WhseInv, InvTransaction
+from bakery_app.inventory.models import StockPosting
 from bakery_app import db
+from bakery_app._events import session_events
 
 
 class PullOutHeaderRequest(db.Model):
@@ -14,7 +14,7 @@ class PullOutHeaderRequest(db.Model):
     seriescode = db.Column(db.String(50), nullable=False)  # series code
     transnumber = db.Column(db.Integer, nullable=False)  # series next_num
     objtype = db.Column(db.Integer, db.ForeignKey('tblobjtype.objtype'), nullable=False)
-    transdate = db.Column(db.DateTime, nullable=False)
+    transdate = db.Column(db.DateTime, nullable=False, index=True)
     reference = db.Column(db.String(100), nullable=False)  # seriescode + number
     remarks = db.Column(db.String(250))
     user_type = db.Column(db.String(50))
@@ -53,7 +53,7 @@ class PullOutHeader(db.Model):
     seriescode = db.Column(db.String(50), nullable=False)  # series code
     transnumber = db.Column(db.Integer, nullable=False)  # series next_num
     objtype = db.Column(db.Integer, db.ForeignKey('tblobjtype.objtype'), nullable=False)
-    transdate = db.Column(db.DateTime, nullable=False)
+    transdate = db.Column(db.DateTime, nullable=False, index=True)
     reference = db.Column(db.String(100), nullable=False)  # seriescode + number
     remarks = db.Column(db.String(250))
     docstatus = db.Column(db.String(10), default='O', nullable=False)
@@ -87,28 +87,14 @@ class PullOutRow(db.Model):
     # header = db.relationship("PullOutHeader", back_populates="row", lazy=True)
 
 
-@event.listens_for(db.session, "before_flush")
-def insert_update(*args):
-    sess = args[0]
-    for obj in sess.new:
-
-        # Insert to InvTransaction and Update Whse Inv
-        if isinstance(obj, PullOutRow):
-
-            po_header = PullOutHeader.query.filter_by(id=obj.pullout_id).first()
-            whseinv = WhseInv.query.filter_by(warehouse=obj.whsecode,
-                                              item_code=obj.item_code).first()
-            whseinv.quantity -= obj.quantity
-
-            invtrans = InvTransaction(series_code=po_header.seriescode, trans_id=po_header.id,
-                                      trans_num=po_header.transnumber, objtype=po_header.objtype,
-                                      item_code=obj.item_code,
-                                      outqty=obj.quantity, uom=obj.uom, warehouse=obj.whsecode, warehouse2=obj.to_whse,
-                                      transdate=po_header.transdate, created_by=po_header.created_by,
-                                      updated_by=po_header.updated_by, reference=po_header.reference,
-                                      sap_number=obj.sap_number, reference2="PullOut")
-
-            db.session.add_all([whseinv, invtrans])
-
-        else:
-            continue
+@session_events.listens_for("before_flush", PullOutRow)
+def insert_update(sess, obj):
+    # Insert to InvTransaction and Update Whse Inv
+    po_header = PullOutHeader.query.get(obj.pullout_id)
+    StockPosting.of(sess).add(obj.whsecode, obj.item_code, outqty=obj.quantity, check_stock=True,
+                              series_code=po_header.seriescode, trans_id=po_header.id,
+                              trans_num=po_header.transnumber, objtype=po_header.objtype,
+                              uom=obj.uom, warehouse2=obj.to_whse,
+                              transdate=po_header.transdate, created_by=po_header.created_by,
+                              updated_by=po_header.updated_by, reference=po_header.reference,
+                              sap_number=obj.sap_number, reference2="PullOut")
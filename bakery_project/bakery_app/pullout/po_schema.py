@@ -1,3 +1,5 @@
+from sqlalchemy.orm import selectinload
+
 from bakery_app import ma
 from .models import PullOutRow, PullOutHeader, PullOutHeaderRequest, PullOutRowRequest
 
@@ -17,6 +19,8 @@ class PullOutHeaderSchema(ma.SQLAlchemyAutoSchema):
 
     row = ma.Nested(PullOutHeaderRowSchema, many=True)
 
+    relationship_loaders = {'row': selectinload}
+
 
 class PullOutHeaderRequestSchema(ma.SQLAlchemyAutoSchema):
     class Meta:
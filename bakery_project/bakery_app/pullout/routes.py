@@ -2,12 +2,12 @@ import pyodbc
 
 from datetime import datetime
 from flask import Blueprint, request
-from sqlalchemy import exc, and_, cast, DATE, func, case
+from sqlalchemy import exc, and_, func, case
 from bakery_app import db
-from bakery_app._utils import Check, ResponseMessage
-from bakery_app._helpers import BaseQuery
+from bakery_app._utils import DocumentCheck, ResponseMessage, StreamResponse
+from bakery_app._helpers import BaseQuery, KeysetPagination
 from bakery_app.users.routes import token_required
-from bakery_app.branches.models import ObjectType, Series
+from bakery_app.branches.models import SeriesError, series_allocator
 from bakery_app.items.models import Items
 from bakery_app.inventory.models import WhseInv
 from bakery_app.inventory.inv_schema import WhseInvSchema
@@ -27,10 +27,9 @@ def create_po_req(curr_user):
     if not curr_user.is_admin() and not curr_user.is_allow_pullout():
         return ResponseMessage(False, message="Unauthorized user!").resp(), 401
 
-    whse = Warehouses.query.filter_by(whsecode=curr_user.whse).first()
     # if whse.is_cutoff():
     #     return ResponseMessage(False, message="Cutoff is enable, please disable it!").resp(), 401
-    if not whse.is_cutoff():
+    if not Warehouses.cutoff_of(curr_user.whse):
         return ResponseMessage(False, message="Cutoff is disable").resp(), 401
 
     date = request.args.get('date')
@@ -38,15 +37,16 @@ def create_po_req(curr_user):
     if request.method == 'GET':
         try:
             if not curr_user.is_manager():
-                whse_inv_case = case([(WhseInv.quantity != 0, 1)], else_=0)
-                whse_inv = db.session.query(WhseInv.item_code,
-                                            WhseInv.item_code,
-                                            WhseInv.quantity,
+                # all the items, no WhseInv row is zero quantity
+                quantity = func.isnull(WhseInv.quantity, 0)
+                whse_inv_case = case([(quantity != 0, 1)], else_=0)
+                whse_inv = db.session.query(Items.item_code,
+                                            quantity.label('quantity'),
                                             Items.uom
-                                            ).filter(WhseInv.warehouse == curr_user.whse
-                                                     ).outerjoin(
-                    Items, Items.item_code == WhseInv.item_code
-                ).order_by(whse_inv_case.desc(), WhseInv.item_code
+                                            ).outerjoin(
+                    WhseInv, and_(WhseInv.item_code == Items.item_code,
+                                  WhseInv.warehouse == curr_user.whse)
+                ).order_by(whse_inv_case.desc(), Items.item_code
                            ).all()
                 whseinv_schema = WhseInvSchema(many=True)
                 result = whseinv_schema.dump(whse_inv)
@@ -66,7 +66,7 @@ def create_po_req(curr_user):
                                  func.isnull(auditor_case, 0)).label('variance'),
                         po_req_row.uom
                     ).filter(
-                        and_(cast(po_req_header.transdate, DATE) == date,
+                        and_(BaseQuery.on_date(po_req_header.transdate, date),
                              po_req_row.whsecode == curr_user.whse,
                              po_req_header.id == po_req_row.pulloutreq_id,
                              False == po_req_header.confirm
@@ -104,57 +104,32 @@ def create_po_req(curr_user):
 
             pending_req_po = PullOutHeaderRequest.query.filter(
                 and_(PullOutHeaderRequest.user_type == header['user_type'],
-                     func.cast(PullOutHeaderRequest.transdate,
-                               DATE) == header['transdate'],
+                     BaseQuery.on_date(PullOutHeaderRequest.transdate, header['transdate']),
                      PullOutHeaderRequest.docstatus == 'O',
                      PullOutHeaderRequest.confirm == False)).first()
 
             if pending_req_po:
                 return ResponseMessage(False, message=f"You have an entry that still pending!").resp(), 401
 
-            # query the object type
-            obj = ObjectType.query.filter_by(code='PORQ').first()
-
-            # Check if has objtype
-            if not obj:
-                return ResponseMessage(False, message="Object type not found!").resp(), 401
-
-            # query the series
-            series = Series.query.filter_by(
-                whsecode=curr_user.whse, objtype=obj.objtype).first()
-
-            # check if has series
-            if not series:
-                return ResponseMessage(False, message="Series not found!").resp(), 401
-
-            # check if next num is not greater done end num
-            if series.next_num + 1 > series.end_num:
-                return ResponseMessage(False, message="Series number is greater than next num!").resp(), 401
-
-            # construct reference
-            reference = f"{series.code}-{obj.code}-{series.next_num}"
-
-            # add to header
-            header['series'] = series.id
-            header['objtype'] = obj.objtype
-            header['seriescode'] = series.code
-            header['transnumber'] = series.next_num
-            header['reference'] = reference
-
-            # add 1 to next series
-            series.next_num += 1
+            # add the series number to header
+            try:
+                header.update(series_allocator.allocate(curr_user.whse, 'PORQ')._asdict())
+            except SeriesError as err:
+                return ResponseMessage(False, message=f"{err}").resp(), 401
 
             po_req_header = PullOutHeaderRequest(**header)
-            db.session.add_all([series, po_req_header])
+            db.session.add(po_req_header)
             db.session.flush()
 
+            # check if valid
+            error = DocumentCheck(rows).first_error('itemcode', 'uom')
+            if error:
+                raise Exception(error)
+
             for row in rows:
-                # query the stock inventory
-                whse_inv = WhseInv.query.filter_by(
-                    warehouse=curr_user.whse, item_code=row['item_code']).first()
                 # check if the whse inv is less than the quantity to pullout
                 # if true then raise an error.
-                if whse_inv.quantity < row['quantity']:
+                if WhseInv.on_hand(curr_user.whse, row['item_code']) < row['quantity']:
                     raise Exception(
                         f"{row['item_code'].title()} below stock level!")
 
@@ -163,12 +138,6 @@ def create_po_req(curr_user):
                 row['objtype'] = po_req_header.objtype
                 row['created_by'] = po_req_header.created_by
                 row['updated_by'] = po_req_header.updated_by
-                check = Check(**row)
-                # check if valid
-                if not check.itemcode_exist():
-                    raise Exception("Invalid item code!")
-                if not check.uom_exist():
-                    raise Exception("Invalid uom!")
 
                 po_req_row = PullOutRowRequest(
                     pulloutreq_id=po_req_header.id, **row)
@@ -195,6 +164,8 @@ def create_po_req(curr_user):
 def get_all_po(curr_user):
     try:
         data = request.args.to_dict()
+        page = KeysetPagination(data, PullOutHeader.transdate, PullOutHeader.id)
+        stream = StreamResponse(data)
 
         transdate  = ''
         whse_filt = []
@@ -215,7 +186,7 @@ def get_all_po(curr_user):
         po_filters = BaseQuery.create_query_filter(PullOutHeader, filters={"and": header_filt})
 
         if transdate:
-            po_filters.append((cast(PullOutHeader.transdate, DATE) == transdate))
+            po_filters.append((BaseQuery.on_date(PullOutHeader.transdate, transdate)))
 
         pullout = db.session.query(PullOutHeader).\
             select_from(PullOutHeader).\
@@ -223,8 +194,10 @@ def get_all_po(curr_user):
             join(Warehouses, Warehouses.whsecode == PullOutRow.whsecode).\
             filter(*whse_filters, *po_filters)
         po_schema = PullOutHeaderSchema(many=True, exclude=("row",))
-        result = po_schema.dump(pullout)
-        return ResponseMessage(True, count=len(result), data=result).resp()
+        if stream.enabled:
+            return stream.resp(page.stream(pullout), schema=po_schema, filename='pullout')
+        result = po_schema.dump(page.all(pullout))
+        return ResponseMessage(True, count=len(result), data=result, page=page).resp()
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
             return ResponseMessage(False, message=f"{err}").resp(), 500
     except Exception as err:
@@ -238,11 +211,11 @@ def get_all_po(curr_user):
 @token_required
 def get_po_details(curr_user, id):
     try:
-        pullout = PullOutHeader.query.get(id)
         po_schema = PullOutHeaderSchema(only=("id","series", "seriescode", "transnumber",
                                                 "objtype", "transdate", "reference", "remarks",
                                                 "docstatus", "sap_number", "created_by", "updated_by",
                                                 "date_created", "date_updated", "confirm", "row",))
+        pullout = PullOutHeader.query.for_dump(po_schema).get(id)
         result = po_schema.dump(pullout)
         return ResponseMessage(True, data=result).resp()
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
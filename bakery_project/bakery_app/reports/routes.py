@@ -1,10 +1,10 @@
 import pyodbc
 
 from flask import Blueprint, request, jsonify, json
-from sqlalchemy import and_, or_, case, cast, exc, DATE, func
+from sqlalchemy import and_, or_, case, exc, String, bindparam, func, text
 from bakery_app import db
 from bakery_app._helpers import BaseQuery
-from bakery_app._utils import ResponseMessage
+from bakery_app._utils import ResponseMessage, StreamResponse
 from bakery_app.users.routes import token_required
 from bakery_app.payment.models import PayTransHeader, CashTransaction, Deposit, PaymentType
 from bakery_app.sales.models import SalesHeader, SalesRow
@@ -22,31 +22,21 @@ from .reports_schema import CashTransSchema, SalesTransSchema, FinalInvCountSche
 reports = Blueprint('reports', __name__)
 
 
-# Cash Flow Report
-@reports.route('/api/report/cs')
-@token_required
-def cash_flow_report(curr_user):
-    try:
-        branch = curr_user.branch
-        from_date = request.args.get('from_date')
-        to_date = request.args.get('to_date')
-        cashier_id = request.args.get('cashier_id')
-        sales_type = request.args.get('sales_type')
-        payment_type = request.args.get('payment_type')
-        query_cash_trans = """
+# Cash flow report totals and rows, bound parameters so SQL Server reuses the plan
+CASH_FLOW_TOTALS = text("""
             Declare @branch varchar(100)
             Declare @cashier_id varchar(100)
-            Declare @from_date varchar(100)
-            Declare @to_date varchar(100)
+            Declare @from_date datetime
+            Declare @to_date datetime
             Declare @sales_type varchar(50)
             Declare @payment_type varchar(50)
             
-            SET @branch = '{}'
-            SET @from_date = '{}'
-            SET @to_date = '{}'
-            SET @cashier_id = '{}'
-            SET @sales_type = '{}'
-            SET @payment_type = '{}'
+            SET @branch = :branch
+            SET @from_date = CAST(:from_date AS DATE)
+            SET @to_date = CAST(:to_date AS DATE)
+            SET @cashier_id = :cashier_id
+            SET @sales_type = :sales_type
+            SET @payment_type = :payment_type
             
             
             
@@ -73,27 +63,29 @@ def cash_flow_report(curr_user):
             FROM tblcashtrans a1 LEFT JOIN
             tblpayment a2 on a1.trans_id = a2.id and a1.objtype = a2.objtype LEFT JOIN 
             tblsales a3 on a2.base_id = a3.id
-            WHERE (@from_date IS NULL OR CAST(a1.date_created as DATE) >= @from_date)
-                    AND (@to_date IS NULL OR CAST(a1.date_created as DATE) <= @to_date)
-                    AND (CAST(a1.created_by AS VARCHAR(MAX)) IN (SELECT a1.id FROM bakery_db.dbo.[tbluser] a1 
+            WHERE (@from_date IS NULL OR a1.date_created >= @from_date)
+                    AND (@to_date IS NULL OR a1.date_created < DATEADD(day, 1, @to_date))
+                    AND (a1.created_by IN (SELECT a1.id FROM tbluser a1 
                             WHERE (@branch = '' OR a1.branch = @branch)))
                     AND (@cashier_id = '' OR a1.created_by = @cashier_id)
                     AND (@sales_type = '' OR a3.transtype = @sales_type)
                     AND (@payment_type = '' OR a1.transtype = @payment_type)
-            """.format(branch, from_date, to_date, cashier_id, sales_type, payment_type)
+            """).bindparams(
+    *[bindparam(name, type_=String) for name in
+      ('branch', 'from_date', 'to_date', 'cashier_id', 'sales_type', 'payment_type')])
 
-        query_rows = """
+CASH_FLOW_ROWS = text("""
             Declare @branch varchar(100)
-            Declare @from_date varchar(100)
-            Declare @to_date varchar(100)
+            Declare @from_date datetime
+            Declare @to_date datetime
             Declare @sales_type varchar(50)
             Declare @payment_type varchar(50)
     
-            SET @branch = '{}'
-            SET @from_date = '{}'
-            SET @to_date = '{}'
-            SET @sales_type = '{}'
-            SET @payment_type = '{}'
+            SET @branch = :branch
+            SET @from_date = CAST(:from_date AS DATE)
+            SET @to_date = CAST(:to_date AS DATE)
+            SET @sales_type = :sales_type
+            SET @payment_type = :payment_type
    
             select a1.reference, CAST(a1.transdate as DATE)[transdate], a1.amount, 
                 CASE WHEN a1.objtype = 4 THEN '/api/payment/details/' + CAST(a2.id as varchar(30))
@@ -106,19 +98,41 @@ def cash_flow_report(curr_user):
                 tblsales a3 on a2.base_id = a3.id LEFT JOIN
                 tblpaymenttype a4 on a1.transtype = a4.code
             WHERE 
-                (@from_date IS NULL OR CAST(a1.date_created as DATE) >= @from_date)
-                AND (@to_date IS NULL OR CAST(a1.date_created as DATE) <= @to_date)
-                AND( (CAST(a3.created_by AS VARCHAR(MAX)) IN (SELECT a1.id FROM bakery_db.dbo.[tbluser] a1 
-                        WHERE (@branch IS NULL OR a1.branch = @branch)))
+                (@from_date IS NULL OR a1.date_created >= @from_date)
+                AND (@to_date IS NULL OR a1.date_created < DATEADD(day, 1, @to_date))
+                AND( (a3.created_by IN (SELECT a1.id FROM tbluser a1 
+                        WHERE (@branch = '' OR a1.branch = @branch)))
                 OR 
-                    (CAST(a1.created_by AS VARCHAR(MAX)) IN (SELECT a1.id FROM bakery_db.dbo.[tbluser] a1 
-                        WHERE (@branch IS NULL OR a1.branch = @branch))))
+                    (a1.created_by IN (SELECT a1.id FROM tbluser a1 
+                        WHERE (@branch = '' OR a1.branch = @branch))))
                 AND (@payment_type = '' OR a1.transtype = @payment_type)
                 AND (@sales_type = '' OR a3.transtype = @sales_type)
-        """.format(branch, from_date, to_date, sales_type, payment_type)
+        """).bindparams(
+    *[bindparam(name, type_=String) for name in
+      ('branch', 'from_date', 'to_date', 'sales_type', 'payment_type')])
 
-        exec_cash_trans = db.engine.execute(query_cash_trans)
-        exec_rows = db.engine.execute(query_rows)
+
+# Cash Flow Report
+@reports.route('/api/report/cs')
+@token_required
+def cash_flow_report(curr_user):
+    try:
+        branch = curr_user.branch
+        from_date = request.args.get('from_date')
+        to_date = request.args.get('to_date')
+        cashier_id = request.args.get('cashier_id')
+        sales_type = request.args.get('sales_type')
+        payment_type = request.args.get('payment_type')
+        # the text filters are skipped when empty, the dates when NULL
+        params = {'branch': branch or '', 'from_date': from_date or None, 'to_date': to_date or None,
+                  'cashier_id': cashier_id or '', 'sales_type': sales_type or '',
+                  'payment_type': payment_type or ''}
+        # streamed, only the rows of the report
+        stream = StreamResponse(request.args.to_dict())
+        if stream.enabled:
+            return stream.resp(lambda: db.session.execute(CASH_FLOW_ROWS, params), filename='cash_flow')
+        exec_cash_trans = db.session.execute(CASH_FLOW_TOTALS, params)
+        exec_rows = db.session.execute(CASH_FLOW_ROWS, params)
 
         result_cash_trans_dict = [dict(row) for row in exec_cash_trans]
         result_rows_dict = [dict(row) for row in exec_rows]
@@ -171,7 +185,7 @@ def sales_report(curr_user):
             func.sum(SalesHeader.disc_amount).label('disc_amount')
         ).outerjoin(User, SalesHeader.created_by == User.id
                     ).filter(
-            and_(func.cast(SalesHeader.transdate, DATE) == date,
+            and_(BaseQuery.on_date(SalesHeader.transdate, date),
                  SalesHeader.confirm,
                  SalesHeader.docstatus != 'N',
                  *sales_filters,
@@ -191,7 +205,7 @@ def sales_report(curr_user):
             User.username.label('user')
         ).outerjoin(User, SalesHeader.created_by == User.id
                     ).filter(
-            and_(func.cast(SalesHeader.transdate, DATE) == date,
+            and_(BaseQuery.on_date(SalesHeader.transdate, date),
                  SalesHeader.confirm,
                  SalesHeader.docstatus != 'N',
                  *sales_filters,
@@ -218,8 +232,9 @@ def sales_report(curr_user):
 def pullout_report(curr_user):
     try:
         date = request.args.get('date')
-        pull_out = PullOutHeader.query.filter(func.cast(PullOutHeader.transdate, DATE) == date).all()
         po_schema = PullOutHeaderSchema(many=True)
+        pull_out = PullOutHeader.query.filter(BaseQuery.on_date(PullOutHeader.transdate, date)).\
+            for_dump(po_schema).all()
         result = po_schema.dump(pull_out)
         return ResponseMessage(True, count=len(result), data=result).resp()
 
@@ -252,12 +267,12 @@ def final_count_report(curr_user):
                 filt.append(k, "==", v)
 
     try:
+        fc_schema = FinalCountSchema()
         final_count = FinalInvCount.query. \
-            filter(func.cast(FinalInvCount.transdate, DATE) == transdate,
-                    FinalInvCountRow.whsecode == curr_user.whse,).first()
+            filter(BaseQuery.on_date(FinalInvCount.transdate, transdate),
+                    FinalInvCountRow.whsecode == curr_user.whse,).for_dump(fc_schema).first()
         if not final_count:
             raise Exception("No final count transaction!")
-        fc_schema = FinalCountSchema()
         result = fc_schema.dump(final_count)
         return ResponseMessage(True, data=result).resp()
         
@@ -294,7 +309,7 @@ def final_report(curr_user):
                     sales_filt.append((k, "==", v))
 
         # check first there's a order need to confirm
-        pending_order = SalesHeader.query.filter(and_(cast(SalesHeader.transdate, DATE) == transdate,
+        pending_order = SalesHeader.query.filter(and_(BaseQuery.on_date(SalesHeader.transdate, transdate),
                                                         SalesHeader.confirm == False,
                                                         SalesHeader.docstatus != 'N')).first()
         if pending_order:
@@ -336,7 +351,7 @@ def final_report(curr_user):
             join(User, cash_trans.created_by == User.id). \
             outerjoin(pay_trans, pay_trans.id == cash_trans.trans_id). \
             outerjoin(sales_trans, pay_trans.base_id == sales_trans.id).\
-            filter(and_(cast(cash_trans.transdate, DATE) == transdate,
+            filter(and_(BaseQuery.on_date(cash_trans.transdate, transdate),
                         *user_filters
                         ))
 
@@ -376,7 +391,7 @@ def final_report(curr_user):
             func.sum(net_ar_agent_case).label('net_agent_sales'))\
                 .outerjoin(User, SalesHeader.created_by == User.id)\
                 .filter(and_(
-                        func.cast(SalesHeader.transdate, DATE) == transdate,
+                        BaseQuery.on_date(SalesHeader.transdate, transdate),
                         SalesHeader.confirm == True,
                         SalesHeader.docstatus != 'N',
                         *sales_filters,
@@ -401,7 +416,7 @@ def final_report(curr_user):
             outerjoin(Warehouses, fc_row.whsecode == Warehouses.whsecode). \
             outerjoin(PriceListRow, and_(PriceListRow.pricelist_id == Warehouses.pricelist,
                                         PriceListRow.item_code == fc_row.item_code)). \
-            filter(cast(fc_header.transdate, DATE) == transdate)
+            filter(BaseQuery.on_date(fc_header.transdate, transdate))
         
 
         # Payment Method Summary
@@ -419,7 +434,7 @@ def final_report(curr_user):
             outerjoin(pay_trans, pay_trans.id == cash_trans.trans_id). \
             outerjoin(sales_trans, pay_trans.base_id == sales_trans.id).\
             outerjoin(PaymentType, cash_trans.transtype == PaymentType.code). \
-            filter(and_(cast(cash_trans.transdate, DATE) == transdate,
+            filter(and_(BaseQuery.on_date(cash_trans.transdate, transdate),
                         *user_filters
                         )).\
             group_by(PaymentType.description)
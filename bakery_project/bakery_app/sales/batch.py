@@ -0,0 +1,91 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+
+from flask import current_app
+
+from bakery_app import db
+from bakery_app.branches.models import Warehouses
+from bakery_app.users.models import User, UserSnapshot
+from .models import SalesBatchDoc
+
+
+class SalesBatchWorker:
+    """Posts the staged documents of the offline sales batches in the background.
+
+    The batches are posted by a pool of threads, one batch per thread, each
+    document with the normal sales posting in its own transaction, oldest
+    transdate first, for the warehouse it was uploaded from. The sales access
+    of the user and the cutoff of that warehouse are checked when it is
+    posted. The staging table is the queue, manage.py
+    post_sales_batches drains what a stopped process left pending.
+    """
+
+    def __init__(self, post, workers=2):
+        # post(curr_user, data) -> dumped sales, flushed not committed
+        self.post = post
+        self.workers = max(workers, 1)
+        self._pool = None
+        self._lock = Lock()
+
+    def submit(self, batch_id):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='sales-batch')
+        return self._pool.submit(self._run, current_app._get_current_object(), batch_id)
+
+    def _run(self, app, batch_id):
+        with app.app_context():
+            try:
+                self.process(batch_id)
+            except Exception:
+                app.logger.exception(f"Sales batch {batch_id} stopped")
+            finally:
+                db.session.remove()
+
+    def process(self, batch_id=None, statuses=('P',)):
+        """Post the documents of the batch, or of every batch, with the statuses, return the number done"""
+        query = db.session.query(SalesBatchDoc.id).filter(SalesBatchDoc.status.in_(statuses))
+        if batch_id is not None:
+            query = query.filter(SalesBatchDoc.batch_id == batch_id)
+        ids = [doc_id for doc_id, in query.order_by(SalesBatchDoc.transdate, SalesBatchDoc.seq)]
+        db.session.commit()
+        return sum(self.post_document(doc_id, statuses) for doc_id in ids)
+
+    def _claim(self, doc_id, statuses):
+        # another worker may have taken it
+        table = SalesBatchDoc.__table__
+        result = db.session.execute(table.update().where(
+            db.and_(table.c.id == doc_id, table.c.status.in_(statuses))).values(status='R'))
+        db.session.commit()
+        return result.rowcount == 1
+
+    def post_document(self, doc_id, statuses=('P',)):
+        if not self._claim(doc_id, statuses):
+            return 0
+        doc = SalesBatchDoc.query.get(doc_id)
+        try:
+            user = User.query.get(doc.user_id)
+            # checked now, the user may have lost the sales access since the upload
+            if user is None or not user.is_active() or not user.is_sales():
+                raise Exception("Unauthorized user!")
+            # the warehouse of the upload, the user may have been moved since
+            if Warehouses.cutoff_of(doc.whsecode):
+                raise Exception("Your warehouse cutoff is enable!")
+            data = json.loads(doc.payload)
+            data['header']['transdate'] = doc.transdate
+            result = self.post(UserSnapshot(user).replace(whse=doc.whsecode), data)
+            # done in the same transaction as the sales, never posted twice
+            doc.status = 'D'
+            doc.sales_id = result['id']
+            doc.date_processed = datetime.now()
+            db.session.commit()
+        except Exception as err:
+            db.session.rollback()
+            doc = SalesBatchDoc.query.get(doc_id)
+            doc.status = 'E'
+            doc.message = f"{err}"[:250]
+            doc.date_processed = datetime.now()
+            db.session.commit()
+        return 1
@@ -1,8 +1,8 @@
 from datetime import datetime
-from sqlalchemy import event
 from bakery_app import db, ma
-from bakery_app.customers.models import Customer
-from bakery_app.inventory.models import InvTransaction, WhseInv
+from bakery_app._events import session_events
+from bakery_app.customers.models import BalancePosting
+from bakery_app.inventory.models import StockPosting
 from bakery_app._helpers import get_model_changes
 
 
@@ -16,7 +16,7 @@ class SalesHeader(db.Model):
     seriescode = db.Column(db.String(50), nullable=False)
     transnumber = db.Column(db.Integer, nullable=False)
     reference = db.Column(db.String(100))
-    transdate = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    transdate = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
     cust_code = db.Column(db.String(100), db.ForeignKey('tblcustomer.code',
                                                         ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
     cust_name = db.Column(db.String(100), nullable=False)
@@ -42,7 +42,7 @@ class SalesHeader(db.Model):
     void = db.Column(db.Boolean, nullable=True, default=False)
     created_by = db.Column(db.Integer, db.ForeignKey('tbluser.id'), nullable=False)
     updated_by = db.Column(db.Integer, db.ForeignKey('tbluser.id'), nullable=False)
-    date_created = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    date_created = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
     date_updated = db.Column(db.DateTime, nullable=False, default=datetime.now)
     confirm = db.Column(db.Boolean, default=False)
     date_confirm = db.Column(db.DateTime, default=datetime.now)
@@ -115,78 +115,73 @@ class DiscountedCustomer(db.Model):
     date_updated = db.Column(db.DateTime, nullable=False, default=datetime.now)
 
 
-# Sales Insert events
-@event.listens_for(db.session, "before_flush")
-def sales_insert_event(*args):
-    sess = args[0]
+class SalesBatchDoc(db.Model):
+    """A sales document of an offline batch, staged until the batch worker posts it"""
+    __tablename__ = "tblsalesbatch"
 
-    for obj in sess.new:
+    # P pending, R running, D done, E error
+    statuses = {'P': 'pending', 'R': 'running', 'D': 'posted', 'E': 'failed'}
 
-        if isinstance(obj, SalesRow):
-            sales = SalesHeader.query.get(obj.sales_id)
-            cust = Customer.query.filter_by(code=sales.cust_code).first()
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.String(36), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)  # position in the upload
+    user_id = db.Column(db.Integer, db.ForeignKey('tbluser.id'), nullable=False)
+    whsecode = db.Column(db.String(100), nullable=False)
+    transdate = db.Column(db.DateTime, nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # the /api/sales/new body
+    status = db.Column(db.String(1), nullable=False, default='P')
+    message = db.Column(db.String(250))
+    sales_id = db.Column(db.Integer)
+    date_created = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    date_processed = db.Column(db.DateTime)
 
-            cust.balance += sales.amount_due
+    __table_args__ = (db.Index('ix_tblsalesbatch_batch', 'batch_id', 'seq'),
+                      db.Index('ix_tblsalesbatch_status', 'status', 'transdate'))
 
-            # insert to InvTransaction all sales transaction
-            inv_trans = InvTransaction(trans_id=sales.id, trans_num=sales.transnumber,
-                                       objtype=sales.objtype, item_code=obj.item_code,
-                                       outqty=obj.quantity, uom=obj.uom,
-                                       warehouse=obj.whsecode, warehouse2=obj.whsecode,
-                                       transdate=sales.transdate, created_by=sales.created_by,
-                                       reference=sales.reference, reference2=sales.reference2,
-                                       remarks=sales.remarks, series_code=sales.seriescode,
-                                       updated_by=sales.updated_by)
 
-            # deduct the qty of whse inv
-            whseinv = WhseInv.query.filter_by(warehouse=obj.whsecode, item_code=obj.item_code).first()
-            whseinv.quantity -= obj.quantity
+# Sales Insert events
+@session_events.listens_for("before_flush", SalesRow)
+def sales_insert_event(sess, obj):
+    # the header is in the identity map, no query
+    sales = sess.query(SalesHeader).get(obj.sales_id)
 
-            db.session.add_all([inv_trans, whseinv, cust])
+    # the amount due once per document, not per row
+    BalancePosting.of(sess).add(sales.cust_code, sales.amount_due, document=(sales.objtype, sales.id))
 
-        else:
-            continue
+    # insert to InvTransaction all sales transaction
+    # and deduct the qty of whse inv
+    StockPosting.of(sess).add(obj.whsecode, obj.item_code, outqty=obj.quantity, check_stock=True,
+                              trans_id=sales.id, trans_num=sales.transnumber,
+                              objtype=sales.objtype, uom=obj.uom, warehouse2=obj.whsecode,
+                              transdate=sales.transdate, created_by=sales.created_by,
+                              reference=sales.reference, reference2=sales.reference2,
+                              remarks=sales.remarks, series_code=sales.seriescode,
+                              updated_by=sales.updated_by)
 
 
 # Sales Update events
-@event.listens_for(db.session, "before_flush")
-def sales_update_event(*args):
-    sess = args[0]
-
-    for obj in sess.dirty:
-
-        if isinstance(obj, SalesHeader):
-            # get the changes
-            changes = get_model_changes(obj)
-            for i in changes:
-                if i == 'void':
-                    if changes[i][1]:
-                        salesrow = SalesRow.query.filter(SalesRow.sales_id == obj.id).all()
-
-                        # Update Customer Balance
-                        cust = Customer.query.filter_by(code=obj.cust_code).first()
-                        cust.balance -= obj.amount_due
-
-                        # Loop all the items in salesrow if the header is void
-                        # And Insert to Inv_transaction the voided items
-                        for row in salesrow:
-                            # add to inventory transaction the void transaction
-                            inv_trans = InvTransaction(trans_id=obj.id, trans_num=obj.transnumber,
-                                                       objtype=obj.objtype, item_code=row.item_code,
-                                                       inqty=row.quantity, uom=row.uom,
-                                                       warehouse=row.whsecode, warehouse2=row.whsecode,
-                                                       transdate=obj.transdate, created_by=obj.created_by,
-                                                       reference=obj.reference, reference2=obj.reference2,
-                                                       remarks=obj.remarks, series_code=obj.seriescode,
-                                                       updated_by=obj.updated_by)
-
-                            # add back the void quantity
-                            whseinv = WhseInv.query.filter_by(warehouse=row.whsecode,
-                                                              item_code=row.item_code).first()
-                            whseinv.quantity += row.quantity
-
-                            # add to session
-                            db.session.add_all([inv_trans, whseinv, cust])
-
-        else:
-            continue
+@session_events.listens_for("before_flush", SalesHeader, state='dirty')
+def sales_update_event(sess, obj):
+    # get the changes
+    changes = get_model_changes(obj)
+    for i in changes:
+        if i == 'void':
+            if changes[i][1]:
+                posting = StockPosting.of(sess)
+                salesrow = SalesRow.query.filter(SalesRow.sales_id == obj.id).all()
+
+                # Update Customer Balance
+                BalancePosting.of(sess).add(obj.cust_code, -obj.amount_due)
+
+                # Loop all the items in salesrow if the header is void
+                # And Insert to Inv_transaction the voided items
+                for row in salesrow:
+                    # add to inventory transaction the void transaction
+                    # and add back the void quantity
+                    posting.add(row.whsecode, row.item_code, inqty=row.quantity,
+                                trans_id=obj.id, trans_num=obj.transnumber,
+                                objtype=obj.objtype, uom=row.uom, warehouse2=row.whsecode,
+                                transdate=obj.transdate, created_by=obj.created_by,
+                                reference=obj.reference, reference2=obj.reference2,
+                                remarks=obj.remarks, series_code=obj.seriescode,
+                                updated_by=obj.updated_by)
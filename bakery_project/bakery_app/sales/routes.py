@@ -1,135 +1,185 @@
 import json
+import uuid
 import pyodbc
 from datetime import datetime
-from sqlalchemy import exc, and_, or_, func, select, cast, DATE
+from sqlalchemy import exc, and_, or_, select
 from sqlalchemy.sql import label
 from flask import Blueprint, request, jsonify
 
 from bakery_app import db
-from bakery_app._helpers import BaseQuery
+from bakery_app._helpers import BaseQuery, KeysetPagination
 from bakery_app.customers.models import Customer
-from bakery_app.inventory.models import WhseInv
-from bakery_app.branches.models import Series, ObjectType, Warehouses
+from bakery_app.branches.models import Warehouses, series_allocator
 from bakery_app.users.routes import token_required, User
-from bakery_app._utils import Check, ResponseMessage
+from bakery_app._utils import DocumentCheck, ResponseMessage, StreamResponse
+from bakery_app._idempotency import idempotent
+from bakery_app._group_commit import GroupCommitQueue
+from bakery_app.config import Config
 
-from .models import (SalesHeader, SalesRow, SalesType, DiscountType)
+from .batch import SalesBatchWorker
+from .models import (SalesHeader, SalesRow, SalesType, DiscountType, SalesBatchDoc)
 from .sales_schema import (SalesHeaderSchema, SalesTypeSchema, DiscountTypeSchema, SalesRowSchema)
 
 sales = Blueprint('sales', __name__)
 
+# optional group commit of the new sales per warehouse
+sales_queue = GroupCommitQueue(max_batch=Config.SALES_GROUP_MAX, max_wait_ms=Config.SALES_GROUP_WAIT_MS,
+                               timeout=Config.SALES_GROUP_TIMEOUT, enabled=Config.SALES_GROUP_COMMIT)
+
+
+def post_sales(curr_user, data):
+    """Insert the sales of the request data and flush, return the dumped sales"""
+    details = data['rows']
+
+    # add to header dictionary
+    data['header']['created_by'] = curr_user.id
+    data['header']['updated_by'] = curr_user.id
+    if data['header']['transtype'].upper() == 'CASH':
+        cust = db.session.query(Customer). \
+            filter(and_(Customer.whse == curr_user.whse, Customer.code.contains('Cash'))).first()
+        data['header']['cust_code'] = cust.code
+        data['header']['cust_name'] = cust.name
+
+    if data['header']['transtype'].upper() == 'AGENT AR SALES':
+        cust = db.session.query(Customer). \
+            filter(and_(Customer.whse == curr_user.whse, Customer.code.contains('AR Sales'))).first()
+        data['header']['cust_code'] = cust.code
+        data['header']['cust_name'] = cust.name
+
+    # check if the header has discount and user is allowed to add discount
+    if data['header']['discprcnt'] and not curr_user.can_discount():
+        raise Exception("You're not allowed to add discount!")
+
+    if not Customer.query.filter_by(code=data['header']['cust_code']).first():
+        raise Exception("Invalid Customer Code")
+    
+    num = series_allocator.allocate(curr_user.whse, 'SLES')
+    sales = SalesHeader(**num._asdict(), **data['header'])
+
+    db.session.add(sales)
+    db.session.flush()
+
+    for row in details:
+        row['whsecode'] = curr_user.whse
+        row['sales_id'] = sales.id
+
+    # check if valid
+    error = DocumentCheck(details).first_error('itemcode', 'uom', 'whsecode')
+    if error:
+        raise Exception(error)
+
+    # check if the rows have discount and if user is allowed to add discount
+    if not curr_user.can_discount() and any(row['discprcnt'] for row in details):
+        raise Exception("You're not allowed to add sales with discount!")
+
+    # compute the rows and the header totals in one pass
+    rows = []
+    gross = row_discount = 0.0
+    for row in details:
+        if row['free']:
+            row['unit_price'] = 0
+        row['gross'] = row['unit_price'] * row['quantity']
+        row['disc_amount'] = row['gross'] * (row['discprcnt'] / 100) if row['discprcnt'] else 0.0
+        row['linetotal'] = row['gross'] - row['disc_amount']
+        gross += row['gross']
+        row_discount += row['disc_amount']
+        rows.append(SalesRow(**row))
+
+    db.session.add_all(rows)
+    sales.gross += float(gross)
+    sales.row_discount += row_discount
+
+    sales.disc_amount = sales.gross * (sales.discprcnt / 100) + sales.row_discount
+    sales.doctotal = sales.gross + sales.delfee - sales.disc_amount - sales.gc_amount
+    sales.amount_due = sales.doctotal
+
+    if sales.tenderamt > sales.amount_due:
+        sales.change = sales.tenderamt - sales.amount_due
+
+    db.session.flush()
+    sales_schema = SalesHeaderSchema()
+    return sales_schema.dump(sales)
+
+
+# posts the offline batches in the background
+sales_batches = SalesBatchWorker(post_sales, workers=Config.SALES_BATCH_WORKERS)
+
 
 # Create New Sales
 @sales.route('/api/sales/new', methods=['POST'])
 @token_required
+@idempotent
 def new_sales(curr_user):
     # check if user sales is true
     if not curr_user.is_sales():
         return ResponseMessage(False, message="Unauthorized user!").resp(), 401
 
     # query the whse and check if cutoff is enable
-    whse = Warehouses.query.filter_by(whsecode=curr_user.whse).first()
-    if whse.is_cutoff():
+    if Warehouses.cutoff_of(curr_user.whse):
         return ResponseMessage(False, message="Your warehouse cutoff is enable!").resp(), 401
 
     # get the json data from request body
     data = request.get_json()
 
-    # get the all details from data key rows
-    details = data['rows']
-
     # check if has transdate and convert to datetime object
     if data['header']['transdate']:
         data['header']['transdate'] = datetime.strptime(data['header']['transdate'], '%Y/%m/%d %H:%M')
 
-    # add to header dictionary
-    data['header']['created_by'] = curr_user.id
-    data['header']['updated_by'] = curr_user.id
     try:
-        obj = ObjectType.query.filter_by(code='SLES').first()
-        if not obj:
-            raise Exception("Invalid object type!")
-        series = Series.query.filter_by(whsecode=curr_user.whse, objtype=obj.objtype).first()
-        if not series:
-            raise Exception("Invalid series!")
-
-        if data['header']['transtype'].upper() == 'CASH':
-            cust = db.session.query(Customer). \
-                filter(and_(Customer.whse == curr_user.whse, Customer.code.contains('Cash'))).first()
-            data['header']['cust_code'] = cust.code
-            data['header']['cust_name'] = cust.name
-
-        if data['header']['transtype'].upper() == 'AGENT AR SALES':
-            cust = db.session.query(Customer). \
-                filter(and_(Customer.whse == curr_user.whse, Customer.code.contains('AR Sales'))).first()
-            data['header']['cust_code'] = cust.code
-            data['header']['cust_name'] = cust.name
-
-        # check if the header has discount and user is allowed to add discount
-        if data['header']['discprcnt'] and not curr_user.can_discount():
-            raise Exception("You're not allowed to add discount!")
-
-        if not Customer.query.filter_by(code=data['header']['cust_code']).first():
-            raise Exception("Invalid Customer Code")
-        
-        # add 1 to series
-        series.next_num += 1
-
-        sales = SalesHeader(**data['header'])
-        sales.seriescode = series.code
-        sales.transnumber = series.next_num
-        sales.reference = f"{series.code}-{obj.code}-{series.next_num}"
-        sales.objtype = obj.objtype
-        
-        db.session.add_all([series, sales])
-        db.session.flush()
-
-        for row in details:
-            row['whsecode'] = curr_user.whse
-            row['sales_id'] = sales.id
-            check = Check(**row)
-            if not check.itemcode_exist():
-                raise Exception("Invalid item code!")
-            elif not check.uom_exist():
-                raise Exception("Invalid uom!")
-            elif not check.whsecode_exist():
-                raise Exception("Invalid whsecode!")
-
-            # check if the row has discount and if user is allowed to add discount
-            if row['discprcnt'] and not curr_user.can_discount():
-                raise Exception("You're not allowed to add sales with discount!")
-
-            # query the inventory of warehouse
-            whseinv = WhseInv.query.filter_by(item_code=row['item_code'], warehouse=row['whsecode']).first()
-            # check the quantity
-            if row['quantity'] > whseinv.quantity:
-                raise Exception(f"{row['item_code'].title()} below qty!")
-
-            if row['free']:
-                row['unit_price'] = 0
-            # add to row the computation
-            row['gross'] = row['unit_price'] * row['quantity']
-            row['disc_amount'] = row['gross'] * (row['discprcnt']/100 if row['discprcnt'] else 0 / 100)
-            row['linetotal'] = row['gross'] - row['disc_amount']
-
-            s_r = SalesRow(**row)
-
-            sales.gross += float(s_r.gross)
-            sales.row_discount += s_r.disc_amount
-
-            db.session.add(s_r)
-
-        sales.disc_amount = sales.gross * (sales.discprcnt / 100) + sales.row_discount
-        sales.doctotal = sales.gross + sales.delfee - sales.disc_amount - sales.gc_amount
-        sales.amount_due = sales.doctotal
-
-        if sales.tenderamt > sales.amount_due:
-            sales.change = sales.tenderamt - sales.amount_due
+        if sales_queue.enabled:
+            # no connection held while waiting, the writer takes one from the same pool
+            db.session.close()
+            # committed with the other sales of the warehouse
+            result = sales_queue.submit(curr_user.whse, post_sales, curr_user, data)
+        else:
+            result = post_sales(curr_user, data)
+            db.session.commit()
+        return ResponseMessage(True, message="Successfully added!", data=result).resp()
+    except (pyodbc.IntegrityError, exc.IntegrityError) as err:
+        db.session.rollback()
+        return ResponseMessage(False, message=f"{err}").resp(), 500
+    except Exception as err:
+        db.session.rollback()
+        return ResponseMessage(False, message=f"{err}").resp(), 500
+    finally:
+        db.session.close()
+
+
+# Upload a batch of offline sales, posted in the background
+@sales.route('/api/sales/batch', methods=['POST'])
+@token_required
+@idempotent
+def new_sales_batch(curr_user):
+    if not curr_user.is_sales():
+        return ResponseMessage(False, message="Unauthorized user!").resp(), 401
+
+    if Warehouses.cutoff_of(curr_user.whse):
+        return ResponseMessage(False, message="Your warehouse cutoff is enable!").resp(), 401
 
+    # a list of /api/sales/new bodies
+    documents = request.get_json()['sales']
+    if not documents:
+        return ResponseMessage(False, message="No sales to post!").resp(), 400
+    if len(documents) > Config.SALES_BATCH_MAX:
+        return ResponseMessage(False, message=f"At most {Config.SALES_BATCH_MAX} sales per batch!").resp(), 400
+
+    try:
+        batch_id = uuid.uuid4().hex
+        now = datetime.now()
+        rows = []
+        for seq, doc in enumerate(documents, 1):
+            transdate = doc['header'].get('transdate')
+            rows.append({'batch_id': batch_id, 'seq': seq, 'user_id': curr_user.id,
+                         'whsecode': curr_user.whse, 'status': 'P', 'date_created': now,
+                         'transdate': datetime.strptime(transdate, '%Y/%m/%d %H:%M') if transdate else now,
+                         'payload': json.dumps(doc)})
+
+        # staged with one insert, nothing is posted yet
+        db.session.execute(SalesBatchDoc.__table__.insert(), rows)
         db.session.commit()
-        sales_schema = SalesHeaderSchema()
-        result = sales_schema.dump(sales)
-        return ResponseMessage(True, message="Successfully added!", data=result).resp()
+        sales_batches.submit(batch_id)
+        return ResponseMessage(True, message="Batch accepted!", count=len(rows),
+                               data={'batch_id': batch_id}).resp(), 202
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
         db.session.rollback()
         return ResponseMessage(False, message=f"{err}").resp(), 500
@@ -140,12 +190,41 @@ def new_sales(curr_user):
         db.session.close()
 
 
+# Progress of an offline sales batch
+@sales.route('/api/sales/batch/<batch_id>')
+@token_required
+def sales_batch_status(curr_user, batch_id):
+    try:
+        docs = db.session.query(SalesBatchDoc.seq, SalesBatchDoc.user_id, SalesBatchDoc.status,
+                                SalesBatchDoc.sales_id, SalesBatchDoc.message). \
+            filter(SalesBatchDoc.batch_id == batch_id).order_by(SalesBatchDoc.seq).all()
+        if not docs:
+            raise Exception("Invalid batch id!")
+        if docs[0].user_id != curr_user.id and not curr_user.is_admin():
+            return ResponseMessage(False, message="Unauthorized user!").resp(), 401
+
+        counts = dict.fromkeys(SalesBatchDoc.statuses.values(), 0)
+        documents = []
+        for doc in docs:
+            status = SalesBatchDoc.statuses[doc.status]
+            counts[status] += 1
+            documents.append({'seq': doc.seq, 'status': status, 'sales_id': doc.sales_id,
+                              'message': doc.message})
+        result = {'batch_id': batch_id, 'total': len(docs), **counts,
+                  'done': not counts['pending'] and not counts['running'], 'documents': documents}
+        return ResponseMessage(True, data=result).resp()
+    except Exception as err:
+        return ResponseMessage(False, message=f"{err}").resp(), 500
+
+
 # Get all sales
 @sales.route('/api/sales/get_all')
 @token_required
 def get_all_sales(curr_user):
     try:
         data = request.args.to_dict()
+        page = KeysetPagination(data, SalesHeader.transdate, SalesHeader.id)
+        stream = StreamResponse(data)
         transdate = ''
         header_filt = []
         row_filt = []
@@ -177,7 +256,7 @@ def get_all_sales(curr_user):
                     join(SalesRow, SalesRow.sales_id == SalesHeader.id). \
                     outerjoin(User, User.id == SalesHeader.created_by). \
                     filter(and_(
-                        cast(SalesHeader.transdate, DATE) == transdate,
+                        BaseQuery.on_date(SalesHeader.transdate, transdate),
                         *header_filter,
                         *row_filter,
                         *user_filter
@@ -194,8 +273,10 @@ def get_all_sales(curr_user):
                     ))
             
         sales_schema = SalesHeaderSchema(many=True, exclude=("date_created", "date_updated", "created_by", "updated_by", "salesrow"))
-        result = sales_schema.dump(query)
-        return ResponseMessage(True, count=len(result), data=result).resp()
+        if stream.enabled:
+            return stream.resp(page.stream(query, schema=sales_schema), schema=sales_schema, filename='sales')
+        result = sales_schema.dump(page.all(query, schema=sales_schema))
+        return ResponseMessage(True, count=len(result), data=result, page=page).resp()
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
         return ResponseMessage(False, message=f"{err}").resp(), 500
     except Exception as err:
@@ -207,8 +288,8 @@ def get_all_sales(curr_user):
 @token_required
 def get_sales_details(curr_user, id):
     try:
-        sales = SalesHeader.query.get(id)
         sales_schema = SalesHeaderSchema()
+        sales = SalesHeader.query.for_dump(sales_schema).get(id)
         result = sales_schema.dump(sales)
         return ResponseMessage(True, data=result).resp()
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
@@ -226,8 +307,7 @@ def sales_void(curr_user):
         return ResponseMessage(False, message="Unauthorized user!").resp(), 401
 
     # query the whse and check if cutoff is enable
-    whse = Warehouses.query.filter_by(whsecode=curr_user.whse).first()
-    if whse.is_cutoff():
+    if Warehouses.cutoff_of(curr_user.whse):
         return ResponseMessage(False, message="Your warehouse cutoff is enable!").resp(), 401
 
     try:
@@ -292,25 +372,26 @@ def ar_for_confirm(curr_user):
         sales_filter = BaseQuery.create_query_filter(
             SalesHeader, filters={'and': filt})
 
+        sales_schema = SalesHeaderSchema(many=True, only=("id", "docstatus", "seriescode",
+                                                            "transnumber", "reference", "transdate", "cust_code",
+                                                            "cust_name", "objtype", "remarks", "transtype", "delfee",
+                                                            "disctype", "discprcnt", "disc_amount", "gross",
+                                                            "gc_amount", "doctotal", "reference2", "tenderamt",
+                                                            "sap_number", "appliedamt", "amount_due", "void", "created_user", "confirm"))
+
         if date_created:
             sales = db.session.query(SalesHeader).join(SalesRow). \
                 join(Warehouses, Warehouses.whsecode == SalesRow.whsecode).filter(and_(Warehouses.branch == curr_user.branch,
-                            func.cast(SalesHeader.date_created, DATE) == date_created,
+                            BaseQuery.on_date(SalesHeader.date_created, date_created),
                             and_(SalesHeader.confirm != True, SalesHeader.transtype !='CASH'),
-                            *sales_filter)).all()
+                            *sales_filter)).for_dump(sales_schema).all()
         else:
             sales = db.session.query(SalesHeader).join(SalesRow). \
                 join(Warehouses, Warehouses.whsecode == SalesRow.whsecode)\
                     .filter(and_(Warehouses.branch == curr_user.branch,
                             and_(SalesHeader.confirm != True, SalesHeader.transtype !='CASH'),
-                            *sales_filter)).all()
+                            *sales_filter)).for_dump(sales_schema).all()
 
-        sales_schema = SalesHeaderSchema(many=True, only=("id", "docstatus", "seriescode",
-                                                            "transnumber", "reference", "transdate", "cust_code",
-                                                            "cust_name", "objtype", "remarks", "transtype", "delfee",
-                                                            "disctype", "discprcnt", "disc_amount", "gross",
-                                                            "gc_amount", "doctotal", "reference2", "tenderamt",
-                                                            "sap_number", "appliedamt", "amount_due", "void", "created_user", "confirm"))
         result = sales_schema.dump(sales)
         return ResponseMessage(True, count=len(result), data=result).resp()
     
@@ -1,3 +1,5 @@
+from sqlalchemy.orm import joinedload, selectinload
+
 from bakery_app import ma
 from bakery_app.users.models import UserSchema
 from .models import SalesHeader, SalesRow, SalesType, DiscountType
@@ -32,6 +34,8 @@ class SalesHeaderSchema(ma.SQLAlchemyAutoSchema):
     salesrow = ma.Nested(SalesRowSchema, many=True)
     created_user = ma.Nested(UserSchema, only=("username",))
 
+    relationship_loaders = {'salesrow': selectinload, 'created_user': joinedload}
+
     cashsales = ma.Number()
     arsales = ma.Number()
     agentsales = ma.Number()
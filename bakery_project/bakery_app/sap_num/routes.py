@@ -2,7 +2,7 @@ from datetime import datetime
 
 import pyodbc
 from flask import Blueprint, request, json
-from sqlalchemy import exc, and_, func, DATE, cast
+from sqlalchemy import exc, and_
 from bakery_app import db
 from bakery_app._utils import ResponseMessage
 from bakery_app.users.routes import token_required
@@ -48,7 +48,7 @@ def sales_update_sap(curr_user):
 
         sales_filt = BaseQuery.create_query_filter(SalesHeader, filters={'and': filt})
         sales = db.session.query(SalesHeader).filter(and_(
-                func.cast(SalesHeader.date_created, DATE) == date,
+                BaseQuery.on_date(SalesHeader.date_created, date),
                 SalesHeader.confirm == True,
                 SalesHeader.sap_number == None,
                 SalesHeader.docstatus != 'N',
@@ -147,7 +147,7 @@ def update_payment_sap_num(curr_user):
                 join(SalesHeader, SalesHeader.id == PayTransHeader.base_id). \
                 outerjoin(User, User.id == SalesHeader.created_by). \
                 filter(and_(
-                    cast(PayTransHeader.transdate, DATE) == transdate,
+                    BaseQuery.on_date(PayTransHeader.transdate, transdate),
                     *sales_filter,
                     *payment_filter,
                     *user_filter,
@@ -1,8 +1,11 @@
+import time
 from datetime import datetime
 from itsdangerous import (TimedJSONWebSignatureSerializer as Serializer,
                           BadSignature, SignatureExpired)
 from flask import current_app
-from bakery_app import db, ma, login_manager, bcrypt
+from bakery_app import db, ma, login_manager, bcrypt, cache
+from bakery_app.config import Config
+from bakery_app._cache import LRUCache
 from flask_login import UserMixin
 
 
@@ -11,46 +14,14 @@ def load_user(user_id):
     return User.query.get(int(user_id))
 
 
-class User(db.Model, UserMixin):
-    __tablename__ = "tbluser"
-
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(100), nullable=False, unique=True)
-    fullname = db.Column(db.String(100), nullable=False)
-    password = db.Column(db.String(200), nullable=False)
-    date_created = db.Column(db.DateTime, nullable=False, default=datetime.now)
-    date_updated = db.Column(db.DateTime, default=datetime.now)
-    branch = db.Column(db.String(50))  # branch code
-    whse = db.Column(db.String(100))  # whsecode
-    isAdmin = db.Column(db.Boolean, default=False)
-    isManager = db.Column(db.Boolean, default=False)
-    isAuditor = db.Column(db.Boolean, default=False)
-    isSales = db.Column(db.Boolean, default=False)
-    isCashier = db.Column(db.Boolean, default=False)
-    isChecker = db.Column(db.Boolean, default=False)
-    isCanAddSap = db.Column(db.Boolean, default=False)
-    isTransfer = db.Column(db.Boolean, default=False)
-    isReceive = db.Column(db.Boolean, default=False)
-    isVoid = db.Column(db.Boolean, default=False)
-    isDiscount = db.Column(db.Boolean, default=False)
-    isAllowEnding = db.Column(db.Boolean, default=False)
-    isAllowPullOut = db.Column(db.Boolean, default=False)
-    isARSales = db.Column(db.Boolean, default=False)
-    isCashSales = db.Column(db.Boolean, default=False)
-    isAgentSales = db.Column(db.Boolean, default=False)
-    isAccounting = db.Column(db.Boolean, default=False)
-    isActive = db.Column(db.Boolean, default=True)
+PERMISSION_FLAGS = ('isAdmin', 'isManager', 'isAuditor', 'isSales', 'isCashier', 'isChecker',
+                    'isCanAddSap', 'isTransfer', 'isReceive', 'isVoid', 'isDiscount', 'isAllowEnding',
+                    'isAllowPullOut', 'isARSales', 'isCashSales', 'isAgentSales', 'isAccounting',
+                    'isActive')
 
-    def hash_password(self, password):
-        self.password = bcrypt.generate_password_hash(password).decode('utf-8')
 
-    def verify_password(self, password):
-        return bcrypt.check_password_hash(self.password, password)
-
-    def generate_auth_token(self, expires_sec=172800):
-        # 2days token expiration
-        s = Serializer(current_app.config['SECRET_KEY'], expires_sec)
-        return s.dumps({'user_id': self.id}).decode('utf-8')
+class UserPermissionMixin:
+    """Permission checks shared by the User model and its cached snapshot"""
 
     def is_admin(self):
         return self.isAdmin
@@ -103,6 +74,59 @@ class User(db.Model, UserMixin):
     def is_accounting(self):
         return self.isAccounting
 
+
+class User(db.Model, UserMixin, UserPermissionMixin):
+    __tablename__ = "tbluser"
+
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(100), nullable=False, unique=True)
+    fullname = db.Column(db.String(100), nullable=False)
+    password = db.Column(db.String(200), nullable=False)
+    date_created = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    date_updated = db.Column(db.DateTime, default=datetime.now)
+    branch = db.Column(db.String(50))  # branch code
+    whse = db.Column(db.String(100))  # whsecode
+    isAdmin = db.Column(db.Boolean, default=False)
+    isManager = db.Column(db.Boolean, default=False)
+    isAuditor = db.Column(db.Boolean, default=False)
+    isSales = db.Column(db.Boolean, default=False)
+    isCashier = db.Column(db.Boolean, default=False)
+    isChecker = db.Column(db.Boolean, default=False)
+    isCanAddSap = db.Column(db.Boolean, default=False)
+    isTransfer = db.Column(db.Boolean, default=False)
+    isReceive = db.Column(db.Boolean, default=False)
+    isVoid = db.Column(db.Boolean, default=False)
+    isDiscount = db.Column(db.Boolean, default=False)
+    isAllowEnding = db.Column(db.Boolean, default=False)
+    isAllowPullOut = db.Column(db.Boolean, default=False)
+    isARSales = db.Column(db.Boolean, default=False)
+    isCashSales = db.Column(db.Boolean, default=False)
+    isAgentSales = db.Column(db.Boolean, default=False)
+    isAccounting = db.Column(db.Boolean, default=False)
+    isActive = db.Column(db.Boolean, default=True)
+    perm_version = db.Column(db.Integer, nullable=False, default=1)  # bumped to revoke issued tokens
+
+    def hash_password(self, password):
+        self.password = bcrypt.generate_password_hash(password).decode('utf-8')
+
+    def verify_password(self, password):
+        return bcrypt.check_password_hash(self.password, password)
+
+    def capabilities(self):
+        # permission flags packed as a bitmap in PERMISSION_FLAGS order
+        return sum(1 << i for i, flag in enumerate(PERMISSION_FLAGS) if getattr(self, flag))
+
+    def bump_perm_version(self):
+        self.perm_version = (self.perm_version or 0) + 1
+
+    def generate_auth_token(self, expires_sec=172800):
+        # 2days token expiration
+        s = Serializer(current_app.config['SECRET_KEY'], expires_sec)
+        claims = {'user_id': self.id, 'username': self.username, 'fullname': self.fullname,
+                  'whse': self.whse, 'branch': self.branch, 'caps': self.capabilities(),
+                  'pv': self.perm_version}
+        return s.dumps(claims).decode('utf-8')
+
     def is_active(self):
         return self.isActive
 
@@ -121,6 +145,119 @@ class User(db.Model, UserMixin):
         return f"User('{self.username}', '{self.fullname}')"
 
 
+class UserSnapshot(UserPermissionMixin):
+    """Read-only copy of the user fields that token_required hands to the routes.
+
+    Safe to share across requests and threads because it is not bound to a session.
+    """
+    __slots__ = ('id', 'username', 'fullname', 'branch', 'whse', 'perm_version') + PERMISSION_FLAGS
+
+    def __init__(self, user):
+        for attr in self.__slots__:
+            object.__setattr__(self, attr, getattr(user, attr))
+
+    @classmethod
+    def from_claims(cls, claims):
+        """Build the snapshot from the claims of a signed token, without a query"""
+        snap = cls.__new__(cls)
+        values = {'id': claims['user_id'], 'username': claims['username'],
+                  'fullname': claims['fullname'], 'branch': claims['branch'],
+                  'whse': claims['whse'], 'perm_version': claims['pv']}
+        for i, flag in enumerate(PERMISSION_FLAGS):
+            values[flag] = bool(claims['caps'] & (1 << i))
+        for attr, value in values.items():
+            object.__setattr__(snap, attr, value)
+        return snap
+
+    def replace(self, **values):
+        """Return a copy of the snapshot with the values changed"""
+        snap = self.__class__.__new__(self.__class__)
+        for attr in self.__slots__:
+            object.__setattr__(snap, attr, values.get(attr, getattr(self, attr)))
+        return snap
+
+    def __setattr__(self, key, value):
+        raise AttributeError("User snapshot is read-only.")
+
+    def is_active(self):
+        return self.isActive
+
+    def __repr__(self):
+        return f"UserSnapshot('{self.username}', '{self.fullname}')"
+
+
+# verified token -> UserSnapshot, per process
+token_cache = LRUCache(maxsize=Config.TOKEN_CACHE_SIZE, ttl=Config.TOKEN_CACHE_TTL)
+
+
+def _perm_version_key(user_id):
+    return f"perm_version:{user_id}"
+
+
+def get_perm_version(user_id):
+    """Current permission version of the user, 0 if the user no longer exists"""
+    version = cache.get(_perm_version_key(user_id))
+    if version is None:
+        version = db.session.query(User.perm_version).filter_by(id=user_id).scalar() or 0
+        cache.set(_perm_version_key(user_id), version,
+                  timeout=current_app.config['PERM_VERSION_CACHE_TIMEOUT'])
+    return version
+
+
+def set_perm_version(user_id, version):
+    cache.set(_perm_version_key(user_id), version,
+              timeout=current_app.config['PERM_VERSION_CACHE_TIMEOUT'])
+
+
+def get_token_user(token):
+    """Return the UserSnapshot of a valid token, verifying and caching it on a miss.
+
+    Tokens carrying claims are authorized from the token alone, the only lookup is
+    the permission version which is served from the cache.
+    """
+    snap = token_cache.get(token)
+    if snap is None:
+        snap = _load_token_user(token)
+        if snap is None:
+            return None
+    # token issued before the last permission change
+    if snap.perm_version != get_perm_version(snap.id):
+        token_cache.pop(token)
+        return None
+    return snap
+
+
+def _load_token_user(token):
+    s = Serializer(current_app.config['SECRET_KEY'])
+    try:
+        data, header = s.loads(token, return_header=True)
+    except SignatureExpired:
+        return None
+    except BadSignature:
+        return None
+
+    if 'caps' in data:
+        snap = UserSnapshot.from_claims(data)
+    else:
+        # token issued before the claims were added
+        user = User.query.get(data['user_id'])
+        if not user:
+            return None
+        snap = UserSnapshot(user)
+    # never keep a token cached past its own expiration
+    ttl = header['exp'] - time.time()
+    if token_cache.ttl:
+        ttl = min(ttl, token_cache.ttl)
+    if ttl > 0:
+        token_cache.set(token, snap, ttl=ttl)
+    return snap
+
+
+def invalidate_user_tokens(user_id):
+    """Drop every cached token that belongs to the user"""
+    return token_cache.discard_where(lambda snap: snap.id == user_id)
+
+
 class UserSchema(ma.SQLAlchemyAutoSchema):
     class Meta:
         model = User
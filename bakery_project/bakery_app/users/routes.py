@@ -7,11 +7,13 @@ from flask_login import current_user, login_user
 from sqlalchemy import exc
 
 from bakery_app import auth, db
-from bakery_app._helpers import BaseQuery
+from bakery_app._cache import master_data
+from bakery_app._helpers import BaseQuery, KeysetPagination
 from bakery_app.branches.models import Branch, Warehouses
-from bakery_app._utils import Check, ResponseMessage
+from bakery_app._utils import Check, ResponseMessage, StreamResponse
 
-from .models import User, UserSchema
+from .models import (User, UserSchema, UserSnapshot, get_token_user,
+                     invalidate_user_tokens, set_perm_version, token_cache)
 
 users = Blueprint('users', __name__)
 
@@ -21,8 +23,8 @@ def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         if current_user.is_authenticated:
-            # allow user through
-            curr_user = User.query.filter_by(id=current_user.id).first()
+            # allow user through, current_user is already loaded by the user_loader
+            curr_user = UserSnapshot(current_user._get_current_object())
             return f(curr_user, *args, **kwargs)
         try:
             auth_header = request.headers['Authorization']  # grab the auth header
@@ -35,10 +37,11 @@ def token_required(f):
             return jsonify({"success": False, 'message': 'Token is missing'}), 401
 
         try:
-            user = User.verify_auth_token(token)
-            curr_user = User.query.filter_by(id=user.id).first()
+            curr_user = get_token_user(token)
         except:
             return jsonify({"success": False, 'message': 'Token is invalid'}), 401
+        if not curr_user:
+            return jsonify({"success": False, 'message': 'Token is invalid'}), 401
         return f(curr_user, *args, **kwargs)
 
     return decorated
@@ -59,7 +62,7 @@ def new_user(curr_user):
 
     if User.query.filter_by(username=data['username']).first() is not None:
         return ResponseMessage(False, message="User is already exist!").resp(), 401
-    if not Warehouses.query.filter_by(whsecode=data['whse']).first():
+    if not master_data.get(Warehouses, data['whse']):
         return ResponseMessage(False, message="Invalid warehouse!").resp(), 401
 
     try:
@@ -117,6 +120,8 @@ def get_all_users(curr_user):
     filt = []
 
     data = request.args.to_dict()
+    page = KeysetPagination(data, User.fullname, User.id, desc=False)
+    stream = StreamResponse(data)
 
     for k, v in data.items():
         if k == 'search':
@@ -133,11 +138,13 @@ def get_all_users(curr_user):
         
         user_filter = BaseQuery.create_query_filter(User, filters={'and': filt})
         user = db.session.query(User).filter(*user_filter). \
-            order_by(User.fullname.asc()).all()
+            order_by(User.fullname.asc())
 
         user_schema = UserSchema(many=True, only=("id", "username", "fullname",))
-        result = user_schema.dump(user)
-        return ResponseMessage(True, count=len(result), data=result).resp()
+        if stream.enabled:
+            return stream.resp(page.stream(user, unique=False), schema=user_schema, filename='users')
+        result = user_schema.dump(page.all(user, unique=False))
+        return ResponseMessage(True, count=len(result), data=result, page=page).resp()
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
         return ResponseMessage(False, message=f"{err}").resp(), 500
     except Exception as err:
@@ -178,17 +185,21 @@ def update_user(curr_user, id):
 
         for k, v in data.items():
             if k == 'branch':
-                if not Branch.query.filter_by(code=v).first():
+                if not master_data.get(Branch, v):
                     raise Exception("Invalid branch code!")
             if k == 'whse':
-                if not Warehouses.query.filter_by(whsecode=v).first():
+                if not master_data.get(Warehouses, v):
                     raise Exception("Invalid warehouse code!")
             if k == 'password':
                 user.hash_password(v)
             else:
                 setattr(user, k, v)
 
+        # revoke the tokens issued with the old permissions
+        user.bump_perm_version()
         db.session.commit()
+        set_perm_version(user.id, user.perm_version)
+        invalidate_user_tokens(user.id)
         user_schema = UserSchema(exclude=("password", "date_created",))
         result = user_schema.dump(user)
         return ResponseMessage(True, message="User data successfully updated!", data=result).resp()
@@ -214,8 +225,11 @@ def change_pass(curr_user):
         return ResponseMessage(False, message="Missing required field!").resp(), 401
 
     u.hash_password(data['password'])
+    u.bump_perm_version()
     try:
         db.session.commit()
+        set_perm_version(u.id, u.perm_version)
+        invalidate_user_tokens(u.id)
         return ResponseMessage(True, message="Password successfully updated!").resp()
     except (pyodbc.IntegrityError, exc.IntegrityError) as err:
         db.session.rollback()
@@ -243,6 +257,8 @@ def delete_branch(curr_user, id):
 
         db.session.delete(u)
         db.session.commit()
+        set_perm_version(id, 0)
+        invalidate_user_tokens(id)
         user_schema = UserSchema()
         result = user_schema.dump(u)
         response = ResponseMessage(True, message=f"Successfully deleted!", data=result)
@@ -255,3 +271,13 @@ def delete_branch(curr_user, id):
         return ResponseMessage(False, message=f"{err}").resp(), 500
     finally:
         db.session.close()
+
+
+# Token Cache Hit/Miss Counters
+@users.route('/api/auth/token_cache/stats')
+@token_required
+def token_cache_stats(curr_user):
+    if not curr_user.is_admin():
+        return ResponseMessage(False, message="Unauthorized user!").resp(), 401
+
+    return ResponseMessage(True, data=token_cache.stats()).resp()
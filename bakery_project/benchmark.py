@@ -0,0 +1,537 @@
+"""Benchmarks of the database heavy paths.
+
+They run against a scratch database, BENCH_DATABASE_URI or an in memory
+sqlite database, which is dropped and created again for every measure.
+report_plans only reads, it needs a SQL Server copy of the application data.
+
+    python benchmark.py whse_seeding -s 1000,5000,20000
+    python benchmark.py report_plans -w BENCH -n 50
+    python benchmark.py json_encoding -n 5000
+    python benchmark.py dump_queries -s 5,50
+    python benchmark.py sales_posting -l 1,10,50,200
+    python benchmark.py sales_throughput -t 8 -n 50
+    python benchmark.py batch_replay -n 200
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from flask_script import Manager
+from sqlalchemy import event
+
+from bakery_app import create_app, db
+from bakery_app._helpers import json_backends
+from bakery_app.config import Config
+from bakery_app.users.models import User
+from bakery_app.branches.models import Branch, Warehouses, ObjectType, Series, series_allocator
+from bakery_app.customers.models import Customer
+from bakery_app.items.models import Items, ItemGroup, UnitOfMeasure
+from bakery_app.inventory.models import WhseInv, TransferHeader, TransferRow, ReceiveHeader, ReceiveRow
+from bakery_app.item_request.models import ItemRequest, ItemRequestRow
+from bakery_app.payment.models import PayTransHeader, PayTransRow
+from bakery_app.pullout.models import PullOutHeader, PullOutRow
+from bakery_app.inventory_count.routes import FINAL_COUNT
+from bakery_app.reports.routes import CASH_FLOW_TOTALS, CASH_FLOW_ROWS
+from bakery_app.sales.models import SalesHeader, SalesRow, SalesType, SalesBatchDoc
+from bakery_app.sales.routes import sales_batches, sales_queue
+from bakery_app.sales.sales_schema import SalesHeaderSchema
+
+
+class BenchConfig(Config):
+    # never the application database, every measure drops all the tables
+    SQLALCHEMY_DATABASE_URI = os.environ.get('BENCH_DATABASE_URI', 'sqlite://')
+    SECRET_KEY = Config.SECRET_KEY or 'benchmark'
+
+
+app = create_app(BenchConfig)
+manager = Manager(app)
+
+
+def reset_database():
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+
+
+def load_master_data(items):
+    """Insert a user, a branch and a catalog of items, return the user id"""
+    user_id = db.session.execute(User.__table__.insert().values(
+        username='bench', fullname='Benchmark', password='-')).inserted_primary_key[0]
+    audit = {'created_by': user_id, 'updated_by': user_id}
+    db.session.execute(Branch.__table__.insert().values(code='BENCH', name='Benchmark', **audit))
+    db.session.execute(ItemGroup.__table__.insert().values(code='BENCH', description='Benchmark', **audit))
+    db.session.execute(UnitOfMeasure.__table__.insert().values(code='PC', description='Piece', **audit))
+    db.session.execute(Items.__table__.insert(), [
+        dict(item_code=f"ITEM{i:06}", item_name=f"Item {i}", item_group='BENCH', uom='PC', **audit)
+        for i in range(items)])
+    db.session.commit()
+    return user_id
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def create_warehouse(whsecode, user_id):
+    whse = Warehouses(whsecode=whsecode, whsename=whsecode, branch='BENCH',
+                      created_by=user_id, updated_by=user_id)
+    db.session.add(whse)
+    db.session.commit()
+
+
+def create_warehouse_orm(whsecode, user_id):
+    # the previous seeding, one WhseInv object per item
+    db.session.execute(Warehouses.__table__.insert().values(
+        whsecode=whsecode, whsename=whsecode, branch='BENCH', created_by=user_id, updated_by=user_id))
+    for item in Items.query.all():
+        db.session.add(WhseInv(item_code=item.item_code, warehouse=whsecode,
+                               created_by=user_id, updated_by=user_id))
+    db.session.commit()
+
+
+@manager.option('-s', '--sizes', dest='sizes', default='100,1000,5000,10000',
+                help="Comma separated catalog sizes")
+@manager.option('-r', '--repeat', dest='repeat', type=int, default=3)
+def whse_seeding(sizes, repeat):
+    """Time to create a warehouse and its WhseInv rows against the catalog size"""
+    print(f"{'items':>8} {'insert select ms':>18} {'orm objects ms':>16}")
+    for size in map(int, sizes.split(',')):
+        set_based = []
+        orm = []
+        for _ in range(repeat):
+            reset_database()
+            user_id = load_master_data(size)
+            set_based.append(timed(create_warehouse, 'BENCH', user_id))
+            orm.append(timed(create_warehouse_orm, 'BENCH-ORM', user_id))
+            assert WhseInv.query.filter_by(warehouse='BENCH').count() == size
+        print(f"{size:>8} {min(set_based):>18.1f} {min(orm):>16.1f}")
+
+
+def sql_compilations():
+    # cumulative since the server started despite the name, for the whole instance
+    return db.session.execute(
+        "SELECT cntr_value FROM sys.dm_os_performance_counters "
+        "WHERE RTRIM(counter_name) = 'SQL Compilations/sec'").scalar()
+
+
+def run_bound(stmt, params):
+    db.session.execute(stmt, params).fetchall()
+
+
+def run_literal(stmt, params):
+    # the values inlined in the batch, like the previous str.format reports
+    sql = str(stmt.bindparams(**params).compile(
+        dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    db.session.connection().execute(sql).fetchall()
+
+
+def report_params(whse, branch):
+    return {
+        'cash_flow_totals': (CASH_FLOW_TOTALS, lambda day: {
+            'branch': branch, 'from_date': str(day), 'to_date': str(day),
+            'cashier_id': '', 'sales_type': '', 'payment_type': ''}),
+        'cash_flow_rows': (CASH_FLOW_ROWS, lambda day: {
+            'branch': branch, 'from_date': str(day), 'to_date': str(day),
+            'sales_type': '', 'payment_type': ''}),
+        'final_count': (FINAL_COUNT, lambda day: {'date': str(day), 'whse': whse}),
+    }
+
+
+@manager.option('-w', '--whse', dest='whse', required=True)
+@manager.option('-b', '--branch', dest='branch', default='')
+@manager.option('-d', '--date', dest='last_date', default=None, help="Last report date, YYYY-MM-DD")
+@manager.option('-n', '--runs', dest='runs', type=int, default=20,
+                help="Runs per report, one date back for each run")
+def report_plans(whse, branch, last_date, runs):
+    """Plan compilations and latency of the raw reports, inlined values against bound parameters"""
+    if db.engine.dialect.name != 'mssql':
+        print("report_plans needs BENCH_DATABASE_URI on SQL Server.")
+        return
+    last_date = datetime.strptime(last_date, '%Y-%m-%d').date() if last_date else date.today()
+    days = [last_date - timedelta(days=i) for i in range(runs)]
+
+    print(f"{'report':<18} {'mode':<8} {'compiles':>9} {'avg ms':>9} {'max ms':>9}")
+    for name, (stmt, params_for) in report_params(whse, branch).items():
+        for mode, run in (('literal', run_literal), ('bound', run_bound)):
+            db.session.remove()
+            # warm the connection, the first batch of a connection compiles the session setup
+            db.session.execute("SELECT 1")
+            before = sql_compilations()
+            timings = [timed(run, stmt, params_for(day)) for day in days]
+            # the counter query itself is compiled once too
+            compiles = sql_compilations() - before
+            print(f"{name:<18} {mode:<8} {compiles:>9} "
+                  f"{sum(timings) / len(timings):>9.1f} {max(timings):>9.1f}")
+    db.session.remove()
+
+
+class fakefloat(float):
+    # the previous Decimal encoding, kept here for the comparison
+    def __init__(self, value):
+        self._value = value
+
+    def __repr__(self):
+        return str(self._value)
+
+
+class LegacyJSONEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, Decimal):
+            return fakefloat(o)
+        if isinstance(o, (date, datetime)):
+            return o.isoformat()
+        raise TypeError(repr(o) + " is not JSON serializable")
+
+
+def legacy_dumps(obj, sort_keys=True):
+    # what jsonify did with CustomJSONEncoder
+    return json.dumps(obj, cls=LegacyJSONEncoder, sort_keys=sort_keys, separators=(',', ':')).encode()
+
+
+def sales_payload(count):
+    """The /api/sales/get_all payload of count in memory sales"""
+    user = User(username='bench', fullname='Benchmark')
+    now = datetime.now()
+    sales = [SalesHeader(id=i, seriescode='SLES', transnumber=i, reference=f"SLES-{i}", transdate=now,
+                         cust_code='C1', cust_name='Customer', objtype=3, transtype='CASH', delfee=0.0,
+                         discprcnt=0.0, disc_amount=0.0, gross=125.5, gc_amount=0.0, doctotal=125.5,
+                         tenderamt=200.0, appliedamt=125.5, change=74.5, amount_due=0.0, row_discount=0.0,
+                         void=False, confirm=False, date_confirm=now, created_user=user)
+               for i in range(count)]
+    schema = SalesHeaderSchema(many=True, exclude=("date_created", "date_updated", "created_by",
+                                                   "updated_by", "salesrow"))
+    return {'success': True, 'message': None, 'count': count, 'data': schema.dump(sales)}
+
+
+def report_payload(count):
+    """A raw report payload, the SUM columns come back as Decimal"""
+    now = datetime.now()
+    rows = [{'item_code': f"ITEM{i:06}", 'transdate': now, 'quantity': Decimal('12.50'),
+             'amount': Decimal('1520.75'), 'price': Decimal('121.66')} for i in range(count)]
+    return {'success': True, 'message': None, 'count': count, 'data': rows}
+
+
+@manager.option('-n', '--rows', dest='rows', type=int, default=5000)
+@manager.option('-r', '--repeat', dest='repeat', type=int, default=5)
+def json_encoding(rows, repeat):
+    """Encoding time of a sales list and a report payload, previous encoder against the backends"""
+    encoders = dict(legacy=legacy_dumps, **json_backends)
+    payloads = {'sales list': sales_payload(rows), 'report': report_payload(rows)}
+    print(f"{'payload':<12} {'encoder':<8} {'best ms':>9} {'kb':>9}")
+    for name, payload in payloads.items():
+        expected = json.loads(legacy_dumps(payload))
+        for encoder, dumps in encoders.items():
+            # same document as before, whatever the backend
+            assert json.loads(dumps(payload)) == expected
+            best = min(timed(dumps, payload) for _ in range(repeat))
+            print(f"{name:<12} {encoder:<8} {best:>9.1f} {len(dumps(payload)) / 1024:>9.1f}")
+
+
+def dummy_row(_table, **values):
+    """Values for the required columns of the table without a default"""
+    row = {}
+    for col in _table.columns:
+        if col.name in values or col.primary_key or col.nullable \
+                or col.default is not None or col.server_default is not None:
+            continue
+        python_type = col.type.python_type
+        if python_type is str:
+            row[col.name] = 'BENCH'[:col.type.length or 5]
+        elif python_type is datetime:
+            row[col.name] = datetime.now()
+        elif python_type is date:
+            row[col.name] = date.today()
+        else:
+            row[col.name] = python_type(0)
+    row.update(values)
+    return row
+
+
+def insert(model, **values):
+    return db.session.execute(
+        model.__table__.insert().values(**dummy_row(model.__table__, **values))).inserted_primary_key[0]
+
+
+def load_documents(count, rows=3):
+    """Insert count documents of each kind with their rows, each created by another user"""
+    user_id = load_master_data(rows)
+    insert(Warehouses, whsecode='BENCH', whsename='Benchmark', branch='BENCH')
+    db.session.execute(User.__table__.update().where(User.id == user_id).values(
+        whse='BENCH', branch='BENCH', isAdmin=True, isReceive=True))
+    now = datetime.now()
+    for i in range(count):
+        creator = insert(User, username=f"bench{i}", fullname=f"Benchmark {i}", branch='BENCH', whse='BENCH')
+        audit = {'created_by': creator, 'updated_by': creator}
+        documents = [(TransferHeader, TransferRow, 'transfer_id', {'docstatus': 'O'}, {'to_whse': 'BENCH'}),
+                     (ReceiveHeader, ReceiveRow, 'receive_id', {}, {}),
+                     (SalesHeader, SalesRow, 'sales_id', {}, {'whsecode': 'BENCH'}),
+                     (PullOutHeader, PullOutRow, 'pullout_id', {}, {'whsecode': 'BENCH'}),
+                     (ItemRequest, ItemRequestRow, 'request_id', {}, {}),
+                     (PayTransHeader, PayTransRow, 'payment_id', {}, {})]
+        for header, row, fk, header_values, row_values in documents:
+            header_id = insert(header, transdate=now, **header_values, **audit)
+            for r in range(rows):
+                values = dict(item_code=f"ITEM{r:06}", **{fk: header_id}, **row_values, **audit)
+                # e.g. the sales rows have no audit columns, the payment rows no item
+                insert(row, **{name: value for name, value in values.items() if name in row.__table__.c})
+    db.session.commit()
+    return User.query.get(user_id).generate_auth_token()
+
+
+@manager.option('-s', '--sizes', dest='sizes', default='5,50', help="Comma separated document counts")
+def dump_queries(sizes):
+    """Queries run by the endpoints dumping nested rows, must not grow with the documents.
+
+    A check more than a measure, it exits with an error when a count grows.
+    """
+    endpoints = [('transfer for receive', '/api/inv/trfr/forrec'),
+                 ('transfer list', '/api/inv/trfr/getall'),
+                 ('transfer details', '/api/inv/trfr/getdetails/1'),
+                 ('receive list', '/api/inv/recv/get_all'),
+                 ('receive details', '/api/inv/recv/details/1'),
+                 ('sales list', '/api/sales/get_all'),
+                 ('sales details', '/api/sales/details/1'),
+                 ('pullout report', f"/api/report/pullout?date={date.today()}"),
+                 ('pullout list', '/api/pullout/get_all'),
+                 ('pullout details', '/api/pullout/details/1'),
+                 ('item request list', '/api/inv/item_request/get_all'),
+                 ('item request details', '/api/inv/item_request/details/1'),
+                 ('payment details', '/api/payment/details/1')]
+    sizes = [int(size) for size in sizes.split(',')]
+    counts = {name: [] for name, _ in endpoints}
+    statements = []
+
+    def count(*args):
+        statements.append(1)
+
+    client = app.test_client()
+    for size in sizes:
+        reset_database()
+        headers = {'Authorization': f"Bearer {load_documents(size)}"}
+        # token and master data caches warmed outside of the counts
+        client.get(endpoints[0][1], headers=headers)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            for name, url in endpoints:
+                statements.clear()
+                response = client.get(url, headers=headers)
+                result = response.get_json()
+                assert result['success'], f"{name}: {result['message']}"
+                if isinstance(result['data'], list):
+                    # a constant count of an empty list proves nothing
+                    assert len(result['data']) == size, f"{name}: {len(result['data'])} of {size} documents"
+                counts[name].append(len(statements))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+    print(f"{'endpoint':<22} " + ' '.join(f"{f'{size} docs':>9}" for size in sizes))
+    growing = []
+    for name, per_size in counts.items():
+        print(f"{name:<22} " + ' '.join(f"{n:>9}" for n in per_size))
+        if len(set(per_size)) > 1:
+            growing.append(name)
+    if growing:
+        raise SystemExit(f"Queries grow with the documents: {', '.join(growing)}")
+
+
+def load_sales_setup(items):
+    """A sales user with a stocked warehouse, its SLES series and an AR customer"""
+    user_id = load_master_data(items)
+    create_warehouse('BENCH', user_id)
+    db.session.execute(WhseInv.__table__.update().values(quantity=10 ** 9))
+    db.session.execute(User.__table__.update().where(User.id == user_id).values(
+        whse='BENCH', branch='BENCH', isSales=True))
+    insert(ObjectType, code='SLES', objtype=3, description='Sales', table='tblsales', created_by=user_id)
+    insert(Series, code='SLES', name='Sales', whsecode='BENCH', objtype=3,
+           start_num=1, next_num=1, end_num=10 ** 9, created_by=user_id)
+    insert(SalesType, code='AR Sales', description='AR Sales', created_by=user_id, updated_by=user_id)
+    insert(Customer, code='BENCH-AR', name='Benchmark AR', whse='BENCH', balance=0.0)
+    db.session.commit()
+    return User.query.get(user_id).generate_auth_token()
+
+
+def sales_document(lines):
+    header = {'transdate': datetime.now().strftime('%Y/%m/%d %H:%M'), 'transtype': 'AR Sales',
+              'cust_code': 'BENCH-AR', 'cust_name': 'Benchmark AR', 'discprcnt': 0, 'delfee': 0,
+              'gc_amount': 0, 'tenderamt': 0, 'remarks': 'benchmark'}
+    rows = [{'item_code': f"ITEM{i:06}", 'quantity': 2, 'uom': 'PC', 'unit_price': 12.5,
+             'discprcnt': 0, 'free': False} for i in range(lines)]
+    return {'header': header, 'rows': rows}
+
+
+def customer_balance():
+    db.session.remove()
+    return Customer.query.filter_by(code='BENCH-AR').first().balance
+
+
+@manager.option('-l', '--lines', dest='lines', default='1,10,50,200', help="Comma separated lines per sale")
+@manager.option('-r', '--repeat', dest='repeat', type=int, default=5)
+def sales_posting(lines, repeat):
+    """Posting time and statements of /api/sales/new against the lines of the sale"""
+    lines = [int(n) for n in lines.split(',')]
+    statements = []
+
+    def count(*args):
+        statements.append(1)
+
+    reset_database()
+    headers = {'Authorization': f"Bearer {load_sales_setup(max(lines))}"}
+    client = app.test_client()
+    print(f"{'lines':>6} {'best ms':>9} {'avg ms':>9} {'statements':>11}")
+    for n in lines:
+        timings = []
+        for _ in range(repeat):
+            balance = customer_balance()
+            statements.clear()
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                start = time.perf_counter()
+                response = client.post('/api/sales/new', json=sales_document(n), headers=headers)
+                timings.append((time.perf_counter() - start) * 1000)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+            result = response.get_json()
+            assert result['success'], result['message']
+            # the amount due is added to the balance once, whatever the lines
+            assert abs(customer_balance() - balance - result['data']['amount_due']) < 0.005
+        print(f"{n:>6} {min(timings):>9.1f} {sum(timings) / len(timings):>9.1f} {len(statements):>11}")
+
+
+@contextmanager
+def sqlite_immediate(engine):
+    """Transactions of a sqlite file taking the write lock when they begin.
+
+    Concurrent writers then wait for each other, a deferred transaction
+    asking for the write lock late fails with "database is locked" instead.
+    """
+    def autocommit_driver(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    def begin_immediate(connection):
+        connection.execute('BEGIN IMMEDIATE')
+
+    event.listen(engine, 'connect', autocommit_driver)
+    event.listen(engine, 'begin', begin_immediate)
+    engine.dispose()
+    try:
+        yield
+    finally:
+        event.remove(engine, 'connect', autocommit_driver)
+        event.remove(engine, 'begin', begin_immediate)
+        engine.dispose()
+
+
+@manager.option('-t', '--terminals', dest='terminals', type=int, default=8)
+@manager.option('-n', '--sales', dest='count', type=int, default=50, help="Sales per terminal")
+@manager.option('-l', '--lines', dest='lines', type=int, default=10)
+def sales_throughput(terminals, count, lines):
+    """Sales per second of concurrent terminals of one warehouse, one commit each against group commit"""
+    if db.engine.dialect.name == 'sqlite' and db.engine.url.database in (None, '', ':memory:'):
+        print("sales_throughput needs BENCH_DATABASE_URI on a server database or a sqlite file, "
+              "the threads would share the single connection of the in memory database.")
+        return
+    sqlite = db.engine.dialect.name == 'sqlite'
+    if sqlite:
+        # a block is reserved on its own connection, it would wait on the database
+        # lock of the request taking it, one block is reserved before the run
+        series_allocator.block_size = terminals * count + 1
+
+    def terminal(headers):
+        client = app.test_client()
+        latencies = []
+        for _ in range(count):
+            start = time.perf_counter()
+            result = client.post('/api/sales/new', json=sales_document(lines), headers=headers).get_json()
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert result['success'], result['message']
+        return latencies
+
+    print(f"{'mode':<8} {'sales/s':>9} {'avg ms':>9} {'max ms':>9}")
+    for mode in ('direct', 'group'):
+        reset_database()
+        headers = {'Authorization': f"Bearer {load_sales_setup(lines)}"}
+        # the blocks of the dropped database
+        series_allocator.release()
+        if sqlite:
+            series_allocator.allocate('BENCH', 'SLES')
+        # no transaction of this thread left holding the database
+        db.session.remove()
+        sales_queue.enabled = mode == 'group'
+        with sqlite_immediate(db.engine) if sqlite else nullcontext():
+            start = time.perf_counter()
+            with ThreadPoolExecutor(terminals) as pool:
+                latencies = [ms for result in pool.map(terminal, [headers] * terminals) for ms in result]
+            elapsed = time.perf_counter() - start
+        balance = customer_balance()
+        # every sale added to the balance once
+        expected = db.session.query(db.func.sum(SalesHeader.amount_due)).scalar()
+        assert abs(balance - expected) < 0.005 * terminals * count
+        print(f"{mode:<8} {len(latencies) / elapsed:>9.1f} "
+              f"{sum(latencies) / len(latencies):>9.1f} {max(latencies):>9.1f}")
+    sales_queue.enabled = Config.SALES_GROUP_COMMIT
+
+
+@manager.option('-n', '--sales', dest='count', type=int, default=200)
+def batch_replay(count):
+    """An offline batch retried with the same Idempotency-Key is staged once and answers the same batch_id.
+
+    Then every document is posted once, for the warehouse it was uploaded from.
+    """
+    reset_database()
+    headers = {'Authorization': f"Bearer {load_sales_setup(3)}", 'Idempotency-Key': 'bench-batch-1'}
+    body = {'sales': [sales_document(3) for _ in range(count)]}
+    client = app.test_client()
+
+    first = client.post('/api/sales/batch', json=body, headers=headers)
+    retry = client.post('/api/sales/batch', json=body, headers=headers)
+    assert first.status_code == retry.status_code == 202, (first.status_code, retry.status_code)
+    assert retry.headers.get('Idempotent-Replayed') == 'true'
+    assert first.get_json()['data']['batch_id'] == retry.get_json()['data']['batch_id']
+    db.session.remove()
+    staged = db.session.query(db.func.count(db.distinct(SalesBatchDoc.batch_id)),
+                              db.func.count(SalesBatchDoc.id)).one()
+    assert tuple(staged) == (1, count), staged
+    print(f"Batch {first.get_json()['data']['batch_id']} staged once, {count} sales, retry replayed.")
+
+    # posted in the background, each document once
+    batch_id = first.get_json()['data']['batch_id']
+    status_url = f"/api/sales/batch/{batch_id}"
+    deadline = time.monotonic() + 60
+    while not client.get(status_url, headers=headers).get_json()['data']['done']:
+        assert time.monotonic() < deadline, "Batch not posted within 60s"
+        time.sleep(0.1)
+    status = client.get(status_url, headers=headers).get_json()['data']
+    assert status['posted'] == count, status
+    db.session.remove()
+    assert SalesHeader.query.count() == count
+
+    # posted for the warehouse of the upload, with the gates checked at posting
+    user = User.query.filter_by(username='bench').first()
+    user_id = user.id
+    db.session.execute(User.__table__.update().where(User.id == user_id).values(whse='MOVED'))
+    db.session.execute(SalesBatchDoc.__table__.insert(), [
+        {'batch_id': f"{name}-check", 'seq': 1, 'user_id': user_id, 'whsecode': 'BENCH', 'status': 'P',
+         'transdate': datetime.now(), 'date_created': datetime.now(), 'payload': json.dumps(sales_document(3))}
+        for name in ('moved', 'cutoff')])
+    db.session.commit()
+    sales_batches.process('moved-check')
+    moved = SalesBatchDoc.query.filter_by(batch_id='moved-check').one()
+    assert moved.status == 'D', moved.message
+    assert SalesHeader.query.get(moved.sales_id).salesrow[0].whsecode == 'BENCH'
+    db.session.execute(Warehouses.__table__.update().where(Warehouses.whsecode == 'BENCH').values(cutoff=True))
+    db.session.commit()
+    sales_batches.process('cutoff-check')
+    cutoff = SalesBatchDoc.query.filter_by(batch_id='cutoff-check').one()
+    assert cutoff.status == 'E' and 'cutoff' in cutoff.message, (cutoff.status, cutoff.message)
+    print(f"{count} sales posted in the background, a moved user posts for the upload warehouse, "
+          f"a cut off warehouse fails the document.")
+
+
+if __name__ == '__main__':
+    manager.run()
@@ -1,5 +1,14 @@
+from datetime import date, datetime, timedelta
+
 from bakery_app import create_app
 from bakery_app import db
+from bakery_app.config import Config
+from bakery_app._cache import master_data
+from bakery_app._idempotency import IdempotencyKey
+from bakery_app.branches.models import Warehouses
+from bakery_app.customers.models import Customer, CustomerBalanceDelta
+from bakery_app.sales.routes import sales_batches
+from bakery_app.inventory.models import WhseInv, InvTransaction, InvMovementDaily, WhseInvSnapshot
 from flask_script import Manager, Server
 from flask_migrate import Migrate, MigrateCommand
 
@@ -9,5 +18,161 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 manager.add_command("runserver", Server())
 
+
+@manager.option('-c', '--chunk', dest='chunk', type=int, default=5000)
+@manager.option('-n', '--dry-run', dest='dry_run', action='store_true', default=False)
+def prune_whseinv(chunk, dry_run):
+    """Delete the zero WhseInv rows that never had a stock movement (WHSEINV_SPARSE only)"""
+    if not Config.WHSEINV_SPARSE:
+        print("WHSEINV_SPARSE is disabled, the postings need every WhseInv row.")
+        return
+
+    whseinv = WhseInv.__table__
+    trans = InvTransaction.__table__
+    moved = db.exists().where(db.and_(trans.c.warehouse == whseinv.c.warehouse,
+                                      trans.c.item_code == whseinv.c.item_code))
+    unused = db.and_(whseinv.c.quantity == 0, ~moved)
+
+    if dry_run:
+        count = db.session.execute(
+            db.select([db.func.count()]).select_from(whseinv).where(unused)).scalar()
+        print(f"{count} WhseInv rows to delete.")
+        return
+
+    deleted = 0
+    while True:
+        # small transactions, the postings keep running meanwhile
+        ids = [row.id for row in db.session.execute(db.select([whseinv.c.id]).where(unused).limit(chunk))]
+        if not ids:
+            break
+        result = db.session.execute(whseinv.delete().where(db.and_(whseinv.c.id.in_(ids), unused)))
+        db.session.commit()
+        deleted += result.rowcount
+        print(f"{deleted} WhseInv rows deleted...")
+    print(f"Done, {deleted} WhseInv rows deleted.")
+
+
+
+@manager.option('-d', '--date', dest='day', default=None, help="Snapshot date YYYY-MM-DD, default yesterday")
+@manager.option('-f', '--from', dest='from_date', default=None, help="Rebuild the snapshots from this date")
+@manager.option('-t', '--to', dest='to_date', default=None, help="Rebuild the snapshots up to this date")
+@manager.option('-w', '--whse', dest='whse', default=None, help="Only this warehouse")
+def snapshot_whseinv(day, from_date, to_date, whse):
+    """Write the closing WhseInv balances of a day, run nightly, or rebuild a date range"""
+    def parse(value):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+    yesterday = date.today() - timedelta(days=1)
+    if from_date:
+        start, end = parse(from_date), parse(to_date) if to_date else yesterday
+    else:
+        start = end = parse(day) if day else yesterday
+    if end > yesterday:
+        print("Only the closed days can be snapshot, up to yesterday.")
+        return
+
+    whsecodes = [whse] if whse else [w.whsecode for w in db.session.query(Warehouses.whsecode)]
+    # oldest first, each day starts from the snapshot of the day before
+    while start <= end:
+        rows = WhseInvSnapshot.take(start, whsecodes)
+        db.session.commit()
+        print(f"{start} {rows} balances")
+        start += timedelta(days=1)
+
+
+
+@manager.option('-f', '--from', dest='from_date', default=None, help="From date YYYY-MM-DD, default the first posting")
+@manager.option('-t', '--to', dest='to_date', default=None, help="To date YYYY-MM-DD, default today")
+def rollup_whsmovement(from_date, to_date):
+    """Rebuild the daily movement rollup from the ledger, before snapshot_whseinv of the same days"""
+    if from_date:
+        start = datetime.strptime(from_date, '%Y-%m-%d').date()
+    else:
+        first = db.session.query(db.func.min(InvTransaction.transdate)).scalar()
+        if not first:
+            print("No posting yet.")
+            return
+        start = first.date()
+    end = datetime.strptime(to_date, '%Y-%m-%d').date() if to_date else date.today()
+
+    # a month per transaction
+    while start <= end:
+        until = min(start + timedelta(days=30), end)
+        rows = InvMovementDaily.rebuild(start, until)
+        db.session.commit()
+        print(f"{start} - {until} {rows} rows")
+        start = until + timedelta(days=1)
+
+
+@manager.option('-c', '--code', dest='codes', default=None, help="Comma separated customer codes")
+@manager.option('-w', '--walk-in', dest='walk_in', action='store_true', default=False,
+                help="The Cash and AR Sales customers of every warehouse")
+@manager.option('--off', dest='off', action='store_true', default=False)
+def defer_balance(codes, walk_in, off):
+    """Keep the balance changes of the customers in CustomerBalanceDelta, or stop with --off"""
+    filters = []
+    if codes:
+        filters.append(Customer.code.in_(codes.split(',')))
+    if walk_in:
+        filters.append(db.or_(Customer.code.contains('Cash'), Customer.code.contains('AR Sales')))
+    if not filters:
+        print("Nothing to change, give the codes or --walk-in.")
+        return
+
+    cust = Customer.__table__
+    result = db.session.execute(cust.update().where(db.or_(*filters)).values(deferred_balance=not off))
+    db.session.commit()
+    # the postings read the flag from the master data cache, the bump reaches
+    # the workers through the shared cache backend. Without one master_data is
+    # disabled and they read it from the database on their next posting.
+    master_data.bump(Customer)
+    print(f"{result.rowcount} customers {'updated directly' if off else 'deferred'}.")
+    if off:
+        # the deltas already appended still have to be folded
+        fold_balances(5000)
+
+
+@manager.option('-c', '--chunk', dest='chunk', type=int, default=5000)
+def fold_balances(chunk):
+    """Add the pending CustomerBalanceDelta rows to Customer.balance, run every few minutes"""
+    folded = 0
+    while True:
+        # short transactions, the customer rows are locked only by the update
+        try:
+            rows = CustomerBalanceDelta.fold(db.session, limit=chunk)
+            db.session.commit()
+        except Exception as err:
+            db.session.rollback()
+            print(f"{err}")
+            break
+        if not rows:
+            break
+        folded += rows
+    print(f"{folded} balance deltas folded.")
+
+
+@manager.option('-c', '--chunk', dest='chunk', type=int, default=5000)
+def purge_idempotency_keys(chunk):
+    """Delete the expired Idempotency-Key responses, run daily"""
+    deleted = 0
+    while True:
+        rows = IdempotencyKey.purge(limit=chunk)
+        if not rows:
+            break
+        deleted += rows
+    print(f"{deleted} idempotency keys deleted.")
+
+
+@manager.option('-b', '--batch', dest='batch_id', default=None, help="Only this batch")
+@manager.option('-r', '--running', dest='running', action='store_true', default=False,
+                help="Also the documents left running by a stopped process")
+def post_sales_batches(batch_id, running):
+    """Post the pending documents of the offline sales batches"""
+    statuses = ('P', 'R') if running else ('P',)
+    posted = sales_batches.process(batch_id, statuses=statuses)
+    db.session.remove()
+    print(f"{posted} batch documents processed.")
+
+
 if __name__ == '__main__':
     manager.run()